@@ -1,14 +1,32 @@
 import os
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask_socketio import SocketIO, emit
-import paramiko
 import requests
+import json
 import time
-import base64
+import shlex
+import socket
 import sys
 import webbrowser
 import threading
-from parse_share_link import FeiNiuShareParser
+import logging
+import signal
+import subprocess
+import importlib.util
+from ssh_stream import (get_select, get_blocking_call, get_event_factory, get_semaphore_factory, wait_channel_readable,
+                        read_output_frame, channel_finished, FRAME_MAX_BYTES)
+from ssh_log import get_logger, get_dropped_count, SAMPLED
+from ssh_pool import SSHTransportPool
+from ssh_escalation import SudoEscalation
+from ssh_sessions import SessionManager, SSHSession, SessionLimitError
+from session_registry import create_registry, SessionRelay
+from ssh_exec import run_command, RemoteOperation, MAX_SESSION_OPERATIONS
+from ssh_fanout import FanoutJob, FanoutTarget, MAX_TARGETS, RUNNING
+from download_cache import DownloadCache
+from download_jobs import DownloadJob, parse_url_list, resolve_downloads, build_download_command, build_extract_command
+from download_relay import DEFAULT_UPLOAD_LIMIT, RelayCache, DownloadBatch
+from share_cache import share_cache
+from parse_share_link import sign_methods
 
 # 处理打包后的路径
 if getattr(sys, 'frozen', False):
@@ -22,7 +40,55 @@ else:
     app = Flask(__name__)
 
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-socketio = SocketIO(app, cors_allowed_origins="*")
+
+
+def resolve_socketio_serializer(name: str) -> str:
+    """校验Socket.IO序列化方式，msgpack需要安装msgpack包，否则回退到默认"""
+    if name == 'msgpack':
+        try:
+            import msgpack  # noqa: F401
+        except ImportError:
+            print("未安装msgpack，Socket.IO回退到默认序列化方式")
+            return 'default'
+        return 'msgpack'
+    return 'default'
+
+
+# Socket.IO序列化方式: default（JSON + 二进制附件）或 msgpack
+SOCKETIO_SERIALIZER = resolve_socketio_serializer(os.environ.get('NASPT_SOCKETIO_SERIALIZER', 'default'))
+# 会话登记表：默认进程内；多进程部署时设置为 redis://...，各工作进程共享会话归属与容量计数，
+# 并经同一个Redis转发Socket.IO消息（eventlet模式下使用绿色socket访问Redis）
+session_registry = create_registry(os.environ.get('NASPT_SESSION_REGISTRY'),
+                                   green=importlib.util.find_spec('eventlet') is not None)
+socketio = SocketIO(app, cors_allowed_origins="*", serializer=SOCKETIO_SERIALIZER,
+                    client_manager=session_registry.client_manager())
+# 与Socket.IO异步模式匹配的select，用于等待SSH通道可读
+channel_select = get_select(socketio.async_mode)
+# 与Socket.IO异步模式匹配的阻塞调用方式，多主机任务的建立连接、上传文件在其中执行
+blocking_call = get_blocking_call(socketio.async_mode)
+# 与Socket.IO异步模式匹配的事件，输出流控暂停时等待浏览器的确认
+output_event_factory = get_event_factory(socketio.async_mode)
+
+
+def tcp_nodelay_middleware(wsgi_app):
+    """
+    为eventlet.wsgi的连接设置TCP_NODELAY
+
+    二进制ssh_output帧由两条WebSocket消息组成（占位包 + 附件），eventlet.wsgi默认不关闭Nagle算法，
+    第二条消息会等到浏览器的延迟ACK（约40ms）才发出，交互回显明显变慢
+    """
+    def middleware(environ, start_response):
+        sock_input = environ.get('eventlet.input')
+        if sock_input is not None:
+            try:
+                sock_input.get_socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except (AttributeError, OSError):
+                pass
+        return wsgi_app(environ, start_response)
+    return middleware
+
+
+app.wsgi_app = tcp_nodelay_middleware(app.wsgi_app)
 
 
 def ensure_naspt_path(base_path: str) -> str:
@@ -44,7 +110,10 @@ DEFAULT_REMOTE_BASE_DIR = ensure_naspt_path(os.environ.get('NASPT_REMOTE_BASE_DI
 def get_remote_paths(docker_path: str | None = None) -> dict:
     """根据Docker配置路径返回统一的naspt目录结构"""
     base_dir = ensure_naspt_path(docker_path) if docker_path else DEFAULT_REMOTE_BASE_DIR
+    # 解压目标目录：Docker配置路径本身（与前端的dockerBase一致）
+    docker_dir = (docker_path.strip().rstrip('/') or '/') if docker_path else base_dir[:-len('/naspt')] or '/'
     return {
+        'docker': docker_dir,
         'base': base_dir,
         'downloads': f"{base_dir}/downloads",
         'tmp': f"{base_dir}/tmp",
@@ -52,13 +121,21 @@ def get_remote_paths(docker_path: str | None = None) -> dict:
     }
 
 
-# 存储SSH连接
-ssh_connections = {}
+# 终端会话（按Socket.IO sid），负责容量限制和空闲回收
+ssh_sessions = SessionManager(registry=session_registry)
+
+# 已认证SSH传输的连接池，多个浏览器标签页连接同一台主机时复用
+ssh_pool = SSHTransportPool(idle_timeout=float(os.environ.get('NASPT_SSH_POOL_IDLE_TIMEOUT', 300)))
+# 空闲会话和空闲连接的清理间隔（秒）
+SSH_POOL_SWEEP_INTERVAL = 30
+_pool_reaper_started = False
+
+# 日志由后台线程异步写出，级别通过 NASPT_LOG_LEVEL 配置
+logger = get_logger('ssh')
+
 
-# 日志辅助函数，确保立即输出
-def log_ssh(msg):
-    print(msg)
-    sys.stdout.flush()
+def log_ssh(msg, level=logging.INFO):
+    logger.log(level, msg)
 
 
 def filter_non_critical_errors(error_output: str) -> str:
@@ -107,293 +184,836 @@ def replace_env_variables(content, env_content):
 
 
 def create_ssh_connection(host, port, username, password):
-    """创建SSH连接"""
+    """
+    创建SSH连接（复用连接池中已认证的传输，只为本次会话新开一个shell）
+
+    建立连接、认证和打开shell等待服务器应答，在线程池中执行，不阻塞其他会话；
+    sudo提权经channel_select等待输出，在当前协程中进行
+
+    Returns:
+        (SSHLease, channel, 初始输出)，断开时需要关闭channel并release()
+    """
+    lease = None
     try:
-        # 如果用户名不是root，先尝试直接用root用户连接
-        if username.lower() != 'root':
-            try:
-                # 尝试用root用户和相同密码连接
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.connect(hostname=host, port=int(port), username='root', password=password, timeout=10)
-                username = 'root'  # 标记已切换到root
-            except:
-                # 如果root连接失败，使用原用户连接
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.connect(hostname=host, port=int(port), username=username, password=password, timeout=10)
-        else:
-            # 如果已经是root，直接连接
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(hostname=host, port=int(port), username=username, password=password, timeout=10)
+        lease = blocking_call(ssh_pool.acquire, host, port, username, password)
+        if lease.reused:
+            log_ssh(f"[SSH] 复用已认证的连接: {username}@{host}:{port}")
+        username = lease.username
+        channel = blocking_call(lease.open_shell, term='xterm-256color')
+        initial_output = b''
         
-        # 如果还不是root，尝试切换到root
-        if username.lower() != 'root':
-            # 尝试使用exec_command执行sudo切换，验证密码是否正确
-            escaped_password = password.replace('\\', '\\\\').replace('"', '\\"').replace('$', '\\$').replace('`', '\\`').replace('!', '\\!')
-            
-            # 测试sudo权限和密码
-            stdin, stdout, stderr = ssh.exec_command(f'echo "{escaped_password}" | sudo -S whoami', timeout=5)
-            result = stdout.read().decode('utf-8').strip()
-            
-            # 如果sudo成功，说明密码正确，可以在交互式shell中使用
-            if result == 'root':
-                # 创建交互式shell
-                channel = ssh.invoke_shell(term='xterm-256color')
-                time.sleep(0.8)
-                
-                # 在交互式shell中切换到root
-                # 先发送sudo -S -i命令
-                channel.send('sudo -S -i\n')
-                time.sleep(0.8)
-                # 发送密码
-                channel.send(f'{escaped_password}\n')
-                time.sleep(1.5)
-                # 确认切换
-                channel.send('whoami\n')
-                time.sleep(0.3)
-            else:
-                # sudo失败，使用原用户创建shell
-                channel = ssh.invoke_shell(term='xterm-256color')
-                time.sleep(0.5)
-                channel.send('whoami\n')
-        else:
-            # 如果已经是root，直接创建shell
-            channel = ssh.invoke_shell(term='xterm-256color')
-            time.sleep(0.5)
-            channel.send('whoami\n')
+        # 如果还不是root，在交互式shell中用sudo -i切换到root（已知sudo不可用时跳过）
+        if username.lower() != 'root' and lease.conn.sudo_root is not False:
+            result = SudoEscalation(channel, password, select_func=channel_select).run()
+            initial_output = result.output
+            log_ssh(f"[SSH] sudo提权{'成功' if result.success else '失败' if result.success is False else '超时'}，耗时{result.elapsed:.2f}s")
+            if result.success is not None:
+                lease.conn.sudo_root = result.success
+                ssh_pool.remember_login_method(lease.conn, 'sudo' if result.success else 'user')
         
-        return ssh, channel
+        # 确认当前用户
+        channel.send('whoami\n')
+        return lease, channel, initial_output
     except Exception as e:
+        if lease is not None:
+            lease.release()
         raise Exception(f"SSH连接失败: {str(e)}")
 
+
+def start_pool_reaper():
+    """启动后台任务定期关闭空闲超时的会话，并清理空闲的池化连接（只启动一次）"""
+    global _pool_reaper_started
+    if _pool_reaper_started:
+        return
+    _pool_reaper_started = True
+    # 多进程部署时接收其他进程转发来的会话事件
+    session_relay.start()
+
+    def reap():
+        while True:
+            try:
+                # 续期当前进程的心跳，其他进程据此判断本进程持有的会话是否仍然有效
+                session_registry.heartbeat()
+            except Exception as e:
+                logger.warning("[SSH] 会话登记表心跳失败: %s", e)
+            socketio.sleep(SSH_POOL_SWEEP_INTERVAL)
+            try:
+                for session in ssh_sessions.reap_idle():
+                    log_ssh(f"[SSH] 回收会话，session_id={session.sid}, 原因: {session.close_reason}")
+                    emit_session_closed(session)
+                closed = ssh_pool.sweep()
+                if closed:
+                    log_ssh(f"[SSH] 已关闭 {closed} 个空闲连接")
+            except Exception as e:
+                logger.exception("[SSH] 清理空闲会话失败: %s", e)
+
+    socketio.start_background_task(reap)
+
 @socketio.on('connect')
 def handle_connect():
+    start_pool_reaper()
     log_ssh('客户端已连接')
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    # 浏览器断开后分离终端会话：通道保持打开，输出写入回滚缓冲区，等待重新附加
+    session_id = request.sid
+    worker = session_relay.routes.pop(session_id, None)
+    if worker is not None:
+        session_relay.forward(worker, 'detach', session_id)
+    else:
+        detach_session(session_id)
     log_ssh('客户端已断开')
 
+
+def detach_session(session_id, data=None):
+    if ssh_sessions.detach(session_id) is not None:
+        log_ssh(f"[SSH] 客户端断开，会话已分离，session_id={session_id}")
+
+
+def emit_session_closed(session):
+    """通知会话关闭时所附加的浏览器（分离中的会话没有可通知的对象）"""
+    if session.sid is not None:
+        socketio.emit('ssh_disconnected', {'message': session.close_reason}, room=session.sid)
+
+
+def read_ssh_output(session):
+    """
+    读取会话输出的后台任务（就绪驱动，有数据时立即唤醒并一次读空）
+
+    附加时按浏览器确认做流控并发送给当前sid；分离时继续读取，输出只写入回滚缓冲区，
+    远程进程不会因为没有浏览器而被阻塞
+    """
+    channel = session.channel
+    log_ssh(f"[SSH] 开始读取输出线程，session_id={session.sid}")
+    last_flush = 0.0
+    try:
+        while True:
+            try:
+                if session.closed:
+                    log_ssh(f"[SSH] 会话已关闭，退出线程")
+                    break
+                
+                # 浏览器未确认的输出达到上限时不再读取通道，背压经SSH窗口传递到远程进程
+                if session.attached and not session.output.wait_for_room(
+                        lambda: session.closed or not session.attached):
+                    continue
+                
+                # 等待通道可读，空闲时不占用CPU；超时只做一次存活检查
+                if not wait_channel_readable(channel, select_func=channel_select):
+                    continue
+                
+                # 合并输出为帧，以二进制发送，由前端流式解码，避免多字节字符被截断
+                max_bytes = min(FRAME_MAX_BYTES, session.output.room()) if session.attached else FRAME_MAX_BYTES
+                frame = read_output_frame(channel, last_flush, select_func=channel_select, max_bytes=max_bytes)
+                if frame:
+                    last_flush = time.monotonic()
+                    session.record_output(frame)
+                    target_sid = session.sid
+                    if target_sid is None:
+                        continue
+                    session.output.on_sent(len(frame))
+                    logger.debug("[SSH] 收到数据，长度=%d, 内容预览=%r", len(frame), frame[:50], extra=SAMPLED)
+                    try:
+                        socketio.emit('ssh_output', {'data': frame}, room=target_sid)
+                    except Exception as emit_err:
+                        logger.exception("[SSH] 发送ssh_output失败: %s", emit_err)
+                    continue
+                
+                # 检查channel是否关闭
+                if channel_finished(channel):
+                    if channel.exit_status_ready():
+                        log_ssh(f"[SSH] channel退出，状态码={channel.recv_exit_status()}")
+                    else:
+                        log_ssh(f"[SSH] channel已关闭，退出线程")
+                    break
+            except Exception as e:
+                logger.exception("[SSH] 读取SSH输出错误: %s", e)
+                if not session.closed and session.sid is not None:
+                    try:
+                        socketio.emit('ssh_error', {'message': f'连接已断开: {str(e)}'}, room=session.sid)
+                    except:
+                        pass
+                break
+    finally:
+        # 远程shell退出时释放会话，通知前端
+        if ssh_sessions.discard(session, '远程shell已退出'):
+            emit_session_closed(session)
+        log_ssh(f"[SSH] 读取输出线程退出，session_id={session.sid}")
+
+
+def attach_ssh_session(session_id, data) -> bool:
+    """
+    把session_id附加到已有的终端会话（页面刷新或网络重连），不重新登录
+
+    也用于处理其他工作进程转发来的附加请求：此时session_id连接在那个进程上，消息经Socket.IO消息队列送达
+
+    Returns:
+        是否附加成功；失败时调用方按新连接处理
+    """
+    host, port, username = data.get('host'), data.get('port', 22), data.get('username')
+    session, previous_sid = ssh_sessions.attach(data.get('session_token'), session_id, host, port, username,
+                                                data.get('password'))
+    if session is None:
+        return False
+    log_ssh(f"[SSH] 重新附加会话，session_id={session_id}, host={host}, username={username}")
+    if previous_sid is not None:
+        socketio.emit('ssh_disconnected', {'message': '终端已在其他窗口打开'}, room=previous_sid)
+    socketio.emit('ssh_connected', {'message': 'SSH会话已恢复', 'session_token': session.token, 'reattached': True},
+                  room=session_id)
+    # 一次性发送缓冲的屏幕内容
+    screen = session.scrollback.snapshot()
+    if screen:
+        session.output.on_sent(len(screen))
+        socketio.emit('ssh_output', {'data': screen}, room=session_id)
+    # 分离期间仍在进行的操作，之后的输出和结果会发到新的sid
+    for operation in list(session.operations.values()):
+        socketio.emit('operation_started', operation.snapshot(), room=session_id)
+    for job, owner in list(download_jobs.values()):
+        if owner is session:
+            socketio.emit('download_started', {'job_id': job.id, 'concurrency': job.parallelism,
+                                               'items': [item.snapshot() for item in job.targets]}, room=session_id)
+    socketio.start_background_task(collect_host_facts, session_id, data.get('docker_path'))
+    return True
+
+
+def attach_remote_session(session_id, data) -> bool:
+    """会话由其他工作进程持有时（浏览器重连到了另一个进程），请求持有进程附加，之后本sid的事件都转发过去"""
+    worker = ssh_sessions.owner(data.get('session_token'))
+    if worker is None:
+        return False
+    # 先记录路由：持有进程发出的ssh_connected可能先于回复到达浏览器，随后的输入必须已能转发
+    session_relay.routes[session_id] = worker
+    if session_relay.forward(worker, 'attach', session_id, data, wait=True) is True:
+        log_ssh(f"[SSH] 会话由工作进程 {worker} 持有，已转发附加，session_id={session_id}")
+        return True
+    # 附加失败时关闭该sid在持有进程上原先附加的会话（若有），之后按新连接处理
+    session_relay.routes.pop(session_id, None)
+    session_relay.forward(worker, 'ssh_disconnect', session_id)
+    return False
+
+
 @socketio.on('ssh_connect')
 def handle_ssh_connect(data):
-    """处理SSH连接请求"""
-    log_ssh(f"[SSH] 收到ssh_connect事件，data={data}")
+    """处理SSH连接请求（带有效会话令牌时重新附加已有会话）"""
+    logger.debug("[SSH] 收到ssh_connect事件，data=%s",
+                 {k: v for k, v in (data or {}).items() if k not in ('password', 'session_token')})
     try:
         host = data.get('host')
         port = data.get('port', 22)
         username = data.get('username')
         password = data.get('password')
+        docker_path = data.get('docker_path')
+        session_id = request.sid
         
-        log_ssh(f"[SSH] 解析参数: host={host}, port={port}, username={username}")
+        logger.debug("[SSH] 解析参数: host=%s, port=%s, username=%s", host, port, username)
         
         if not all([host, username, password]):
             log_ssh("[SSH] 缺少必要参数")
             emit('ssh_error', {'message': '缺少必要参数'})
             return
         
-        log_ssh(f"[SSH] 开始创建SSH连接...")
-        ssh, channel = create_ssh_connection(host, port, username, password)
-        log_ssh(f"[SSH] SSH连接创建成功")
+        # 同一标签页改连其他会话：原先转发到其他进程的会话在那里关闭
+        worker = session_relay.routes.get(session_id)
+        if worker is not None and ssh_sessions.owner(data.get('session_token')) != worker:
+            session_relay.routes.pop(session_id, None)
+            session_relay.forward(worker, 'ssh_disconnect', session_id)
+        
+        if data.get('session_token') and (attach_ssh_session(session_id, data)
+                                          or attach_remote_session(session_id, data)):
+            return
+        
+        # 占用会话名额，超出总数或单主机上限时拒绝
+        try:
+            ssh_sessions.reserve(session_id, host)
+        except SessionLimitError as e:
+            log_ssh(f"[SSH] 拒绝连接: {e}", logging.WARNING)
+            emit('ssh_error', {'message': str(e)})
+            return
+        
+        logger.debug("[SSH] 开始创建SSH连接...")
+        try:
+            lease, channel, initial_output = create_ssh_connection(host, port, username, password)
+        except Exception:
+            ssh_sessions.cancel(session_id)
+            raise
+        logger.debug("[SSH] SSH连接创建成功")
         
         # 存储连接
-        session_id = request.sid
         log_ssh(f"[SSH] 建立连接，session_id={session_id}, host={host}, port={port}, username={username}")
-        log_ssh(f"[SSH] channel状态: closed={channel.closed}, exit_status_ready={channel.exit_status_ready()}, recv_ready={channel.recv_ready()}")
+        logger.debug("[SSH] channel状态: closed=%s, exit_status_ready=%s, recv_ready=%s",
+                     channel.closed, channel.exit_status_ready(), channel.recv_ready())
         
         # 设置channel为非阻塞模式，确保能及时读取数据
         channel.settimeout(0.1)
         
-        ssh_connections[session_id] = {
-            'ssh': ssh,
-            'channel': channel
-        }
-        
-        emit('ssh_connected', {'message': 'SSH连接成功'})
-        log_ssh(f"[SSH] 已发送ssh_connected事件")
+        # 同一标签页重复连接时，旧会话会被关闭
+        session = SSHSession(session_id, host, port, username, lease, channel, sleep_func=socketio.sleep,
+                             password=password, event_factory=output_event_factory)
+        ssh_sessions.register(session)
         
-        # 立即读取一次，获取初始输出（比如whoami的结果）
-        try:
-            if channel.recv_ready():
-                initial_data = channel.recv(4096).decode('utf-8', errors='ignore')
-                if initial_data:
-                    log_ssh(f"[SSH] 初始数据，长度={len(initial_data)}")
-                    socketio.emit('ssh_output', {'data': initial_data}, room=session_id)
-                    log_ssh(f"[SSH] 已发送初始数据到room={session_id}")
-        except Exception as e:
-            log_ssh(f"[SSH] 读取初始数据失败: {e}")
+        emit('ssh_connected', {'message': 'SSH连接成功', 'session_token': session.token})
+        logger.debug("[SSH] 已发送ssh_connected事件")
         
-        # 启动线程读取SSH输出
-        def read_ssh_output(target_session_id):
-            log_ssh(f"[SSH] 开始读取输出线程，session_id={target_session_id}")
-            try:
-                while True:
-                    try:
-                        if target_session_id not in ssh_connections:
-                            log_ssh(f"[SSH] session_id不在连接列表中，退出线程")
-                            break
-                        conn_info = ssh_connections.get(target_session_id)
-                        if not conn_info:
-                            log_ssh(f"[SSH] 连接信息不存在，退出线程")
-                            break
-                        channel = conn_info['channel']
-                        
-                        # 检查channel是否关闭
-                        if channel.closed:
-                            log_ssh(f"[SSH] channel已关闭，退出线程")
-                            break
-                        
-                        if channel.exit_status_ready():
-                            exit_status = channel.recv_exit_status()
-                            log_ssh(f"[SSH] channel退出，状态码={exit_status}")
-                            break
-                        
-                        if channel.recv_ready():
-                            data = channel.recv(4096).decode('utf-8', errors='ignore')
-                            if data:
-                                log_ssh(f"[SSH] 收到数据，长度={len(data)}, 内容预览={repr(data[:50])}")
-                                try:
-                                    socketio.emit('ssh_output', {'data': data}, room=target_session_id)
-                                    log_ssh(f"[SSH] 已发送ssh_output事件到room={target_session_id}, 数据长度={len(data)}")
-                                except Exception as emit_err:
-                                    import traceback
-                                    log_ssh(f"[SSH] 发送ssh_output失败: {emit_err}")
-                                    log_ssh(f"[SSH] 错误堆栈: {traceback.format_exc()}")
-                        else:
-                            socketio.sleep(0.05)
-                    except Exception as e:
-                        import traceback
-                        log_ssh(f"[SSH] 读取SSH输出错误: {e}")
-                        log_ssh(f"[SSH] 错误堆栈: {traceback.format_exc()}")
-                        if target_session_id in ssh_connections:
-                            try:
-                                socketio.emit('ssh_error', {'message': f'连接已断开: {str(e)}'}, room=target_session_id)
-                            except:
-                                pass
-                        break
-            finally:
-                log_ssh(f"[SSH] 读取输出线程退出，session_id={target_session_id}")
+        # 提权过程中读到的输出先发给终端
+        if initial_output:
+            session.record_output(initial_output)
+            session.output.on_sent(len(initial_output))
+            emit('ssh_output', {'data': initial_output})
         
-        socketio.start_background_task(read_ssh_output, session_id)
+        socketio.start_background_task(read_ssh_output, session)
+        socketio.start_background_task(collect_host_facts, session_id, docker_path)
         
     except Exception as e:
         emit('ssh_error', {'message': str(e)})
 
-@socketio.on('ssh_input')
-def handle_ssh_input(data):
+# 终端会话事件：事件名 -> 处理函数(session_id, data)，本进程和其他工作进程转发来的事件都由它处理
+SESSION_EVENTS = {'attach': attach_ssh_session, 'detach': detach_session}
+
+
+def session_event(name, reply=False):
+    """
+    注册终端会话事件
+
+    sid的会话由本进程持有时直接处理；浏览器重连到本进程、会话仍在其他工作进程时，转发给持有进程处理。
+    处理函数只能通过socketio.emit(room=session_id)发送消息
+
+    Args:
+        reply: 处理函数的返回值是否作为Socket.IO确认返回给浏览器（转发时需要等待持有进程回复）
+    """
+    def decorator(func):
+        SESSION_EVENTS[name] = func
+
+        def handler(data=None):
+            session_id = request.sid
+            worker = session_relay.route(session_id)
+            if worker is None:
+                return func(session_id, data or {})
+            return session_relay.forward(worker, name, session_id, data, wait=reply)
+
+        socketio.on_event(name, handler)
+        return func
+    return decorator
+
+
+def emit_error(session_id, message):
+    socketio.emit('ssh_error', {'message': message}, room=session_id)
+
+
+@session_event('ssh_input')
+def handle_ssh_input(session_id, data):
     """处理SSH输入"""
     try:
-        session_id = request.sid
-        if session_id in ssh_connections:
-            channel = ssh_connections[session_id]['channel']
+        session = ssh_sessions.get(session_id)
+        if session is not None:
             command = data.get('command', '')
             if command == '\r':
                 command = '\n'
             
-            # 记录发送的命令（隐藏敏感字符）
-            cmd_display = repr(command) if len(command) == 1 and command in ['\n', '\r', '\t'] else command[:50]
-            log_ssh(f"[SSH] 收到输入，session_id={session_id}, command={cmd_display}, channel.closed={channel.closed}")
-            
-            if channel.closed:
+            if session.channel.closed:
                 log_ssh(f"[SSH] channel已关闭，无法发送")
-                emit('ssh_error', {'message': 'SSH通道已关闭'})
+                emit_error(session_id, 'SSH通道已关闭')
                 return
             
-            sent_bytes = channel.send(command)
-            log_ssh(f"[SSH] 已发送 {sent_bytes} 字节到channel")
+            # 入队后合并写出：已有写入者时由它一并发送，同时到达的按键合并为一次send
+            session.writer.write(command)
+            session.record_input(len(command))
+            if session.writer.flush():
+                # 按写出批次记录日志，且只记录长度，避免泄露输入内容
+                logger.debug("[SSH] 写入输入，session_id=%s, 累计已发送=%d", session_id, session.writer.sent, extra=SAMPLED)
         else:
             log_ssh(f"[SSH] SSH未连接，session_id={session_id}")
-            emit('ssh_error', {'message': 'SSH未连接'})
+            emit_error(session_id, 'SSH未连接')
+    except TimeoutError as e:
+        # 远程窗口长时间已满，未写出的输入留在缓冲区，下次输入时继续发送
+        logger.warning("[SSH] 发送输入超时，session_id=%s, 未发送=%d", session_id, session.writer.pending)
+        emit_error(session_id, str(e))
     except Exception as e:
-        import traceback
-        log_ssh(f"[SSH] 发送输入错误: {e}")
-        log_ssh(f"[SSH] 错误堆栈: {traceback.format_exc()}")
-        emit('ssh_error', {'message': str(e)})
+        logger.exception("[SSH] 发送输入错误: %s", e)
+        emit_error(session_id, str(e))
+
+@session_event('ssh_output_ack')
+def handle_ssh_output_ack(session_id, data):
+    """浏览器确认已渲染的输出字节数（累计值），用于输出流控"""
+    session = ssh_sessions.get(session_id)
+    if session is not None:
+        session.output.ack(data.get('bytes', 0))
+
+
+@session_event('ssh_paste', reply=True)
+def handle_ssh_paste(session_id, data):
+    """
+    大段粘贴的分块输入：前端每块等待确认后再发下一块；
+    本块真正写入通道（遵守通道窗口）后才确认，服务端不会积压未发送的数据
+    """
+    session = ssh_sessions.get(session_id)
+    if session is None:
+        return {'success': False, 'message': 'SSH未连接'}
+    chunk = data.get('data', '')
+    try:
+        offset = session.writer.write(chunk)
+        session.record_input(len(chunk))
+        if not session.writer.wait_sent(offset):
+            return {'success': False, 'message': '发送超时，远程终端未读取输入'}
+    except Exception as e:
+        logger.warning("[SSH] 粘贴发送失败: %s", e)
+        return {'success': False, 'message': str(e)}
+    logger.debug("[SSH] 粘贴分块已发送，session_id=%s, id=%s, 位置=%s/%s",
+                 session_id, data.get('id'), data.get('offset'), data.get('total'), extra=SAMPLED)
+    return {'success': True, 'sent': session.writer.sent}
 
-@socketio.on('ssh_disconnect')
-def handle_ssh_disconnect():
+
+@session_event('ssh_disconnect')
+def handle_ssh_disconnect(session_id, data=None):
     """断开SSH连接"""
     try:
-        session_id = request.sid
-        if session_id in ssh_connections:
-            ssh_connections[session_id]['ssh'].close()
-            del ssh_connections[session_id]
-            emit('ssh_disconnected', {'message': 'SSH已断开'})
+        if ssh_sessions.close(session_id, 'SSH已断开') is not None:
+            socketio.emit('ssh_disconnected', {'message': 'SSH已断开'}, room=session_id)
     except Exception as e:
-        emit('ssh_error', {'message': str(e)})
+        emit_error(session_id, str(e))
 
-@socketio.on('deploy_compose')
-def handle_deploy_compose(data):
-    """部署Docker Compose"""
+def collect_host_facts(session_id, docker_path=None, force=False):
+    """一次远程调用收集主机信息（已缓存且未过期时直接使用），并发送给前端"""
+    session = ssh_sessions.get(session_id)
+    if session is None:
+        return
+    facts = session.facts
+    base_dir = get_remote_paths(docker_path)['base']
     try:
-        session_id = request.sid
-        if session_id not in ssh_connections:
-            emit('compose_result', {'success': False, 'message': 'SSH未连接'})
-            return
-        
-        compose_content = data.get('compose', '')
-        env_content = data.get('env', '')
-        action = data.get('action', 'up')  # up, down, logs
-        docker_path = data.get('docker_path')
-        
-        if not compose_content.strip():
-            emit('compose_result', {'success': False, 'message': 'docker-compose.yml内容不能为空'})
+        if force:
+            facts.invalidate()
+        facts.get(session.ssh, base_dir)
+        socketio.emit('host_facts', facts.snapshot(), room=session_id)
+    except Exception as e:
+        logger.warning("[SSH] 收集主机信息失败: %s", e)
+
+
+@session_event('refresh_host_facts')
+def handle_refresh_host_facts(session_id, data):
+    """使主机信息缓存失效并重新收集"""
+    collect_host_facts(session_id, data.get('docker_path'), force=True)
+
+
+# compose操作 -> (命令参数, 操作名称)
+COMPOSE_ACTIONS = {
+    'up': ('up -d', '启动服务'),
+    'down': ('down', '停止服务'),
+    'logs': ('logs --tail=100', '查看日志'),
+}
+
+
+def upload_compose(ssh, facts, transfer, compose_content, env_content, docker_path=None) -> tuple[str, str]:
+    """
+    上传替换环境变量后的docker-compose.yml
+
+    Returns:
+        (compose工作目录, compose命令)
+    """
+    # 使用持久化目录存放compose文件
+    remote_paths = get_remote_paths(docker_path)
+    work_dir = remote_paths['compose']
+    base_dir = remote_paths['base']
+
+    # 创建目录（如果不存在，已创建过的目录不再重复执行）
+    facts.ensure_dirs(ssh, base_dir, work_dir)
+
+    compose_file = f'{work_dir}/docker-compose.yml'
+
+    # 替换环境变量
+    processed_compose = replace_env_variables(compose_content, env_content)
+
+    # 通过SFTP上传处理后的docker-compose.yml，内容未变化时跳过
+    if not transfer.put_text(compose_file, processed_compose):
+        logger.debug("[SSH] compose文件未变化，跳过上传: %s", compose_file)
+
+    # 支持新格式 docker compose 和旧格式 docker-compose，从主机信息缓存读取
+    return work_dir, facts.get(ssh, base_dir)['compose']
+
+
+def start_operation(session, kind, title, prepare):
+    """
+    在会话的连接上新开exec通道执行一次操作，不经过交互式终端
+
+    prepare()在后台准备文件并返回要执行的命令（阻塞调用，在blocking_call中执行）。
+    进度经 operation_started / operation_output / operation_done 发给会话当前附加的sid
+
+    Returns:
+        RemoteOperation；同时进行的操作过多时返回None
+    """
+    if len(session.operations) >= MAX_SESSION_OPERATIONS:
+        return None
+    operation = RemoteOperation(kind, title)
+    session.operations[operation.id] = operation
+
+    def emit_to_session(event, payload):
+        if session.sid is not None:
+            socketio.emit(event, payload, room=session.sid)
+
+    def on_output(stream, lines):
+        session.touch()
+        emit_to_session('operation_output', {'operation_id': operation.id, 'stream': stream, 'lines': lines})
+
+    def run():
+        try:
+            command = blocking_call(prepare)
+            result = run_command(session.lease, command, session.password, on_output, select_func=channel_select,
+                                 blocking_call=blocking_call,
+                                 is_cancelled=lambda: operation.cancelled or session.closed)
+            operation.finish(result)
+        except Exception as e:
+            operation.fail(str(e))
+        finally:
+            session.operations.pop(operation.id, None)
+        log_ssh(f"[SSH] 操作结束: {title}，状态={operation.status}，退出码={operation.exit_status}")
+        emit_to_session('operation_done', operation.snapshot())
+
+    emit_to_session('operation_started', operation.snapshot())
+    socketio.start_background_task(run)
+    return operation
+
+
+@session_event('deploy_compose')
+def handle_deploy_compose(session_id, data):
+    """部署Docker Compose（在独立的exec通道上执行，结束后按退出码发送compose_result）"""
+    def emit_result(success, message):
+        socketio.emit('compose_result', {'success': success, 'message': message}, room=session_id)
+
+    session = ssh_sessions.get(session_id)
+    if session is None:
+        emit_result(False, 'SSH未连接')
+        return
+    
+    compose_content = data.get('compose', '')
+    env_content = data.get('env', '')
+    action = data.get('action', 'up')  # up, down, logs
+    
+    if not compose_content.strip():
+        emit_result(False, 'docker-compose.yml内容不能为空')
+        return
+    if action not in COMPOSE_ACTIONS:
+        emit_result(False, f'未知操作: {action}')
+        return
+    args, title = COMPOSE_ACTIONS[action]
+    
+    def prepare():
+        work_dir, compose_cmd = upload_compose(session.ssh, session.facts, session.transfer,
+                                               compose_content, env_content, data.get('docker_path'))
+        return f'cd {shlex.quote(work_dir)} && {compose_cmd} {args}'
+    
+    operation = start_operation(session, 'compose', title, prepare)
+    if operation is None:
+        emit_result(False, f'同时进行的操作已达上限（{MAX_SESSION_OPERATIONS}）')
+        return
+    emit_result(True, f'{title}中...')
+
+
+@session_event('cancel_operation')
+def handle_cancel_operation(session_id, data):
+    """取消会话上正在进行的操作（关闭其exec通道）"""
+    session = ssh_sessions.get(session_id)
+    operation = session.operations.get(data.get('operation_id')) if session is not None else None
+    if operation is not None:
+        operation.cancel()
+
+
+# 进行中的批量下载：job_id -> (DownloadJob, SSHSession)
+download_jobs = {}
+
+
+@session_event('start_download')
+def handle_start_download(session_id, data):
+    """
+    在会话的主机上批量下载并解压：服务端解析飞牛链接，每个文件一个exec通道，最多concurrency个同时下载
+
+    进度经 download_started / download_progress / download_done 发给会话当前附加的sid，
+    启动前失败（链接无效、无法连接）时发送 download_failed。use_cache不为False时使用downloads目录的下载缓存
+    """
+    session = ssh_sessions.get(session_id)
+    if session is None:
+        emit_error(session_id, 'SSH未连接')
+        return
+
+    def emit_to_session(event, payload):
+        if session.sid is not None:
+            socketio.emit(event, payload, room=session.sid)
+
+    try:
+        urls = parse_url_list(data.get('urls'))
+    except ValueError as e:
+        emit_to_session('download_failed', {'message': str(e)})
+        return
+    remote_paths = get_remote_paths(data.get('docker_path'))
+
+    def on_update(job, item):
+        session.touch()
+        emit_to_session('download_progress', dict(item.snapshot(), job_id=job.id))
+
+    def on_done(job):
+        download_jobs.pop(job.id, None)
+        if job.cache is not None:
+            try:
+                evicted = blocking_call(job.cache.flush)
+                if evicted:
+                    log_ssh(f"[DOWNLOAD] 任务{job.id}: 缓存超出上限，删除{len(evicted)}个文件")
+            except Exception as e:
+                log_ssh(f"[DOWNLOAD] 任务{job.id}: 写入下载缓存失败: {e}", logging.WARNING)
+        summary = job.summary()
+        log_ssh(f"[DOWNLOAD] 任务{job.id}结束: {summary['counts']}，缓存命中{summary['cached']}个，耗时{summary['elapsed']}s")
+        emit_to_session('download_done', summary)
+
+    def execute(command, on_output, is_cancelled):
+        return run_command(session.lease, command, session.password, on_output, select_func=channel_select,
+                           blocking_call=blocking_call, is_cancelled=is_cancelled)
+
+    def start():
+        try:
+            items = blocking_call(resolve_downloads, urls)
+            facts = blocking_call(session.facts.get, session.ssh, remote_paths['base'])
+            blocking_call(session.facts.ensure_dirs, session.ssh, remote_paths['base'], remote_paths['downloads'])
+        except Exception as e:
+            emit_to_session('download_failed', {'message': str(e)})
             return
-        
-        ssh = ssh_connections[session_id]['ssh']
-        channel = ssh_connections[session_id]['channel']
-        
-        # 使用持久化目录存放compose文件
-        remote_paths = get_remote_paths(docker_path)
-        work_dir = remote_paths['compose']
-        base_dir = remote_paths['base']
-        
-        # 创建目录（如果不存在）
-        stdin, stdout, stderr = ssh.exec_command(f'mkdir -p {base_dir} {work_dir}', timeout=5)
-        stdout.read()  # 等待完成
-        
-        # 通过SSH命令直接写入文件，避免临时文件问题
-        compose_file = f'{work_dir}/docker-compose.yml'
-        env_file = f'{work_dir}/.env'
-        
-        # 替换环境变量
-        processed_compose = replace_env_variables(compose_content, env_content)
-        
-        # 上传处理后的docker-compose.yml - 使用base64编码避免特殊字符问题
-        compose_b64 = base64.b64encode(processed_compose.encode('utf-8')).decode('ascii')
-        command = f'echo "{compose_b64}" | base64 -d > "{compose_file}"'
-        stdin, stdout, stderr = ssh.exec_command(command, timeout=10)
-        raw_error = stderr.read().decode('utf-8')
-        error = filter_non_critical_errors(raw_error)
-        if error and 'No such file' not in error:  # 忽略目录不存在的错误（会在下面创建）
-            raise Exception(f'写入compose文件失败: {error}')
-        
-        # 执行docker-compose命令（支持新格式 docker compose 和旧格式 docker-compose）
-        # 先检测使用哪个命令
-        test_cmd = 'docker compose version > /dev/null 2>&1 && echo "new" || echo "old"'
-        stdin, stdout, stderr = ssh.exec_command(test_cmd, timeout=5)
-        docker_cmd = stdout.read().decode('utf-8').strip()
-        compose_cmd = 'docker compose' if docker_cmd == 'new' else 'docker-compose'
-        
-        if action == 'up':
-            command = f'cd {work_dir} && {compose_cmd} up -d\n'
-            emit('compose_result', {'success': True, 'message': '服务启动命令已发送'})
-        elif action == 'down':
-            command = f'cd {work_dir} && {compose_cmd} down\n'
-            emit('compose_result', {'success': True, 'message': '服务停止命令已发送'})
-        elif action == 'logs':
-            command = f'cd {work_dir} && {compose_cmd} logs --tail=100\n'
-            emit('compose_result', {'success': True, 'message': '日志查看命令已发送'})
+        cache = None
+        if data.get('use_cache', True) is not False:
+            cache = DownloadCache(session.transfer, remote_paths['downloads'])
+            try:
+                blocking_call(cache.load)
+            except Exception as e:
+                log_ssh(f"[DOWNLOAD] 读取下载缓存失败，按无缓存下载: {e}", logging.WARNING)
+        job = DownloadJob(items, remote_paths, facts['tools'], execute, socketio.start_background_task,
+                          on_update, on_done, owner=session_id, concurrency=data.get('concurrency'),
+                          segments=data.get('segments'), stream=bool(data.get('stream')),
+                          keep_archive=data.get('keep_archive', True) is not False, cache=cache,
+                          sleep_func=socketio.sleep, is_closed=lambda: session.closed)
+        download_jobs[job.id] = (job, session)
+        log_ssh(f"[DOWNLOAD] 任务{job.id}: {len(items)}个文件，并发{job.parallelism}")
+        emit_to_session('download_started', {'job_id': job.id, 'concurrency': job.parallelism,
+                                             'items': [item.snapshot() for item in items]})
+        job.run()
+
+    socketio.start_background_task(start)
+
+
+@session_event('cancel_download')
+def handle_cancel_download(session_id, data):
+    """取消批量下载：排队的文件不再下载，正在下载的文件关闭通道"""
+    job, session = download_jobs.get(data.get('job_id'), (None, None))
+    if job is not None and session is ssh_sessions.get(session_id):
+        job.cancel()
+
+
+# 浏览器重连到其他工作进程时，经会话登记表把事件转发回持有会话的进程
+session_relay = SessionRelay(session_registry, SESSION_EVENTS, socketio.start_background_task, socketio.sleep,
+                             logger=logger)
+
+
+# 进行中的多主机任务：job_id -> FanoutJob
+fanout_jobs = {}
+# 多主机下载的服务端中转缓存（所有任务共用）
+relay_cache = RelayCache()
+# 中转上传的名额（所有任务共用）：每个上传占用线程池中的一个线程，限制同时上传的主机数
+relay_upload_slots = get_semaphore_factory(socketio.async_mode)(DEFAULT_UPLOAD_LIMIT)
+
+
+def build_fanout_targets(items) -> list[FanoutTarget]:
+    """校验前端传入的目标主机列表"""
+    targets = []
+    seen = set()
+    for index, item in enumerate(items or []):
+        host = (item.get('host') or '').strip()
+        username = (item.get('username') or '').strip()
+        if not host or not username:
+            raise ValueError(f'第{index + 1}台主机缺少地址或用户名')
+        target_id = str(item.get('id') or index)
+        if target_id in seen:
+            target_id = f'{target_id}-{index}'
+        seen.add(target_id)
+        targets.append(FanoutTarget(target_id, host, item.get('port') or 22, username,
+                                    item.get('password') or '', name=item.get('name') or ''))
+    if not targets:
+        raise ValueError('请至少选择一台主机')
+    if len(targets) > MAX_TARGETS:
+        raise ValueError(f'一次最多选择{MAX_TARGETS}台主机')
+    return targets
+
+
+def validate_fanout_operation(operation) -> dict:
+    """
+    校验多主机操作
+
+    支持的操作：
+        {'type': 'command', 'command': ...}
+        {'type': 'compose', 'action': 'up'|'down'|'logs', 'compose': ..., 'env': ..., 'docker_path': ...}
+        {'type': 'download', 'urls': ..., 'docker_path': ..., 'relay': bool}（服务端解析链接，relay时由服务端中转）
+    """
+    operation = dict(operation or {})
+    kind = operation.get('type')
+    if kind == 'command':
+        if not (operation.get('command') or '').strip():
+            raise ValueError('命令不能为空')
+    elif kind == 'compose':
+        if operation.setdefault('action', 'up') not in COMPOSE_ACTIONS:
+            raise ValueError(f"未知操作: {operation['action']}")
+        if not (operation.get('compose') or '').strip():
+            raise ValueError('docker-compose.yml内容不能为空')
+    elif kind == 'download':
+        operation['batch'] = DownloadBatch(parse_url_list(operation.get('urls')),
+                                           relay_cache if operation.get('relay') else None)
+    else:
+        raise ValueError(f'未知操作: {kind}')
+    return operation
+
+
+def prepare_fanout_command(lease, operation) -> str:
+    """在目标主机上准备操作需要的文件，返回要执行的命令（阻塞调用，在blocking_call中执行）"""
+    conn = lease.conn
+    kind = operation['type']
+    if kind == 'command':
+        return operation['command']
+    work_dir, compose_cmd = upload_compose(lease.client, conn.facts, conn.transfer, operation['compose'],
+                                           operation.get('env', ''), operation.get('docker_path'))
+    return f"cd {shlex.quote(work_dir)} && {compose_cmd} {COMPOSE_ACTIONS[operation['action']][0]}"
+
+
+def run_fanout_download(job: FanoutJob, target: FanoutTarget, lease):
+    """
+    多主机下载：在一台主机上依次下载并解压每个文件，有文件失败时返回1
+
+    中转模式下文件由服务端获取（所有主机共用一次下载），边获取边经SFTP上传到downloads目录，主机上只执行解压
+    """
+    conn = lease.conn
+    batch = job.operation['batch']
+    remote_paths = get_remote_paths(job.operation.get('docker_path'))
+
+    def emit_lines(stream, lines):
+        socketio.emit('fanout_output', {'job_id': job.id, 'target_id': target.id, 'stream': stream, 'lines': lines},
+                      room=job.owner)
+
+    def on_output(stream, lines):
+        # 进度标记只用于批量下载页，这里只显示下载工具和tar的输出
+        lines = [line for line in lines if not line.startswith('@@')]
+        if lines:
+            emit_lines(stream, lines)
+
+    items = blocking_call(batch.items)
+    facts = blocking_call(conn.facts.get, lease.client, remote_paths['base'])
+    blocking_call(conn.facts.ensure_dirs, lease.client, remote_paths['base'], remote_paths['downloads'])
+    job.update(target, RUNNING)
+    failed = 0
+    for item in items:
+        if job.cancelled:
+            return None
+        if item.error:
+            emit_lines('stderr', [f'{item.filename}: {item.error}'])
+            failed += 1
+            continue
+        relay_file = None
+        try:
+            if batch.relay is not None:
+                relay_file = blocking_call(batch.relay.fetch, item)
+                if relay_file.complete:
+                    emit_lines('stdout', [f'{item.filename}: 使用服务端缓存（{relay_file.size} 字节），上传中...'])
+                else:
+                    emit_lines('stdout', [f'{item.filename}: 服务端获取中，边获取边上传...'])
+                remote_file = f"{remote_paths['downloads']}/{item.filename}"
+                if not relay_upload_slots.acquire(blocking=False):
+                    emit_lines('stdout', [f'{item.filename}: 等待其他主机的上传完成...'])
+                    relay_upload_slots.acquire()
+                try:
+                    if job.cancelled:
+                        return None
+                    uploaded = blocking_call(batch.relay.upload, relay_file, conn.transfer, remote_file)
+                finally:
+                    relay_upload_slots.release()
+                if not uploaded:
+                    emit_lines('stdout', [f'{item.filename}: 主机上已有相同文件，跳过上传'])
+                command = build_extract_command(item, remote_paths, facts['tools'])
+            else:
+                command = build_download_command(item, remote_paths, facts['tools'])
+            result = run_command(lease, command, target.password, on_output, select_func=channel_select,
+                                 blocking_call=blocking_call, is_cancelled=lambda: job.cancelled)
+        except Exception as e:
+            emit_lines('stderr', [f'{item.filename}: {e}'])
+            failed += 1
+            continue
+        finally:
+            if relay_file is not None:
+                batch.relay.release(relay_file)
+        if result.cancelled:
+            return None
+        if result.success:
+            emit_lines('stdout', [f'{item.filename}: 完成'])
         else:
-            emit('compose_result', {'success': False, 'message': f'未知操作: {action}'})
-            return
-        
-        # 发送命令到终端
-        channel.send(command)
-        
-    except Exception as e:
-        emit('compose_result', {'success': False, 'message': str(e)})
+            emit_lines('stderr', [f'{item.filename}: 失败（退出码 {result.exit_status}）'])
+            failed += 1
+    if failed:
+        target.message = f'{failed}/{len(items)} 个文件失败'
+    log_ssh(f"[FANOUT] {target.name} 下载{len(items)}个文件，失败{failed}个")
+    return 1 if failed else 0
+
+
+def run_fanout_target(job: FanoutJob, target: FanoutTarget):
+    """在一台主机上执行多主机任务的操作，返回退出码"""
+    lease = blocking_call(ssh_pool.acquire, target.host, target.port, target.username, target.password)
+    try:
+        if job.cancelled:
+            return None
+        if job.operation['type'] == 'download':
+            return run_fanout_download(job, target, lease)
+        command = blocking_call(prepare_fanout_command, lease, job.operation)
+        job.update(target, RUNNING)
+
+        def on_output(stream, lines):
+            socketio.emit('fanout_output', {'job_id': job.id, 'target_id': target.id, 'stream': stream, 'lines': lines},
+                          room=job.owner)
+
+        result = run_command(lease, command, target.password, on_output, select_func=channel_select,
+                             blocking_call=blocking_call, is_cancelled=lambda: job.cancelled)
+        if result.exit_status is None and not result.cancelled:
+            target.message = '连接已断开，未收到退出码'
+        log_ssh(f"[FANOUT] {target.name} 退出码={result.exit_status}，耗时{result.elapsed:.2f}s")
+        return result.exit_status
+    finally:
+        lease.release()
+
+
+def emit_fanout_progress(job: FanoutJob, target: FanoutTarget):
+    socketio.emit('fanout_progress', dict(target.snapshot(), job_id=job.id), room=job.owner)
+
+
+def emit_fanout_done(job: FanoutJob):
+    fanout_jobs.pop(job.id, None)
+    summary = job.summary()
+    log_ssh(f"[FANOUT] 任务{job.id}结束: {summary['counts']}，耗时{summary['elapsed']}s")
+    socketio.emit('fanout_done', summary, room=job.owner)
+
+
+@socketio.on('fanout_start')
+def handle_fanout_start(data):
+    """在多台主机上并行执行同一操作，确认中返回job_id，进度经fanout_progress/fanout_output/fanout_done推送"""
+    data = data or {}
+    try:
+        targets = build_fanout_targets(data.get('targets'))
+        operation = validate_fanout_operation(data.get('operation'))
+    except ValueError as e:
+        return {'success': False, 'message': str(e)}
+    job = FanoutJob(targets, operation, data.get('parallelism'), socketio.start_background_task,
+                    on_update=emit_fanout_progress, on_done=emit_fanout_done, owner=request.sid)
+    fanout_jobs[job.id] = job
+    log_ssh(f"[FANOUT] 任务{job.id}: {operation['type']}，{len(targets)}台主机，并发{job.parallelism}")
+    job.run(run_fanout_target)
+    return {'success': True, 'job_id': job.id, 'parallelism': job.parallelism,
+            'targets': [target.snapshot() for target in targets]}
+
+
+@socketio.on('fanout_cancel')
+def handle_fanout_cancel(data):
+    """取消多主机任务：排队的主机不再执行，正在执行的主机关闭通道"""
+    job = fanout_jobs.get((data or {}).get('job_id'))
+    if job is None or job.owner != request.sid:
+        return {'success': False, 'message': '任务不存在或已结束'}
+    job.cancel()
+    return {'success': True}
 
 @app.route('/api/load-services', methods=['POST'])
 def load_services():
@@ -446,9 +1066,38 @@ def load_services():
     except Exception as e:
         return jsonify({'success': False, 'message': f'服务器错误: {str(e)}'}), 500
 
+def is_true(value) -> bool:
+    """请求参数是否为真（JSON中的布尔值或查询字符串中的1/true/yes）"""
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def share_walk_args(args: dict) -> dict:
+    """
+    请求中的子目录展开参数（见share_walker）：recursive、max_depth（最多展开的层数）、pattern（glob）
+
+    Raises:
+        ValueError: max_depth不是非负整数
+    """
+    max_depth = args.get('max_depth')
+    if max_depth in (None, ''):
+        max_depth = None
+    else:
+        try:
+            max_depth = int(max_depth)
+        except (TypeError, ValueError):
+            max_depth = -1
+        if max_depth < 0:
+            raise ValueError('max_depth必须是非负整数')
+    return {'recursive': is_true(args.get('recursive')), 'max_depth': max_depth,
+            'pattern': str(args.get('pattern') or '').strip() or None}
+
+
 @app.route('/api/parse-share-link', methods=['POST'])
 def parse_share_link():
-    """解析飞牛分享链接，获取下载地址"""
+    """
+    解析飞牛分享链接，获取下载地址（结果按分享缓存，见share_cache；refresh为true时重新解析）。
+    recursive为true时展开子目录，max_depth限制展开的层数，pattern只保留匹配的文件（glob）
+    """
     try:
         data = request.get_json()
         share_url = data.get('url', '').strip()
@@ -459,13 +1108,18 @@ def parse_share_link():
         # 验证URL格式
         if not share_url.startswith(('http://', 'https://')):
             return jsonify({'success': False, 'message': 'URL格式不正确'}), 400
+
+        try:
+            walk = share_walk_args(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        # 使用FeiNiuShareParser解析
-        parser = FeiNiuShareParser(share_url)
-        result = parser.parse_all()
+        # 解析在线程池中执行：同一分享的并发请求等待同一次解析，不阻塞其他连接
+        result, cached = blocking_call(share_cache.get, share_url, bool(data.get('refresh')), **walk)
         
         return jsonify({
             'success': True,
+            'cached': cached,
             'data': {
                 'share_id': result['share_id'],
                 'share_url': result['share_url'],
@@ -479,6 +1133,108 @@ def parse_share_link():
     except Exception as e:
         return jsonify({'success': False, 'message': f'解析失败: {str(e)}'}), 500
 
+
+def format_stream_event(event: str, payload: dict, sse: bool) -> str:
+    """
+    流式解析的一条消息：NDJSON为一行 {"type": 事件, "data": 内容}，SSE为 event/data 两行；
+    内容原样放在data中，文件条目等自带的字段（如type）不会与事件名冲突
+    """
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    return json.dumps({'type': event, 'data': payload}, ensure_ascii=False) + '\n'
+
+
+@app.route('/api/parse-share-link/stream', methods=['GET', 'POST'])
+def parse_share_link_stream():
+    """
+    流式解析飞牛分享链接：依次推送share（分享信息）、file（每个文件）、link（每个下载链接，按获取完成的先后），
+    最后是done（与/api/parse-share-link的data相同，file_download_map按文件列表的顺序）或error。
+    参数url、refresh、recursive、max_depth、pattern（同/api/parse-share-link）、format可放在JSON请求体或查询字符串中；
+    format=sse或请求头Accept为text/event-stream时以Server-Sent Events推送（EventSource使用GET），否则为NDJSON
+    """
+    data = request.get_json(silent=True) or {}
+    args = dict(request.args.items(), **data)
+    share_url = str(args.get('url', '')).strip()
+    refresh = is_true(args.get('refresh', ''))
+    sse = args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+
+    if not share_url:
+        return jsonify({'success': False, 'message': '分享链接不能为空'}), 400
+    if not share_url.startswith(('http://', 'https://')):
+        return jsonify({'success': False, 'message': 'URL格式不正确'}), 400
+    try:
+        walk = share_walk_args(args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    def generate():
+        events = share_cache.stream(share_url, refresh, **walk)
+        try:
+            while True:
+                # 每一步的网络请求都经blocking_call执行，不阻塞其他连接（asyncio模式下本来就在WSGI工作线程中）
+                item = blocking_call(next, events, None)
+                if item is None:
+                    return
+                event, payload = item
+                if event == 'done':
+                    result = payload['result']
+                    payload = {
+                        'cached': payload['cached'],
+                        'data': {
+                            'share_id': result['share_id'],
+                            'share_url': result['share_url'],
+                            'auth': result['auth'],
+                            'files': result['files'],
+                            'download_links': result['download_links'],
+                            'file_download_map': result.get('file_download_map', {})
+                        }
+                    }
+                yield format_stream_event(event, payload, sse)
+        except Exception as e:
+            yield format_stream_event('error', {'message': f'解析失败: {str(e)}'}, sse)
+        finally:
+            # 客户端断开时结束解析（经blocking_call执行，排队中的链接请求随之取消）
+            blocking_call(events.close)
+
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    # 禁止反向代理缓冲，事件到达后立即转发
+    return Response(generate(), mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def get_process_usage() -> dict:
+    """当前进程的资源占用（内存、CPU时间、线程数、打开的文件描述符）"""
+    usage = {'threads': threading.active_count()}
+    try:
+        import resource
+        rusage = resource.getrusage(resource.RUSAGE_SELF)
+        usage['cpu_seconds'] = round(rusage.ru_utime + rusage.ru_stime, 2)
+        # Linux上ru_maxrss单位为KB，macOS上为字节
+        usage['max_rss_bytes'] = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+    except ImportError:
+        # Windows没有resource模块
+        pass
+    try:
+        usage['open_fds'] = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        pass
+    return usage
+
+
+@app.route('/api/sessions', methods=['GET'])
+def session_status():
+    """返回终端会话、连接池和进程资源占用，便于长期运行时观察是否泄漏"""
+    return jsonify({
+        'success': True,
+        'sessions': ssh_sessions.stats(),
+        'pool': ssh_pool.stats(),
+        'process': get_process_usage(),
+        'log_dropped': get_dropped_count(),
+        'registry': session_registry.stats(),
+        'share_cache': share_cache.stats(),
+        'sign_methods': sign_methods.stats()
+    })
+
+
 @app.route('/')
 def index():
     paths = get_remote_paths()
@@ -486,9 +1242,37 @@ def index():
         'index.html',
         remote_base_dir=paths['base'],
         remote_download_dir=paths['downloads'],
-        remote_tmp_dir=paths['tmp']
+        remote_tmp_dir=paths['tmp'],
+        socketio_serializer=SOCKETIO_SERIALIZER,
+        # 多进程部署时只用WebSocket：一个Socket.IO连接就是一条TCP连接，始终由接受它的工作进程处理，
+        # 不需要负载均衡器的粘性会话（长轮询的多个HTTP请求可能落到不同进程）
+        socketio_websocket_only=session_registry.shared
     )
 
+def run_workers(count: int, port: int):
+    """
+    启动count个工作进程共同监听同一端口，等待它们退出
+
+    eventlet默认为监听socket设置SO_REUSEPORT，由内核把新连接分配给各进程（Linux 3.9+）
+    """
+    env = dict(os.environ, NASPT_WORKERS='1', NASPT_WORKER_PROCESS='1')
+    print(f"启动 {count} 个工作进程，监听端口 {port}，会话登记表: {os.environ.get('NASPT_SESSION_REGISTRY')}")
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env) for _ in range(count)]
+    # docker stop等发送SIGTERM时同样结束所有工作进程
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+
 def open_browser():
     """延迟打开浏览器"""
     time.sleep(1.5)
@@ -509,9 +1293,19 @@ if __name__ == '__main__':
         print("按 Ctrl+C 停止服务")
         print("=" * 50)
     
+    # 工作进程数：大于1时多个进程共同监听端口，需要共享的会话登记表（NASPT_SESSION_REGISTRY=redis://...）
+    workers = int(os.environ.get('NASPT_WORKERS', 1))
+    if workers > 1 and not getattr(sys, 'frozen', False):
+        if not session_registry.shared or socketio.async_mode != 'eventlet':
+            print("多进程模式需要eventlet和共享的会话登记表，请设置 NASPT_SESSION_REGISTRY=redis://...")
+            sys.exit(1)
+        run_workers(workers, 15432)
+        sys.exit(0)
+    
     # 开发环境使用0.0.0.0，打包后使用127.0.0.1（更安全）
     host = '127.0.0.1' if getattr(sys, 'frozen', False) else '0.0.0.0'
-    debug = not getattr(sys, 'frozen', False)
+    # 工作进程不启用调试模式（自动重载会再派生进程）
+    debug = not getattr(sys, 'frozen', False) and not os.environ.get('NASPT_WORKER_PROCESS')
     
     socketio.run(app, host=host, port=15432, debug=debug, allow_unsafe_werkzeug=True)
 
@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio服务模式
+Socket.IO使用python-socketio的ASGI服务，SSH使用asyncssh，事件与app.py一致
+（ssh_connect / ssh_input / ssh_paste / ssh_output / ssh_output_ack / deploy_compose / cancel_operation），
+每个终端只占用一个协程，适合大量并发终端。页面和HTTP接口仍由app.py中的Flask应用提供。
+
+依赖: pip install asyncssh uvicorn（可选 a2wsgi）
+运行: python app_async.py
+
+与默认模式的差异：不支持分离/重新附加终端（浏览器断开即关闭会话），不支持多主机执行和批量下载任务
+"""
+
+import asyncio
+import hashlib
+import hmac
+import posixpath
+import shlex
+import sys
+import time
+import uuid
+
+import socketio
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+import app as flask_routes
+from app import app as flask_app, get_remote_paths, replace_env_variables, SOCKETIO_SERIALIZER, COMPOSE_ACTIONS
+from host_facts import HostFacts
+from ssh_escalation import SudoEscalation
+from ssh_exec import build_exec_command, LineSplitter, ExecResult, RemoteOperation, MAX_SESSION_OPERATIONS
+from ssh_log import get_logger
+from ssh_pool import DEFAULT_CONNECT_TIMEOUT, DEFAULT_IDLE_TIMEOUT, KEEPALIVE_INTERVAL
+from ssh_sessions import DEFAULT_MAX_SESSIONS, DEFAULT_MAX_SESSIONS_PER_HOST, SessionLimitError
+from ssh_stream import OutputWindow, FRAME_MAX_BYTES, OUTPUT_ACK_WAIT_TIMEOUT, get_blocking_call
+
+logger = get_logger('ssh.async')
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', serializer=SOCKETIO_SERIALIZER)
+
+
+def _wsgi_to_asgi(wsgi_app):
+    """把Flask应用包装为ASGI应用，优先使用a2wsgi，否则使用uvicorn自带的适配器"""
+    try:
+        from a2wsgi import WSGIMiddleware
+    except ImportError:
+        from uvicorn.middleware.wsgi import WSGIMiddleware
+    return WSGIMiddleware(wsgi_app)
+
+
+class _ProcessChannel:
+    """让SudoEscalation把asyncssh进程当作通道使用（只需要send）"""
+
+    def __init__(self, process):
+        self.process = process
+
+    def send(self, data):
+        self.process.stdin.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+
+class AsyncPooledConnection:
+    """连接池中的一个asyncssh连接"""
+
+    def __init__(self, key: tuple, conn, username: str, password: str):
+        self.key = key
+        self.conn = conn
+        self.username = username
+        self.password_digest = hashlib.sha256(password.encode('utf-8')).digest()
+        self.refcount = 0
+        self.sudo_root = None
+        self.facts = HostFacts()
+        self.close_handle: asyncio.TimerHandle | None = None
+
+    def is_active(self) -> bool:
+        return not self.conn.is_closed()
+
+    def matches_password(self, password: str) -> bool:
+        return hmac.compare_digest(self.password_digest, hashlib.sha256(password.encode('utf-8')).digest())
+
+
+class AsyncSSHPool:
+    """按 (主机, 端口, 用户名) 复用asyncssh连接，引用归零后空闲超时关闭"""
+
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._conns: dict[tuple, AsyncPooledConnection] = {}
+        self.login_methods: dict[tuple, str] = {}
+        # 每个key一把锁：同一主机的并发连接只握手一次，不同主机互不等待
+        self._locks: dict[tuple, asyncio.Lock] = {}
+
+    async def _open(self, host: str, port: int, username: str, password: str):
+        return await asyncssh.connect(host, port=port, username=username, password=password, known_hosts=None,
+                                      login_timeout=self.connect_timeout, keepalive_interval=KEEPALIVE_INTERVAL)
+
+    async def _connect(self, host: str, port: int, username: str, password: str, method: str | None):
+        """与ssh_pool.connect_client相同的策略：非root用户优先用相同密码直接登录root，两路并发"""
+        if username.lower() == 'root' or method in ('sudo', 'user'):
+            return await self._open(host, port, username, password), username
+        if method == 'root':
+            try:
+                return await self._open(host, port, 'root', password), 'root'
+            except Exception:
+                return await self._open(host, port, username, password), username
+
+        root_task = asyncio.ensure_future(self._open(host, port, 'root', password))
+        user_task = asyncio.ensure_future(self._open(host, port, username, password))
+        try:
+            root_conn = await root_task
+        except Exception:
+            return await user_task, username
+
+        def close_user(task):
+            if not task.cancelled() and task.exception() is None:
+                task.result().close()
+        user_task.add_done_callback(close_user)
+        return root_conn, 'root'
+
+    async def acquire(self, host: str, port, username: str, password: str) -> tuple[AsyncPooledConnection, bool]:
+        key = (host, int(port), username)
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            pooled = self._conns.get(key)
+            if pooled is not None and pooled.is_active() and pooled.matches_password(password):
+                if pooled.close_handle is not None:
+                    pooled.close_handle.cancel()
+                    pooled.close_handle = None
+                pooled.refcount += 1
+                return pooled, True
+
+            conn, effective_username = await self._connect(host, int(port), username, password,
+                                                           self.login_methods.get(key))
+            if effective_username == 'root' and username.lower() != 'root':
+                self.login_methods[key] = 'root'
+            old = self._conns.get(key)
+            pooled = AsyncPooledConnection(key, conn, effective_username, password)
+            pooled.refcount = 1
+            if old is None or old.refcount == 0:
+                self._conns[key] = pooled
+                if old is not None:
+                    old.conn.close()
+            return pooled, False
+
+    def release(self, pooled: AsyncPooledConnection):
+        pooled.refcount = max(0, pooled.refcount - 1)
+        if pooled.refcount:
+            return
+        if self._conns.get(pooled.key) is not pooled or not pooled.is_active():
+            pooled.conn.close()
+            return
+        pooled.close_handle = asyncio.get_running_loop().call_later(self.idle_timeout, self._close_idle, pooled)
+
+    def _close_idle(self, pooled: AsyncPooledConnection):
+        if pooled.refcount == 0 and self._conns.get(pooled.key) is pooled:
+            del self._conns[pooled.key]
+            pooled.conn.close()
+
+    def stats(self) -> list[dict]:
+        return [{'host': p.key[0], 'port': p.key[1], 'username': p.key[2], 'effective_username': p.username,
+                 'refcount': p.refcount, 'active': p.is_active()} for p in self._conns.values()]
+
+
+class AsyncTerminal:
+    """一个终端会话（asyncssh交互进程）"""
+
+    def __init__(self, sid: str, host: str, pooled: AsyncPooledConnection, process, password: str | None = None):
+        self.sid = sid
+        self.host = host
+        self.pooled = pooled
+        self.process = process
+        self.output = OutputWindow(event_factory=asyncio.Event)
+        self.reader: asyncio.Task | None = None
+        self.created_at = time.time()
+        self.closed = False
+        # 非root登录时exec通道上的操作用它执行sudo
+        self.password = password
+        # 正在进行的操作：operation_id -> (RemoteOperation, Task)
+        self.operations: dict[str, tuple] = {}
+
+    @property
+    def conn(self):
+        return self.pooled.conn
+
+    def write(self, data: str):
+        self.process.stdin.write(data.encode('utf-8'))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.output.wake()
+        for _, task in list(self.operations.values()):
+            task.cancel()
+        self.password = None
+        self.process.close()
+        ssh_pool.release(self.pooled)
+
+
+ssh_pool = AsyncSSHPool()
+# sid -> 终端
+terminals: dict[str, AsyncTerminal] = {}
+# 正在建立连接的 sid -> host，计入容量
+_pending: dict[str, str] = {}
+
+
+def _reserve(sid: str, host: str):
+    """与SessionManager.reserve相同的容量限制"""
+    total = len(terminals) + len(_pending)
+    if DEFAULT_MAX_SESSIONS and total >= DEFAULT_MAX_SESSIONS:
+        raise SessionLimitError(f'会话数已达上限（{DEFAULT_MAX_SESSIONS}），请关闭其他终端后重试')
+    host_count = (sum(1 for t in terminals.values() if t.host == host)
+                  + sum(1 for h in _pending.values() if h == host))
+    if DEFAULT_MAX_SESSIONS_PER_HOST and host_count >= DEFAULT_MAX_SESSIONS_PER_HOST:
+        raise SessionLimitError(f'主机 {host} 的会话数已达上限（{DEFAULT_MAX_SESSIONS_PER_HOST}）')
+    _pending[sid] = host
+
+
+async def escalate(process, password: str) -> tuple:
+    """在asyncssh交互进程中执行sudo -i（复用SudoEscalation状态机）"""
+    escalation = SudoEscalation(_ProcessChannel(process), password)
+    escalation.start()
+    deadline = time.monotonic() + escalation.timeout
+    while not escalation.finished:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            data = await asyncio.wait_for(process.stdout.read(FRAME_MAX_BYTES), remaining)
+        except asyncio.TimeoutError:
+            break
+        escalation.feed(data)
+    return escalation.finish(closed=process.stdout.at_eof())
+
+
+async def get_facts(pooled: AsyncPooledConnection, base_dir: str) -> dict:
+    facts = pooled.facts
+    if facts.is_fresh(base_dir):
+        return facts.facts
+    result = await pooled.conn.run(HostFacts.build_script(base_dir), check=False)
+    return facts.store(result.stdout or '', base_dir)
+
+
+async def ensure_dirs(pooled: AsyncPooledConnection, *dirs: str):
+    missing = [d for d in dirs if d not in pooled.facts.ready_dirs]
+    if not missing:
+        return
+    result = await pooled.conn.run(f"mkdir -p {' '.join(shlex.quote(d) for d in missing)}", check=False)
+    if result.exit_status != 0:
+        raise Exception(f"创建目录失败: {(result.stderr or '').strip()}")
+    pooled.facts.ready_dirs.update(missing)
+
+
+async def put_text(conn, remote_path: str, text: str, mode: int = 0o644) -> bool:
+    """与RemoteTransfer.put_bytes相同：内容未变化时跳过，先写临时文件再原子重命名"""
+    data = text.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    result = await conn.run(f'sha256sum {shlex.quote(remote_path)} 2>/dev/null', check=False)
+    if (result.stdout or '').split()[:1] == [digest]:
+        return False
+    tmp_path = posixpath.join(posixpath.dirname(remote_path),
+                              f'.{posixpath.basename(remote_path)}.naspt-{uuid.uuid4().hex[:8]}')
+    async with conn.start_sftp_client() as sftp:
+        try:
+            async with sftp.open(tmp_path, 'wb') as f:
+                await f.write(data)
+            await sftp.chmod(tmp_path, mode)
+            try:
+                await sftp.posix_rename(tmp_path, remote_path)
+            except asyncssh.SFTPError:
+                try:
+                    await sftp.remove(remote_path)
+                except asyncssh.SFTPError:
+                    pass
+                await sftp.rename(tmp_path, remote_path)
+        except Exception:
+            try:
+                await sftp.remove(tmp_path)
+            except asyncssh.SFTPError:
+                pass
+            raise
+    return True
+
+
+async def run_exec(terminal: AsyncTerminal, command: str, on_output) -> ExecResult:
+    """与ssh_exec.run_command相同：在独立的exec通道上执行命令，stdout/stderr分别按行回调"""
+    start = time.monotonic()
+    wrapped, stdin_data = build_exec_command(command, terminal.pooled.username, terminal.pooled.sudo_root)
+    process = await terminal.conn.create_process(wrapped, encoding=None)
+    try:
+        if stdin_data is not None and terminal.password:
+            process.stdin.write((terminal.password + '\n').encode('utf-8'))
+        process.stdin.write_eof()
+
+        async def pump(stream: str, reader):
+            splitter = LineSplitter()
+            while True:
+                data = await reader.read(FRAME_MAX_BYTES)
+                if not data:
+                    break
+                lines = splitter.feed(data)
+                if lines:
+                    await on_output(stream, lines)
+            lines = splitter.flush()
+            if lines:
+                await on_output(stream, lines)
+
+        await asyncio.gather(pump('stdout', process.stdout), pump('stderr', process.stderr))
+        completed = await process.wait()
+        return ExecResult(completed.exit_status, time.monotonic() - start)
+    finally:
+        process.close()
+
+
+async def start_operation(terminal: AsyncTerminal, kind: str, title: str, prepare) -> RemoteOperation | None:
+    """与app.start_operation相同；prepare为返回命令的协程函数。同时进行的操作过多时返回None"""
+    if len(terminal.operations) >= MAX_SESSION_OPERATIONS:
+        return None
+    operation = RemoteOperation(kind, title)
+
+    async def on_output(stream, lines):
+        await sio.emit('operation_output', {'operation_id': operation.id, 'stream': stream, 'lines': lines},
+                       to=terminal.sid)
+
+    async def run():
+        try:
+            command = await prepare()
+            operation.finish(await run_exec(terminal, command, on_output))
+        except asyncio.CancelledError:
+            operation.finish(ExecResult(None, time.time() - operation.started_at, cancelled=True))
+        except Exception as e:
+            operation.fail(str(e))
+        finally:
+            terminal.operations.pop(operation.id, None)
+        logger.info(f"[SSH] 操作结束: {title}，状态={operation.status}，退出码={operation.exit_status}")
+        await sio.emit('operation_done', operation.snapshot(), to=terminal.sid)
+
+    await sio.emit('operation_started', operation.snapshot(), to=terminal.sid)
+    terminal.operations[operation.id] = (operation, asyncio.ensure_future(run()))
+    return operation
+
+
+async def read_output(terminal: AsyncTerminal):
+    """读取终端输出并发送，未确认的输出达到上限时停止读取，背压经SSH窗口传递到远程进程"""
+    try:
+        while not terminal.closed:
+            while terminal.output.is_full() and not terminal.closed:
+                # 等待ssh_output_ack（或关闭）唤醒，超时只做一次兜底检查
+                terminal.output.room_event.clear()
+                try:
+                    await asyncio.wait_for(terminal.output.room_event.wait(), OUTPUT_ACK_WAIT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+            data = await terminal.process.stdout.read(min(FRAME_MAX_BYTES, terminal.output.room()))
+            if not data:
+                break
+            terminal.output.on_sent(len(data))
+            await sio.emit('ssh_output', {'data': data}, to=terminal.sid)
+    except Exception as e:
+        if not terminal.closed:
+            logger.warning("[SSH] 读取SSH输出错误: %s", e)
+    finally:
+        if terminals.get(terminal.sid) is terminal:
+            del terminals[terminal.sid]
+            terminal.close()
+            await sio.emit('ssh_disconnected', {'message': '远程shell已退出'}, to=terminal.sid)
+
+
+async def close_terminal(sid: str) -> bool:
+    terminal = terminals.pop(sid, None)
+    if terminal is None:
+        return False
+    terminal.close()
+    if terminal.reader is not None:
+        terminal.reader.cancel()
+    return True
+
+
+@sio.event
+async def connect(sid, environ):
+    logger.info('客户端已连接')
+
+
+@sio.event
+async def disconnect(sid, *args):
+    _pending.pop(sid, None)
+    await close_terminal(sid)
+    logger.info('客户端已断开')
+
+
+@sio.event
+async def ssh_connect(sid, data):
+    """处理SSH连接请求"""
+    host = data.get('host')
+    port = data.get('port', 22)
+    username = data.get('username')
+    password = data.get('password')
+    docker_path = data.get('docker_path')
+    if not all([host, username, password]):
+        await sio.emit('ssh_error', {'message': '缺少必要参数'}, to=sid)
+        return
+    if asyncssh is None:
+        await sio.emit('ssh_error', {'message': 'asyncio模式需要安装asyncssh'}, to=sid)
+        return
+
+    await close_terminal(sid)
+    try:
+        _reserve(sid, host)
+    except SessionLimitError as e:
+        await sio.emit('ssh_error', {'message': str(e)}, to=sid)
+        return
+
+    pooled = None
+    try:
+        pooled, reused = await ssh_pool.acquire(host, port, username, password)
+        if reused:
+            logger.info(f"[SSH] 复用已认证的连接: {username}@{host}:{port}")
+        process = await pooled.conn.create_process(term_type='xterm-256color', term_size=(80, 24), encoding=None)
+        initial_output = b''
+        if pooled.username.lower() != 'root' and pooled.sudo_root is not False:
+            result = await escalate(process, password)
+            initial_output = result.output
+            logger.info(f"[SSH] sudo提权{'成功' if result.success else '失败' if result.success is False else '超时'}，耗时{result.elapsed:.2f}s")
+            if result.success is not None:
+                pooled.sudo_root = result.success
+                ssh_pool.login_methods[pooled.key] = 'sudo' if result.success else 'user'
+        process.stdin.write(b'whoami\n')
+    except Exception as e:
+        _pending.pop(sid, None)
+        if pooled is not None:
+            ssh_pool.release(pooled)
+        await sio.emit('ssh_error', {'message': f'SSH连接失败: {str(e)}'}, to=sid)
+        return
+
+    _pending.pop(sid, None)
+    terminal = AsyncTerminal(sid, host, pooled, process, password=password)
+    terminals[sid] = terminal
+    logger.info(f"[SSH] 建立连接，session_id={sid}, host={host}, port={port}, username={username}")
+    await sio.emit('ssh_connected', {'message': 'SSH连接成功'}, to=sid)
+    if initial_output:
+        terminal.output.on_sent(len(initial_output))
+        await sio.emit('ssh_output', {'data': initial_output}, to=sid)
+    terminal.reader = asyncio.ensure_future(read_output(terminal))
+
+    try:
+        await get_facts(pooled, get_remote_paths(docker_path)['base'])
+        await sio.emit('host_facts', pooled.facts.snapshot(), to=sid)
+    except Exception as e:
+        logger.warning("[SSH] 收集主机信息失败: %s", e)
+
+
+@sio.event
+async def ssh_input(sid, data):
+    """处理SSH输入；drain()等待SSH窗口，输入不会在服务端无限堆积"""
+    terminal = terminals.get(sid)
+    if terminal is None:
+        await sio.emit('ssh_error', {'message': 'SSH未连接'}, to=sid)
+        return
+    command = data.get('command', '')
+    if command == '\r':
+        command = '\n'
+    try:
+        terminal.write(command)
+        await terminal.process.stdin.drain()
+    except Exception as e:
+        await sio.emit('ssh_error', {'message': str(e)}, to=sid)
+
+
+@sio.event
+async def ssh_paste(sid, data):
+    """大段粘贴的分块输入，本块写入SSH通道后才确认"""
+    terminal = terminals.get(sid)
+    if terminal is None:
+        return {'success': False, 'message': 'SSH未连接'}
+    try:
+        terminal.write(data.get('data', ''))
+        await terminal.process.stdin.drain()
+    except Exception as e:
+        return {'success': False, 'message': str(e)}
+    return {'success': True}
+
+
+@sio.event
+async def ssh_output_ack(sid, data):
+    terminal = terminals.get(sid)
+    if terminal is not None:
+        terminal.output.ack((data or {}).get('bytes', 0))
+
+
+@sio.event
+async def ssh_disconnect(sid):
+    if await close_terminal(sid):
+        await sio.emit('ssh_disconnected', {'message': 'SSH已断开'}, to=sid)
+
+
+@sio.event
+async def refresh_host_facts(sid, data=None):
+    terminal = terminals.get(sid)
+    if terminal is None:
+        return
+    terminal.pooled.facts.invalidate()
+    try:
+        await get_facts(terminal.pooled, get_remote_paths((data or {}).get('docker_path'))['base'])
+        await sio.emit('host_facts', terminal.pooled.facts.snapshot(), to=sid)
+    except Exception as e:
+        logger.warning("[SSH] 收集主机信息失败: %s", e)
+
+
+@sio.event
+async def deploy_compose(sid, data):
+    """部署Docker Compose（在独立的exec通道上执行）"""
+    terminal = terminals.get(sid)
+    if terminal is None:
+        await sio.emit('compose_result', {'success': False, 'message': 'SSH未连接'}, to=sid)
+        return
+    compose_content = data.get('compose', '')
+    env_content = data.get('env', '')
+    action = data.get('action', 'up')
+    if not compose_content.strip():
+        await sio.emit('compose_result', {'success': False, 'message': 'docker-compose.yml内容不能为空'}, to=sid)
+        return
+    if action not in COMPOSE_ACTIONS:
+        await sio.emit('compose_result', {'success': False, 'message': f'未知操作: {action}'}, to=sid)
+        return
+    args, title = COMPOSE_ACTIONS[action]
+
+    async def prepare():
+        remote_paths = get_remote_paths(data.get('docker_path'))
+        work_dir = remote_paths['compose']
+        await ensure_dirs(terminal.pooled, remote_paths['base'], work_dir)
+        await put_text(terminal.conn, f'{work_dir}/docker-compose.yml',
+                       replace_env_variables(compose_content, env_content))
+        compose_cmd = (await get_facts(terminal.pooled, remote_paths['base']))['compose']
+        return f'cd {shlex.quote(work_dir)} && {compose_cmd} {args}'
+
+    if await start_operation(terminal, 'compose', title, prepare) is None:
+        await sio.emit('compose_result', {'success': False, 'message': f'同时进行的操作已达上限（{MAX_SESSION_OPERATIONS}）'},
+                       to=sid)
+        return
+    await sio.emit('compose_result', {'success': True, 'message': f'{title}中...'}, to=sid)
+
+
+@sio.event
+async def cancel_operation(sid, data):
+    terminal = terminals.get(sid)
+    entry = terminal.operations.get((data or {}).get('operation_id')) if terminal is not None else None
+    if entry is not None:
+        entry[1].cancel()
+
+
+@sio.event
+async def start_download(sid, data=None):
+    """服务端批量下载任务依赖线程池执行的飞牛解析和paramiko连接，本模式不支持"""
+    await sio.emit('download_failed', {'message': 'asyncio模式不支持批量下载任务，请使用默认模式'}, to=sid)
+
+
+# Socket.IO之外的请求（页面、/api/*）交给Flask应用。
+# 这些路由在WSGI适配器的工作线程中执行，这里没有运行eventlet hub，阻塞调用直接在工作线程中执行
+flask_routes.blocking_call = get_blocking_call('threading')
+asgi_app = socketio.ASGIApp(sio, other_asgi_app=_wsgi_to_asgi(flask_app))
+
+
+def main(host: str = '0.0.0.0', port: int = 15432):
+    if uvicorn is None or asyncssh is None:
+        print("asyncio模式需要安装依赖: pip install asyncssh uvicorn")
+        sys.exit(1)
+    print(f"NASPT asyncio模式已启动: http://localhost:{port}")
+    uvicorn.run(asgi_app, host=host, port=port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+远程主机上的下载缓存
+downloads目录下的 .naspt-cache.json 记录每个下载项（按链接，飞牛链接按分享和文件名）对应的文件、
+服务端的大小/ETag/Last-Modified以及已知的sha256。再次下载时先带条件请求头探测：服务端返回304、
+或校验信息与记录一致，就直接解压已有的文件；带 #sha256= 的链接按内容命中，不发请求。
+缓存总大小超过上限时按最近使用时间淘汰，downloads目录不会无限增长
+"""
+
+import json
+import os
+import posixpath
+import threading
+import time
+
+# 缓存总大小上限（MB），可通过 NASPT_DOWNLOAD_CACHE_MB 配置，0表示不限制
+DEFAULT_CACHE_LIMIT = int(os.environ.get('NASPT_DOWNLOAD_CACHE_MB', 20480)) * 1024 * 1024
+# manifest文件名（位于downloads目录）
+MANIFEST_NAME = '.naspt-cache.json'
+MANIFEST_VERSION = 1
+
+
+class DownloadCache:
+    """
+    一台主机downloads目录的缓存记录
+
+    load()/flush()经SFTP读写manifest（阻塞调用），lookup()/record()/touch()只操作内存，
+    可在多个下载任务中同时调用
+    """
+
+    def __init__(self, transfer, downloads_dir: str, limit: int = DEFAULT_CACHE_LIMIT):
+        """
+        Args:
+            transfer: remote_transfer.RemoteTransfer
+            downloads_dir: 远程downloads目录
+            limit: 缓存总大小上限（字节），0表示不限制
+        """
+        self.transfer = transfer
+        self.downloads_dir = downloads_dir.rstrip('/')
+        self.manifest_path = f'{self.downloads_dir}/{MANIFEST_NAME}'
+        self.limit = limit
+        # 缓存键 -> {path, size, etag, last_modified, sha256, last_used, hits}
+        self.entries: dict[str, dict] = {}
+        self.hits = 0
+        self.evicted = 0
+        self._dirty = False
+        # 本次任务用到的缓存键，淘汰时跳过
+        self._pinned: set[str] = set()
+        # 本次删除的缓存键，合并时不从远程恢复
+        self._removed: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _read_manifest(self) -> dict:
+        text = self.transfer.get_text(self.manifest_path)
+        try:
+            data = json.loads(text) if text else {}
+        except ValueError:
+            return {}
+        entries = data.get('entries') if isinstance(data, dict) and data.get('version') == MANIFEST_VERSION else None
+        return entries if isinstance(entries, dict) else {}
+
+    def load(self):
+        entries = self._read_manifest()
+        with self._lock:
+            self.entries = entries
+
+    def lookup(self, key: str, sha256: str | None = None) -> dict | None:
+        """按内容（sha256）或缓存键查找记录，返回副本并附带key；文件是否仍然有效由远程脚本确认"""
+        with self._lock:
+            if sha256:
+                for entry_key, entry in self.entries.items():
+                    if entry.get('sha256') == sha256:
+                        self._pinned.add(entry_key)
+                        return dict(entry, key=entry_key)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self._pinned.add(key)
+            return dict(entry, key=key)
+
+    def touch(self, key: str):
+        """缓存命中：更新最近使用时间"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry['last_used'] = time.time()
+                entry['hits'] = entry.get('hits', 0) + 1
+                self.hits += 1
+                self._dirty = True
+
+    def record(self, key: str, path: str, size: int, etag: str | None = None, last_modified: str | None = None,
+               sha256: str | None = None):
+        """记录新下载的文件；同一路径的旧记录（文件已被覆盖）一并删除"""
+        if posixpath.dirname(path) != self.downloads_dir:
+            return
+        with self._lock:
+            for entry_key in [k for k, e in self.entries.items() if e.get('path') == path and k != key]:
+                del self.entries[entry_key]
+                self._removed.add(entry_key)
+            self.entries[key] = {
+                'path': path,
+                'size': size,
+                'etag': etag or '',
+                'last_modified': last_modified or '',
+                'sha256': sha256 or '',
+                'last_used': time.time(),
+                'hits': 0,
+            }
+            self._pinned.add(key)
+            self._dirty = True
+
+    def forget(self, key: str):
+        """文件已失效（被删除或内容变化）"""
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self._removed.add(key)
+                self._dirty = True
+
+    @property
+    def total_size(self) -> int:
+        with self._lock:
+            return sum(entry.get('size') or 0 for entry in self.entries.values())
+
+    def _select_evictions(self) -> list[tuple[str, dict]]:
+        """超过上限时按最近使用时间从旧到新选出要删除的记录（不淘汰本次任务用到的文件）"""
+        if not self.limit:
+            return []
+        total = sum(entry.get('size') or 0 for entry in self.entries.values())
+        evictions = []
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1].get('last_used') or 0):
+            if total <= self.limit:
+                break
+            if key in self._pinned:
+                continue
+            evictions.append((key, entry))
+            total -= entry.get('size') or 0
+        return evictions
+
+    def flush(self) -> list[str]:
+        """
+        淘汰超出上限的文件并写回manifest（阻塞调用）
+
+        写回前先合并远程的manifest（同一目录上可能有其他任务在下载），同一键取最近使用的记录
+
+        Returns:
+            被删除的文件路径
+        """
+        remote = self._read_manifest() if self._dirty else {}
+        with self._lock:
+            for key, entry in remote.items():
+                if key in self._removed or not isinstance(entry, dict):
+                    continue
+                local = self.entries.get(key)
+                if local is None or (entry.get('last_used') or 0) > (local.get('last_used') or 0):
+                    self.entries[key] = entry
+            evictions = self._select_evictions()
+            for key, _ in evictions:
+                del self.entries[key]
+            if not (self._dirty or evictions):
+                return []
+            self._removed.clear()
+            data = json.dumps({'version': MANIFEST_VERSION, 'entries': self.entries}, ensure_ascii=False)
+            self._dirty = False
+            self._pinned.clear()
+        removed = []
+        for _, entry in evictions:
+            # 只删除downloads目录下的文件
+            if posixpath.dirname(entry['path']) == self.downloads_dir and self.transfer.remove(entry['path']):
+                removed.append(entry['path'])
+        self.evicted += len(removed)
+        self.transfer.put_text(self.manifest_path, data)
+        return removed
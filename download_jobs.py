@@ -0,0 +1,669 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+远程批量下载任务
+下载链接在服务端整理：飞牛分享的 /s/download/ 链接先获取认证信息（同一分享只解析一次，解析结果见share_cache），
+每个文件在目标主机上用独立的exec通道下载并解压，最多同时进行concurrency个，失败自动重试（从断点继续）；
+每个文件的状态、已下载字节数和重试次数实时回报，总耗时取决于最慢的文件而不是所有文件之和。
+已下载过且服务端未变化的文件直接使用downloads目录中的副本（见download_cache）
+"""
+
+import os
+import posixpath
+import re
+import shlex
+import time
+from typing import Callable
+from urllib.parse import urlparse, unquote
+
+from download_cache import DownloadCache
+from resumable_download import DEFAULT_SEGMENTS, MAX_SEGMENTS, MIN_SEGMENT_SIZE
+from share_cache import parse_share, share_cache
+from ssh_fanout import FanoutJob, QUEUED, RUNNING
+
+# 默认同时下载的文件数，可通过 NASPT_DOWNLOAD_CONCURRENCY 配置
+DEFAULT_CONCURRENCY = int(os.environ.get('NASPT_DOWNLOAD_CONCURRENCY', 4))
+# 同时下载数上限：每个文件占用一个SSH通道，OpenSSH默认每个连接最多10个（MaxSessions），还要留给终端和其他操作
+MAX_CONCURRENCY = 8
+# 下载失败后的重试次数，可通过 NASPT_DOWNLOAD_RETRIES 配置
+DEFAULT_RETRIES = int(os.environ.get('NASPT_DOWNLOAD_RETRIES', 2))
+# 第n次重试前等待 n * RETRY_BACKOFF 秒
+RETRY_BACKOFF = 3.0
+# 单个任务的链接数上限
+MAX_URLS = 200
+
+# 下载中、解压中、等待重试（其余状态见ssh_fanout）
+DOWNLOADING = RUNNING
+EXTRACTING = 'extracting'
+RETRYING = 'retrying'
+# 解压失败时远程脚本的退出码（下载已成功，不重试）
+EXTRACT_FAILED_EXIT = 90
+# 大小或哈希校验失败时远程脚本的退出码（已删除不完整的文件，重试时从头下载）
+VERIFY_FAILED_EXIT = 91
+
+# 这些HTTP状态码表示请求本身有问题（链接失效、无权限），重试也不会成功
+PERMANENT_HTTP_ERRORS = (400, 401, 403, 404, 410)
+# 飞牛下载链接返回这些状态码时认为token已失效，清除该分享的解析缓存
+TOKEN_EXPIRED_HTTP_ERRORS = (401, 403, 410)
+
+# 链接末尾可以附带期望的哈希：https://example.com/a.tgz#sha256=<64位十六进制>
+_CHECKSUM_FRAGMENT_PATTERN = re.compile(r'#sha256=([0-9a-fA-F]{64})$')
+# 飞牛分享的下载链接：https://host/s/download/<share_id>?token=...
+FEINIU_DOWNLOAD_PATTERN = re.compile(r'^(https?://[^/]+)/s/download/([^/?#]+)')
+# 远程脚本输出的进度标记
+_MARKER_PATTERN = re.compile(r'^@@(\w+)(?: (.*))?$')
+# curl/wget报告HTTP错误的输出：curl: (22) The requested URL returned error: 404 / ERROR 404: Not Found.
+_HTTP_ERROR_PATTERN = re.compile(r'(?:returned error|ERROR):? (\d{3})\b')
+# 浏览器风格的User-Agent，部分下载源拒绝curl/wget的默认值
+USER_AGENT = 'Mozilla/5.0'
+
+
+def safe_filename(name: str, fallback: str) -> str:
+    """去掉路径和shell不友好的字符，保留中文等文字"""
+    name = re.sub(r'[^\w.\-]', '_', posixpath.basename(name or '').strip())
+    name = name.lstrip('.')
+    return name or fallback
+
+
+def archive_folder(filename: str) -> str:
+    """解压目录名：文件名去掉压缩包扩展名"""
+    return re.sub(r'\.(tar\.gz|tgz|tar|zip)$', '', filename) or filename
+
+
+class DownloadItem:
+    """一个待下载的文件及其进度，状态字段与ssh_fanout.FanoutTarget一致，由FanoutJob调度"""
+
+    def __init__(self, item_id: str, url: str, filename: str, headers: dict | None = None, error: str | None = None,
+                 sha256: str | None = None, cache_key: str | None = None, share_id: str | None = None):
+        self.id = item_id
+        self.url = url
+        # 飞牛链接所属的分享
+        self.share_id = share_id
+        # 下载缓存的键，默认为链接本身
+        self.cache_key = cache_key or url
+        # 期望的sha256，下载完成后校验
+        self.sha256 = sha256
+        self.filename = filename
+        self.name = filename
+        self.headers = headers or {}
+        # 解析阶段的错误（例如无法获取飞牛认证信息），有值时不再下载
+        self.error = error
+        self.status = QUEUED
+        self.exit_code = None
+        self.message = ''
+        # 下载工具和tar最近一行非进度标记的输出（wget -nv成功时也会写到stderr），失败时才作为message
+        self.last_output = ''
+        self.started_at = None
+        self.finished_at = None
+        self.attempt = 0
+        self.bytes = 0
+        self.total = 0
+        self.downloaded = False
+        self.http_status = None
+        # 最近一次尝试从断点继续时已有的字节数
+        self.resumed = 0
+        self.extract_dir = None
+        # 下载缓存：查到的记录、是否命中、服务端的大小/ETag/Last-Modified、压缩包是否保存在downloads目录
+        self.cache_entry = None
+        self.cached = False
+        self.validator = None
+        self.stored = False
+
+    @property
+    def elapsed(self) -> float | None:
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def snapshot(self) -> dict:
+        elapsed = self.elapsed
+        return {
+            'target_id': self.id,
+            'name': self.filename,
+            'url': self.url,
+            'status': self.status,
+            'exit_code': self.exit_code,
+            'message': self.message,
+            'elapsed': round(elapsed, 2) if elapsed is not None else None,
+            'attempt': self.attempt,
+            'bytes': self.bytes,
+            'total': self.total,
+            'resumed': self.resumed,
+            'extract_dir': self.extract_dir,
+            'cached': self.cached
+        }
+
+
+def parse_url_list(urls) -> list[str]:
+    """整理链接列表（字符串按行拆分），去掉空行，只接受http/https"""
+    if isinstance(urls, str):
+        urls = urls.splitlines()
+    result = [url.strip() for url in urls or [] if url and url.strip()]
+    for url in result:
+        if not url.startswith(('http://', 'https://')):
+            raise ValueError(f'不支持的链接: {url}')
+    if not result:
+        raise ValueError('没有有效的下载链接')
+    if len(result) > MAX_URLS:
+        raise ValueError(f'一次最多下载{MAX_URLS}个文件')
+    return result
+
+
+def split_checksum(url: str) -> tuple[str, str | None]:
+    """拆出链接末尾的 #sha256=...（片段不会发送给服务端）"""
+    match = _CHECKSUM_FRAGMENT_PATTERN.search(url)
+    if match is None:
+        return url, None
+    return url[:match.start()], match.group(1).lower()
+
+
+def resolve_downloads(urls: list[str], parse: Callable[[str], dict] = parse_share) -> list[DownloadItem]:
+    """
+    把链接列表整理成下载项（阻塞调用，飞牛链接需要请求分享页面）
+
+    parse(share_url)返回FeiNiuShareParser.parse_all的结果，默认经share_cache缓存。
+    同一分享的多个下载链接按顺序对应解析结果中的文件名，并带上该分享的Cookie和Referer；
+    解析失败的分享，其链接标记为错误，不影响其他链接；链接末尾的 #sha256=... 作为期望的哈希。
+    飞牛链接带有每次解析都不同的token，缓存键使用分享ID和文件名
+    """
+    checksums = [split_checksum(url) for url in urls]
+    urls = [url for url, _ in checksums]
+    shares = {}
+    for url in urls:
+        match = FEINIU_DOWNLOAD_PATTERN.match(url)
+        if match:
+            shares.setdefault(match.group(2), {'base': match.group(1), 'urls': []})['urls'].append(url)
+
+    resolved = {}
+    for share_id, share in shares.items():
+        try:
+            result = parse(f"{share['base']}/s/{share_id}")
+            if not result.get('auth'):
+                raise ValueError('未获取到认证信息')
+        except Exception as e:
+            for url in share['urls']:
+                resolved[url] = {'error': f'无法获取飞牛认证信息: {e}'}
+            continue
+        filenames = list((result.get('file_download_map') or {}).keys())
+        headers = {'Referer': result['share_url'], 'Cookie': f"{share_id}={result['auth']}"}
+        for index, url in enumerate(share['urls']):
+            filename = filenames[index] if index < len(filenames) else ''
+            resolved[url] = {'filename': filename, 'headers': headers, 'share_id': share_id,
+                             'cache_key': f"{share['base']}/s/{share_id}/{filename}" if filename else None}
+
+    items = []
+    used = set()
+    for index, url in enumerate(urls):
+        info = resolved.get(url, {})
+        fallback = f'file_{index + 1}'
+        filename = safe_filename(info.get('filename') or unquote(urlparse(url).path), fallback)
+        if filename in used:
+            filename = f'{index + 1}_{filename}'
+        used.add(filename)
+        items.append(DownloadItem(str(index), url, filename, info.get('headers'), info.get('error'),
+                                  sha256=checksums[index][1], cache_key=info.get('cache_key'),
+                                  share_id=info.get('share_id')))
+    return items
+
+
+def build_download_command(item: DownloadItem, remote_paths: dict, tools: dict, segments: int = 1,
+                           stream: bool = False, keep_archive: bool = True, cached: dict | None = None) -> str:
+    """
+    生成在目标主机上下载并解压一个文件的脚本（POSIX sh）
+
+    cached是下载缓存中的记录（见download_cache）：文件仍在且sha256与期望一致时不发请求直接使用；
+    否则探测时带上If-None-Match/If-Modified-Since，服务端返回304或大小、ETag、Last-Modified与记录一致
+    （至少有ETag或Last-Modified之一）时同样直接解压已有的文件。
+
+    stream为True且文件名是tar.gz/tgz/tar时使用流式模式（见下方stream部分），否则先下载再解压：
+
+    下载先写入 .part 文件，.part.validator 记录服务端的大小、ETag和Last-Modified；重试或再次下载时
+    校验信息一致且服务端支持Range就从断点继续（curl -C - / wget -c），否则从头下载。
+    使用curl、服务端支持Range且文件足够大时分成segments段并行下载，各段写入 .part.segN 后按顺序合并。
+    完成后校验文件大小，带有sha256时校验哈希。输出的标记行：
+        @@total N        文件总大小（未知时为0）
+        @@resume N       从断点继续，已有N字节
+        @@bytes N        已下载字节数
+        @@validator V    服务端的 大小|ETag|Last-Modified
+        @@cached PATH    缓存命中，使用已有的文件
+        @@stale          缓存记录的文件已不存在或大小不符
+        @@downloaded N   下载完成并通过校验
+        @@stored         压缩包已保存在downloads目录
+        @@extract DIR    开始解压
+        @@stream DIR     流式模式：边下载边解压到DIR
+        @@extracted      解压完成
+    """
+    headers = dict(item.headers, **{'User-Agent': USER_AGENT})
+    q = shlex.quote
+    cached = cached or {}
+    # 条件请求头只用于探测，下载本身不带（否则服务端可能对下载请求返回304）
+    conditional = {}
+    if cached.get('etag'):
+        conditional['If-None-Match'] = cached['etag']
+    if cached.get('last_modified'):
+        conditional['If-Modified-Since'] = cached['last_modified']
+    if tools.get('curl') or not tools.get('wget'):
+        header_args = ' '.join(f'-H {q(f"{k}: {v}")}' for k, v in headers.items())
+        conditional_args = ''.join(f' -H {q(f"{k}: {v}")}' for k, v in conditional.items())
+        head_cmd = f'curl -sIL --max-time 20 {header_args} "$url" 2>/dev/null'
+        conditional_head_cmd = f'curl -sIL --max-time 20 {header_args}{conditional_args} "$url" 2>/dev/null'
+        # 连续60秒低于1KB/s视为连接已卡死，结束后由重试从断点继续
+        curl = f'curl -L --fail --silent --show-error --connect-timeout 20 --speed-limit 1024 --speed-time 60 {header_args}'
+        fetch_cmd = f'{curl} -C - -o "$part" "$url"'
+        segment_cmd = f'{curl} -r "$((start + have))-$end" "$url" >> "$seg"'
+        stdout_cmd = f'{curl} "$url"'
+    else:
+        header_args = ' '.join(f'--header={q(f"{k}: {v}")}' for k, v in headers.items())
+        conditional_args = ''.join(f' --header={q(f"{k}: {v}")}' for k, v in conditional.items())
+        head_cmd = f'wget -S --spider --timeout=20 {header_args} "$url" 2>&1'
+        conditional_head_cmd = f'wget -S --spider --timeout=20 {header_args}{conditional_args} "$url" 2>&1'
+        fetch_cmd = f'wget -nv -c --timeout=20 {header_args} -O "$part" "$url"'
+        segment_cmd = None
+        stdout_cmd = f'wget -nv --timeout=20 {header_args} -O - "$url"'
+        segments = 1
+    tar_gz = 'tar -I pigz -xf' if tools.get('pigz') else 'tar -xzf'
+    segments = max(1, min(int(segments or 1), MAX_SEGMENTS))
+    extract_tail = _extract_script(tar_gz)
+    cached_validator = f"{cached.get('size') or 0}|{cached.get('etag') or ''}|{cached.get('last_modified') or ''}"
+    # 按内容命中：期望的sha256与缓存记录一致时不需要请求服务端
+    content_hit = bool(item.sha256 and cached.get('sha256') == item.sha256)
+    if conditional:
+        # 缓存的文件已失效时不带条件请求头，否则304响应里没有文件大小
+        head_cmd = f'if [ -n "$cached_file" ]; then {conditional_head_cmd}; else {head_cmd}; fi'
+    preamble = f"""
+url={q(item.url)}
+name={q(item.filename)}
+dl_dir={q(remote_paths['downloads'])}
+extract_dir={q(remote_paths['docker'] + '/' + archive_folder(item.filename))}
+expected_sha256={q(item.sha256 or '')}
+segments={segments}
+file="$dl_dir/$name"
+part="$file.part"
+cached_file={q(cached.get('path') or '')}
+cached_size={int(cached.get('size') or 0)}
+cached_validator={q(cached_validator)}
+cache_hit=
+mkdir -p "$dl_dir" || exit 1
+if [ -n "$cached_file" ] && [ "$(stat -c%s "$cached_file" 2>/dev/null || echo -1)" != "$cached_size" ]; then
+  echo "@@stale"
+  cached_file=
+fi
+[ -n "$cached_file" ] && [ {'1' if content_hit else '0'} = 1 ] && cache_hit=1
+if [ -z "$cache_hit" ]; then
+  # 只取最后一个响应（重定向之后）的头
+  info=$({{ {head_cmd}; }} | tr -d '\\r' | awk '
+    $1 ~ /^HTTP\\// {{s=$2; l=0; r=""; e=""; m=""}}
+    tolower($1)=="content-length:" {{l=$2+0}}
+    tolower($1)=="accept-ranges:" {{r=tolower($2)}}
+    tolower($1)=="etag:" {{e=$2}}
+    tolower($1)=="last-modified:" {{sub(/^[ \\t]*[^:]*:[ \\t]*/, ""); m=$0}}
+    END {{printf "%s|%d|%s|%s|%s\\n", s, l, r, e, m}}')
+  status=${{info%%|*}}
+  info=${{info#*|}}
+  total=${{info%%|*}}
+  rest=${{info#*|}}
+  ranges=${{rest%%|*}}
+  validator="$total|${{rest#*|}}"
+  [ -n "$total" ] || total=0
+  if [ -n "$cached_file" ]; then
+    # 服务端未变化：304，或大小、ETag、Last-Modified与记录一致（只有大小时不足以判断）
+    case "$status:$validator" in
+      304:*) cache_hit=1 ;;
+      *"||") ;;
+      *) [ "$validator" = "$cached_validator" ] && cache_hit=1 ;;
+    esac
+  fi
+fi
+if [ -n "$cache_hit" ]; then
+  file="$cached_file"
+  echo "@@total $cached_size"
+  echo "@@cached $file"
+  echo "@@downloaded $cached_size"
+{_indent(extract_tail)}  exit 0
+fi
+echo "@@total $total"
+echo "@@validator $validator"
+"""
+    stream_mode = _stream_archive_mode(item.filename) if stream else None
+    if stream_mode is not None:
+        extract_cmd = {'gz': tar_gz, 'tar': 'tar -xf'}[stream_mode]
+        return (preamble + _build_stream_body(stdout_cmd, extract_cmd, keep_archive, bool(item.sha256))).lstrip()
+    return (preamble + f"""if [ "$ranges" != bytes ] || [ "$validator" = "0||" ] || [ "$(cat "$part.validator" 2>/dev/null)" != "$validator" ]; then
+  rm -f "$part" "$part".seg*
+fi
+printf '%s' "$validator" > "$part.validator"
+have=$(stat -c%s "$part" 2>/dev/null || echo 0)
+[ "$have" -gt 0 ] && echo "@@resume $have"
+pids=
+if [ "$segments" -gt 1 ] && [ "$ranges" = bytes ] && [ "$total" -ge $((segments * {MIN_SEGMENT_SIZE})) ] && [ ! -s "$part" ]; then
+  progress() {{ stat -c%s "$part".seg* 2>/dev/null | awk '{{s+=$1}} END {{print s+0}}'; }}
+  have=$(progress)
+  [ "$have" -gt 0 ] && echo "@@resume $have"
+  seg_size=$(( (total + segments - 1) / segments ))
+  i=0
+  while [ $i -lt "$segments" ]; do
+    start=$((i * seg_size))
+    end=$((start + seg_size - 1))
+    [ $end -lt "$total" ] || end=$((total - 1))
+    seg="$part.seg$i"
+    have=$(stat -c%s "$seg" 2>/dev/null || echo 0)
+    if [ "$have" -lt $((end - start + 1)) ]; then
+      {segment_cmd} &
+      pids="$pids $!"
+    fi
+    i=$((i + 1))
+  done
+elif [ "$total" -eq 0 ] || [ "$(stat -c%s "$part" 2>/dev/null || echo 0)" -lt "$total" ]; then
+  segments=1
+  {fetch_cmd} &
+  pids=$!
+  progress() {{ stat -c%s "$part" 2>/dev/null || echo 0; }}
+else
+  segments=1
+fi
+rc=0
+while [ -n "$pids" ]; do
+  alive=
+  for pid in $pids; do kill -0 $pid 2>/dev/null && alive=1; done
+  [ -n "$alive" ] || break
+  echo "@@bytes $(progress)"
+  sleep 1
+done
+for pid in $pids; do wait $pid || rc=$?; done
+if [ "$segments" -gt 1 ]; then
+  [ $rc -eq 0 ] || exit $rc
+  : > "$part"
+  i=0
+  while [ $i -lt "$segments" ]; do
+    cat "$part.seg$i" >> "$part" || exit 1
+    i=$((i + 1))
+  done
+  rm -f "$part".seg*
+elif [ $rc -eq 33 ]; then
+  # 服务端拒绝续传，下次从头下载
+  rm -f "$part"
+  exit $rc
+fi
+[ $rc -eq 0 ] || exit $rc
+size=$(stat -c%s "$part" 2>/dev/null || echo 0)
+if [ "$total" -gt 0 ] && [ "$size" -ne "$total" ]; then
+  echo "文件大小不一致: 期望 $total 字节，实际 $size 字节" >&2
+  rm -f "$part" "$part.validator"
+  exit {VERIFY_FAILED_EXIT}
+fi
+if [ -n "$expected_sha256" ]; then
+  actual=$(sha256sum "$part" | cut -d' ' -f1)
+  if [ "$actual" != "$expected_sha256" ]; then
+    echo "sha256校验失败: 期望 $expected_sha256，实际 $actual" >&2
+    rm -f "$part" "$part.validator"
+    exit {VERIFY_FAILED_EXIT}
+  fi
+fi
+mv -f "$part" "$file" || exit 1
+rm -f "$part.validator"
+echo "@@downloaded $size"
+echo "@@stored"
+""" + extract_tail).lstrip()
+
+
+def _extract_script(tar_gz: str) -> str:
+    """按文件名（或file命令）判断格式，把 $file 解压到 $extract_dir；不是压缩包时直接结束"""
+    return f"""case "$name" in
+  *.tar.gz|*.tgz) mode=gz ;;
+  *.tar) mode=tar ;;
+  *) case "$(file -b "$file" 2>/dev/null)" in
+       *gzip*) mode=gz ;;
+       *"tar archive"*) mode=tar ;;
+       *) mode= ;;
+     esac ;;
+esac
+[ -n "$mode" ] || exit 0
+echo "@@extract $extract_dir"
+mkdir -p "$extract_dir" || exit {EXTRACT_FAILED_EXIT}
+if [ "$mode" = gz ]; then
+  {tar_gz} "$file" -C "$extract_dir" || exit {EXTRACT_FAILED_EXIT}
+else
+  tar -xf "$file" -C "$extract_dir" || exit {EXTRACT_FAILED_EXIT}
+fi
+echo "@@extracted"
+"""
+
+
+def build_extract_command(item: DownloadItem, remote_paths: dict, tools: dict) -> str:
+    """
+    生成解压downloads目录中已有文件的脚本（文件由服务端中转上传，见download_relay），标记行同build_download_command
+    """
+    q = shlex.quote
+    tar_gz = 'tar -I pigz -xf' if tools.get('pigz') else 'tar -xzf'
+    return f"""name={q(item.filename)}
+file={q(remote_paths['downloads'] + '/' + item.filename)}
+extract_dir={q(remote_paths['docker'] + '/' + archive_folder(item.filename))}
+[ -f "$file" ] || {{ echo "文件不存在: $file" >&2; exit 1; }}
+echo "@@downloaded $(stat -c%s "$file")"
+""" + _extract_script(tar_gz)
+
+
+def _indent(script: str, prefix: str = '  ') -> str:
+    return ''.join(prefix + line if line.strip() else line for line in script.splitlines(True))
+
+
+def _stream_archive_mode(filename: str) -> str | None:
+    """流式解压只能根据文件名判断格式（无法先用file检查）"""
+    if re.search(r'\.(tar\.gz|tgz)$', filename, re.I):
+        return 'gz'
+    if re.search(r'\.tar$', filename, re.I):
+        return 'tar'
+    return None
+
+
+def _build_stream_body(fetch_cmd: str, extract_cmd: str, keep_archive: bool, verify_hash: bool) -> str:
+    """
+    流式模式：下载的数据经管道直接交给tar解压，不先写完整个压缩包再读一遍，磁盘读写约减半，
+    下载结束时解压也随之结束。keep_archive为True时用tee同时保存压缩包。
+
+    管道最后一级统计字节数（或计算sha256），用于进度和校验。该模式不支持断点续传和分段，重试从头开始
+    """
+    tee_target = '"$part" "$fifo"' if keep_archive else '"$fifo"'
+    counter = 'sha256sum' if verify_hash else 'wc -c'
+    keep_line = 'mv -f "$part" "$file" || exit 1\necho "@@stored"\n' if keep_archive else ''
+    progress = ('stat -c%s "$part" 2>/dev/null || echo 0' if keep_archive else
+                # 管道最后一级从stdin读取的字节数即已下载的字节数
+                "awk '/^rchar/ {print $2}' /proc/$pipe_pid/io 2>/dev/null || echo 0")
+    return f"""rm -f "$part" "$part".seg* "$part.validator"
+mkdir -p "$extract_dir" || exit 1
+fifo="$dl_dir/.$name.$$.fifo"
+rm -f "$fifo"
+mkfifo "$fifo" || exit 1
+trap 'rm -f "$fifo" "$fifo.out" "$fifo.rc" "$fifo.err"' EXIT
+echo "@@stream $extract_dir"
+# 下载失败时tar的报错只是结果（Unexpected EOF），只在解压本身失败时输出
+{extract_cmd} "$fifo" -C "$extract_dir" 2>"$fifo.err" &
+tar_pid=$!
+{{ {fetch_cmd}; echo $? > "$fifo.rc"; }} | tee {tee_target} | LC_ALL=C {counter} > "$fifo.out" &
+pipe_pid=$!
+while kill -0 $pipe_pid 2>/dev/null; do
+  echo "@@bytes $({progress})"
+  sleep 1
+done
+wait $pipe_pid
+wait $tar_pid
+tar_rc=$?
+rc=$(cat "$fifo.rc" 2>/dev/null || echo 1)
+if [ "$rc" -ne 0 ]; then
+  rm -f "$part"
+  # tar先出错退出时，下载工具因写入失败而退出（curl 23、wget 3、SIGPIPE）
+  case "$tar_rc:$rc" in
+    0:*) exit $rc ;;
+    *:23|*:3|*:141) cat "$fifo.err" >&2; exit {EXTRACT_FAILED_EXIT} ;;
+    *) exit $rc ;;
+  esac
+fi
+result=$(cut -d' ' -f1 "$fifo.out" | tr -d ' ')
+if [ -n "$expected_sha256" ]; then
+  if [ "$result" != "$expected_sha256" ]; then
+    echo "sha256校验失败: 期望 $expected_sha256，实际 $result" >&2
+    rm -f "$part"
+    exit {VERIFY_FAILED_EXIT}
+  fi
+  size=$total
+else
+  size=$result
+  if [ "$total" -gt 0 ] && [ "$size" -ne "$total" ]; then
+    echo "文件大小不一致: 期望 $total 字节，实际 $size 字节" >&2
+    rm -f "$part"
+    exit {VERIFY_FAILED_EXIT}
+  fi
+fi
+{keep_line}echo "@@downloaded $size"
+[ $tar_rc -eq 0 ] || {{ cat "$fifo.err" >&2; exit {EXTRACT_FAILED_EXIT}; }}
+echo "@@extracted"
+"""
+
+
+class DownloadJob(FanoutJob):
+    """
+    一次批量下载：每个文件是一个下载项，由FanoutJob按并发上限调度
+
+    execute(command, on_output, is_cancelled) 在目标主机上执行命令并返回ssh_exec.ExecResult，
+    由调用方绑定到具体的连接；cache为该主机的DownloadCache，任务结束后由调用方flush
+    """
+
+    def __init__(self, items: list[DownloadItem], remote_paths: dict, tools: dict, execute: Callable,
+                 start_task: Callable, on_update: Callable, on_done: Callable, owner: str | None = None,
+                 concurrency=None, retries: int = DEFAULT_RETRIES, segments=None, stream: bool = False,
+                 keep_archive: bool = True, cache: DownloadCache | None = None, sleep_func: Callable = time.sleep,
+                 is_closed: Callable[[], bool] = lambda: False):
+        super().__init__(items, {'type': 'download'}, DEFAULT_CONCURRENCY, start_task, on_update, on_done, owner=owner)
+        try:
+            concurrency = int(concurrency or DEFAULT_CONCURRENCY)
+        except (TypeError, ValueError):
+            concurrency = DEFAULT_CONCURRENCY
+        self.parallelism = max(1, min(concurrency, MAX_CONCURRENCY))
+        self.remote_paths = remote_paths
+        self.tools = tools
+        self.retries = max(0, int(retries))
+        try:
+            segments = int(segments or DEFAULT_SEGMENTS)
+        except (TypeError, ValueError):
+            segments = DEFAULT_SEGMENTS
+        # 每个文件的分段数（服务端支持Range且文件足够大时才分段）
+        self.segments = max(1, min(segments, MAX_SEGMENTS))
+        # 流式模式：边下载边解压，keep_archive为False时不在downloads目录保留压缩包
+        self.stream = bool(stream)
+        self.keep_archive = bool(keep_archive)
+        self.cache = cache
+        self._execute = execute
+        self._sleep = sleep_func
+        self._is_closed = is_closed
+
+    def run(self):
+        super().run(DownloadJob.download)
+
+    def summary(self) -> dict:
+        summary = super().summary()
+        summary['cached'] = sum(1 for item in self.targets if item.cached)
+        return summary
+
+    def _handle_output(self, item: DownloadItem, stream: str, lines: list[str]):
+        changed = False
+        for line in lines:
+            match = _MARKER_PATTERN.match(line) if stream == 'stdout' else None
+            if match is None:
+                # 下载工具的输出，保留最后一行，失败时作为原因
+                if line.strip():
+                    item.last_output = line.strip()[:300]
+                    status = _HTTP_ERROR_PATTERN.search(line)
+                    if status:
+                        item.http_status = int(status.group(1))
+                continue
+            key, value = match.group(1), match.group(2) or ''
+            if key in ('total', 'resume', 'bytes', 'downloaded'):
+                try:
+                    size = int(value)
+                except ValueError:
+                    continue
+                if key == 'total':
+                    item.total = size
+                elif key == 'resume':
+                    item.resumed = item.bytes = size
+                else:
+                    item.bytes = size
+                    if key == 'downloaded':
+                        item.downloaded = True
+                        item.total = item.total or size
+                changed = True
+            elif key == 'extract':
+                item.extract_dir = value
+                item.status = EXTRACTING
+                changed = True
+            elif key == 'stream':
+                item.extract_dir = value
+                changed = True
+            elif key == 'validator':
+                item.validator = value
+            elif key == 'stored':
+                item.stored = True
+            elif key == 'stale':
+                if self.cache is not None and item.cache_entry:
+                    self.cache.forget(item.cache_entry['key'])
+                item.cache_entry = None
+            elif key == 'cached':
+                item.cached = True
+                item.message = '使用已下载的文件'
+                changed = True
+        if changed:
+            self._on_update(self, item)
+
+    def download(self, item: DownloadItem):
+        """
+        下载一个文件（FanoutJob的host_task），失败时按退避重试，重试从断点继续；
+        链接失效（4xx）和解压失败不重试
+        """
+        if item.error:
+            raise Exception(item.error)
+        if self.cache is not None:
+            item.cache_entry = self.cache.lookup(item.cache_key, item.sha256)
+        command = build_download_command(item, self.remote_paths, self.tools, self.segments,
+                                         stream=self.stream, keep_archive=self.keep_archive,
+                                         cached=item.cache_entry)
+        result = None
+        for attempt in range(1, self.retries + 2):
+            if self.cancelled or self._is_closed():
+                return None
+            item.attempt = attempt
+            item.bytes = item.resumed = 0
+            item.message = item.last_output = ''
+            item.http_status = None
+            self.update(item, DOWNLOADING)
+            result = self._execute(command, lambda stream, lines: self._handle_output(item, stream, lines),
+                                   lambda: self.cancelled or self._is_closed())
+            if result.exit_status == 0 or result.cancelled:
+                break
+            item.message = item.last_output
+            if item.downloaded or result.exit_status == EXTRACT_FAILED_EXIT:
+                item.message = f'解压失败: {item.message}' if item.message else '解压失败'
+                break
+            if item.http_status in PERMANENT_HTTP_ERRORS:
+                if item.share_id and item.http_status in TOKEN_EXPIRED_HTTP_ERRORS:
+                    share_cache.invalidate(item.share_id)
+                break
+            if attempt <= self.retries:
+                delay = RETRY_BACKOFF * attempt
+                reason = item.message or f'退出码 {result.exit_status}'
+                self.update(item, RETRYING, f'第{attempt}次下载失败（{reason}），{delay:.0f}秒后重试')
+                self._sleep(delay)
+        if result.exit_status is None and not result.cancelled:
+            item.message = item.message or '连接已断开，未收到退出码'
+        self._update_cache(item)
+        return result.exit_status
+
+    def _update_cache(self, item: DownloadItem):
+        """命中时更新最近使用时间，新保存的压缩包加入缓存（解压失败时文件本身仍然完整）"""
+        if self.cache is None:
+            return
+        if item.cached and item.cache_entry:
+            self.cache.touch(item.cache_entry['key'])
+        elif item.stored:
+            size, etag, last_modified = (item.validator or '0||').split('|', 2)
+            self.cache.record(item.cache_key, posixpath.join(self.remote_paths['downloads'], item.filename),
+                              item.total or int(size or 0), etag, last_modified, item.sha256)
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载中转
+多台主机下载同一批文件时，由NASPT服务端从下载源获取一次并保存到本地缓存，再经各主机池化的SSH连接（SFTP）
+上传到downloads目录并在主机上解压：外网流量只与文件数有关，不再随主机数增长。
+获取在后台线程中进行，各主机不等获取完成：已写入本地的部分边获取边上传，上传的内容最后按sha256确认；
+下载源拒绝续传导致从头获取时，已开始的上传改为等获取完成后重新上传。
+本地缓存有大小上限，按最近使用时间淘汰；缓存的文件再次使用前用大小、ETag、Last-Modified确认下载源未变化
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable
+
+import requests
+
+from download_jobs import USER_AGENT, DownloadItem, resolve_downloads
+from resumable_download import download_resumable, file_digest, probe
+
+# 本地缓存目录，可通过 NASPT_RELAY_CACHE_DIR 配置
+DEFAULT_RELAY_DIR = os.environ.get('NASPT_RELAY_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'naspt-relay')
+# 本地缓存总大小上限（MB），可通过 NASPT_RELAY_CACHE_MB 配置，0表示不限制
+DEFAULT_RELAY_LIMIT = int(os.environ.get('NASPT_RELAY_CACHE_MB', 10240)) * 1024 * 1024
+# 同时进行的中转上传数上限，可通过 NASPT_RELAY_UPLOADS 配置。
+# 每个上传在整个传输期间占用eventlet线程池（默认20个线程）中的一个线程，上限需明显小于线程池大小，
+# 否则向大量主机分发时其他阻塞调用（建立连接、解析分享等）都要排队
+DEFAULT_UPLOAD_LIMIT = max(1, int(os.environ.get('NASPT_RELAY_UPLOADS', 4)))
+# 确认下载源未变化后，这段时间（秒）内再次使用不重新确认（同一任务的其他主机）
+REVALIDATE_INTERVAL = 300
+
+
+class RelayRestarted(Exception):
+    """获取过程中下载源拒绝续传、从头获取，已读取的内容作废"""
+
+
+class _PendingFetch:
+    """进行中的一次获取：记录 .part 中已写入的连续字节数，供边获取边上传的主机读取"""
+
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+        self.part_path = f'{data_path}.part'
+        self.available = 0
+        # 已写入的字节数变小（从头获取）的次数
+        self.generation = 0
+        self.finished = False
+        self.error: BaseException | None = None
+        self.size: int | None = None
+        self.sha256: str | None = None
+        self.cond = threading.Condition()
+
+    def progress(self, downloaded: int, total: int | None):
+        """download_resumable的进度回调（单段下载时即 .part 开头已写入的字节数）"""
+        with self.cond:
+            if downloaded < self.available:
+                self.generation += 1
+            self.available = downloaded
+            self.cond.notify_all()
+
+    def finish(self, size: int | None = None, sha256: str | None = None, error: BaseException | None = None):
+        with self.cond:
+            self.size = size
+            self.sha256 = sha256
+            self.error = error
+            self.finished = True
+            self.cond.notify_all()
+
+    def wait(self):
+        """等待获取完成，失败时抛出获取时的异常"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.finished)
+        if self.error is not None:
+            raise self.error
+
+
+class _StreamReader:
+    """按获取进度读取 .part 的文件对象：没有新数据时等待，获取完成后读到文件末尾"""
+
+    def __init__(self, pending: _PendingFetch):
+        self._pending = pending
+        self._generation = pending.generation
+        self._position = 0
+        self._file = None
+
+    def _open(self):
+        try:
+            return open(self._pending.part_path, 'rb')
+        except FileNotFoundError:
+            # 获取已完成，.part 已重命名
+            return open(self._pending.data_path, 'rb')
+
+    def read(self, size: int) -> bytes:
+        pending = self._pending
+        while True:
+            with pending.cond:
+                pending.cond.wait_for(lambda: pending.finished or pending.available > self._position
+                                      or pending.generation != self._generation)
+                if pending.generation != self._generation and self._position:
+                    raise RelayRestarted('下载源拒绝续传，重新获取')
+                self._generation = pending.generation
+                if pending.error is not None:
+                    raise pending.error
+                limit = None if pending.finished else pending.available - self._position
+            if self._file is None:
+                self._file = self._open()
+            data = self._file.read(size if limit is None else min(size, limit))
+            self._position += len(data)
+            if data or limit is None:
+                return data
+            # 进度已更新但文件被截断（从头获取），等待下一次进度
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RelayFile:
+    """本地缓存中的一个文件，使用期间不会被淘汰，用完调用RelayCache.release"""
+
+    def __init__(self, key: str, path: str, size: int | None, sha256: str | None, fetched: bool,
+                 pending: _PendingFetch | None = None):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        # 本次是否从下载源获取（False表示缓存命中）
+        self.fetched = fetched
+        # 获取尚未完成时为进行中的获取，可边获取边上传
+        self.pending = pending
+
+    @property
+    def complete(self) -> bool:
+        return self.pending is None or (self.pending.finished and self.pending.error is None)
+
+    def wait(self):
+        """等待获取完成（阻塞调用），完成后size和sha256可用"""
+        if self.pending is not None:
+            self.pending.wait()
+            self.size = self.pending.size
+            self.sha256 = self.pending.sha256
+
+
+class RelayCache:
+    """
+    服务端本地的下载缓存
+
+    fetch()是阻塞调用，只等到确认缓存是否可用；需要获取时在后台线程中进行，同一文件只获取一次，
+    各主机经upload()边获取边上传
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_RELAY_DIR, limit: int = DEFAULT_RELAY_LIMIT,
+                 session_factory: Callable = requests.Session):
+        self.cache_dir = cache_dir
+        self.limit = limit
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        # 缓存键 -> 锁，同一文件只获取一次
+        self._key_locks: dict[str, threading.Lock] = {}
+        # 缓存键 -> 正在使用的次数
+        self._in_use: dict[str, int] = {}
+        # 缓存键 -> 最近确认下载源未变化的时间
+        self._validated: dict[str, float] = {}
+        # 缓存键 -> 进行中的获取
+        self._pending: dict[str, _PendingFetch] = {}
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name), os.path.join(self.cache_dir, f'{name}.json')
+
+    @staticmethod
+    def _load_meta(meta_path: str) -> dict | None:
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_meta(meta_path: str, meta: dict):
+        tmp_path = f'{meta_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def _is_fresh(self, item: DownloadItem, meta: dict | None, data_path: str, session, headers: dict) -> bool:
+        """缓存的文件是否仍可使用：sha256与期望一致，或下载源的大小和ETag/Last-Modified与记录一致"""
+        if meta is None or not os.path.exists(data_path) or os.path.getsize(data_path) != meta.get('size'):
+            return False
+        if item.sha256:
+            return meta.get('sha256') == item.sha256
+        if time.monotonic() - self._validated.get(item.cache_key, float('-inf')) < REVALIDATE_INTERVAL:
+            return True
+        if not (meta.get('etag') or meta.get('last_modified')):
+            return False
+        try:
+            info = probe(session, item.url, headers)
+        except requests.RequestException:
+            return False
+        return (info.size, info.etag or '', info.last_modified or '') == \
+            (meta.get('size'), meta.get('etag') or '', meta.get('last_modified') or '')
+
+    def fetch(self, item: DownloadItem) -> RelayFile:
+        """
+        确认缓存是否可用，不可用时开始获取（阻塞调用，不等待获取完成）
+
+        Returns:
+            RelayFile，使用完后需要调用release()；获取失败在wait()或上传时抛出
+        """
+        key = item.cache_key
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            with key_lock:
+                pending = self._pending.get(key)
+                if pending is not None:
+                    # 其他主机已开始获取，共用这次获取
+                    return RelayFile(key, pending.data_path, None, item.sha256, True, pending)
+                return self._fetch(item, key_lock)
+        except BaseException:
+            self._release_key(key)
+            raise
+
+    def _fetch(self, item: DownloadItem, key_lock: threading.Lock) -> RelayFile:
+        key = item.cache_key
+        data_path, meta_path = self._paths(key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        headers = dict(item.headers, **{'User-Agent': USER_AGENT})
+        session = self._session_factory()
+        try:
+            meta = self._load_meta(meta_path)
+            fresh = self._is_fresh(item, meta, data_path, session, headers)
+        finally:
+            session.close()
+        if fresh:
+            meta['last_used'] = time.time()
+            self._save_meta(meta_path, meta)
+            self._validated[key] = time.monotonic()
+            return RelayFile(key, data_path, meta['size'], meta['sha256'], False)
+        pending = self._pending[key] = _PendingFetch(data_path)
+        threading.Thread(target=self._download, args=(item, pending, key_lock), daemon=True).start()
+        return RelayFile(key, data_path, None, item.sha256, True, pending)
+
+    def _download(self, item: DownloadItem, pending: _PendingFetch, key_lock: threading.Lock):
+        """后台获取：单段下载（.part 从头连续写入，才能边获取边上传），中断的下载保留在 .part 中，下次从断点继续"""
+        key = item.cache_key
+        data_path, meta_path = self._paths(key)
+        headers = dict(item.headers, **{'User-Agent': USER_AGENT})
+        session = self._session_factory()
+        meta = error = None
+        try:
+            result = download_resumable(session, item.url, data_path, headers=headers, segments=1,
+                                        expected_hash=item.sha256, progress=pending.progress)
+            info = probe(session, item.url, headers) if not item.sha256 else None
+            meta = {
+                'key': key,
+                'url': item.url,
+                'filename': item.filename,
+                'size': result.size,
+                'etag': info.etag if info else '',
+                'last_modified': info.last_modified if info else '',
+                'sha256': result.digest if result.hash_algorithm == 'sha256' else file_digest(data_path),
+                'last_used': time.time(),
+            }
+            self._save_meta(meta_path, meta)
+            self._validated[key] = time.monotonic()
+        except BaseException as e:
+            error = e
+        finally:
+            session.close()
+            with key_lock:
+                self._pending.pop(key, None)
+        if meta is not None:
+            pending.finish(meta['size'], meta['sha256'])
+            self._evict()
+        else:
+            pending.finish(error=error)
+
+    def upload(self, relay_file: RelayFile, transfer, remote_path: str) -> bool:
+        """
+        把文件上传到主机（阻塞调用）：获取尚未完成时边获取边上传，上传的内容与获取结果的sha256不一致时重新上传
+
+        Args:
+            transfer: 目标主机的remote_transfer.RemoteTransfer
+
+        Returns:
+            是否实际上传（主机上已有相同文件时为False）
+        """
+        if not relay_file.complete:
+            reader = _StreamReader(relay_file.pending)
+            try:
+                digest = transfer.put_stream(reader, remote_path)
+                relay_file.wait()
+                if digest == relay_file.sha256:
+                    return True
+            except RelayRestarted:
+                pass
+            finally:
+                reader.close()
+        # 获取已完成，或边获取边上传的内容作废：按完整的文件上传
+        relay_file.wait()
+        return transfer.put_file(relay_file.path, remote_path, relay_file.sha256)
+
+    def release(self, relay_file: RelayFile):
+        self._release_key(relay_file.key)
+
+    def _release_key(self, key: str):
+        with self._lock:
+            count = self._in_use.get(key, 0) - 1
+            if count > 0:
+                self._in_use[key] = count
+            else:
+                self._in_use.pop(key, None)
+
+    def _evict(self):
+        """总大小超过上限时按最近使用时间删除（不删除正在使用的文件）"""
+        if not self.limit:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            meta = self._load_meta(os.path.join(self.cache_dir, name))
+            if meta and meta.get('key'):
+                entries.append(meta)
+        total = sum(meta.get('size') or 0 for meta in entries)
+        for meta in sorted(entries, key=lambda m: m.get('last_used') or 0):
+            if total <= self.limit:
+                break
+            with self._lock:
+                if meta['key'] in self._in_use:
+                    continue
+                data_path, meta_path = self._paths(meta['key'])
+                for path in (meta_path, data_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self._validated.pop(meta['key'], None)
+            total -= meta.get('size') or 0
+
+
+class DownloadBatch:
+    """
+    多主机任务中的一批下载链接：飞牛链接只解析一次，所有主机共用解析结果；
+    relay为RelayCache时文件由服务端获取后上传到各主机，为None时各主机自己下载
+    """
+
+    def __init__(self, urls: list[str], relay: RelayCache | None = None):
+        self.urls = urls
+        self.relay = relay
+        self._items = None
+        self._lock = threading.Lock()
+
+    def items(self) -> list[DownloadItem]:
+        """解析后的下载项（阻塞调用，第一次调用时解析）"""
+        with self._lock:
+            if self._items is None:
+                self._items = resolve_downloads(self.urls)
+            return self._items
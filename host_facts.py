@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+远程主机信息缓存
+连接建立后一次远程调用收集compose命令、CPU数、架构、磁盘剩余空间和常用工具，
+之后的部署、下载等操作直接读取缓存，不再重复探测
+"""
+
+import os
+import shlex
+import threading
+import time
+from typing import Callable
+
+# 缓存有效期（秒）
+DEFAULT_TTL = float(os.environ.get('NASPT_HOST_FACTS_TTL', 600))
+# 需要探测的工具
+TOOLS = ('curl', 'wget', 'tar', 'pigz', 'file')
+
+_FACTS_SCRIPT = r'''
+if docker compose version >/dev/null 2>&1; then echo "compose=docker compose";
+elif command -v docker-compose >/dev/null 2>&1; then echo "compose=docker-compose";
+else echo "compose="; fi
+echo "arch=$(uname -m)"
+echo "cpus=$(getconf _NPROCESSORS_ONLN 2>/dev/null || nproc 2>/dev/null || echo 1)"
+for t in {tools}; do if command -v $t >/dev/null 2>&1; then echo "tool_$t=1"; else echo "tool_$t=0"; fi; done
+d={base}; while [ ! -d "$d" ] && [ "$d" != "/" ]; do d=$(dirname "$d"); done
+echo "disk_free_kb=$(df -Pk "$d" 2>/dev/null | awk 'NR==2 {{print $4}}')"
+echo "base_exists=$([ -d {base} ] && echo 1 || echo 0)"
+'''
+
+
+def parse_facts(output: str) -> dict:
+    """解析探测脚本输出的 key=value 行"""
+    raw = {}
+    for line in output.splitlines():
+        if '=' in line:
+            key, value = line.split('=', 1)
+            raw[key.strip()] = value.strip()
+    try:
+        cpus = int(raw.get('cpus') or 1)
+    except ValueError:
+        cpus = 1
+    try:
+        disk_free = int(raw['disk_free_kb']) * 1024 if raw.get('disk_free_kb') else None
+    except ValueError:
+        disk_free = None
+    return {
+        # 两种compose都检测不到时保持原有行为，使用docker-compose
+        'compose': raw.get('compose') or 'docker-compose',
+        'compose_available': bool(raw.get('compose')),
+        'arch': raw.get('arch', ''),
+        'cpus': cpus,
+        'tools': {tool: raw.get(f'tool_{tool}') == '1' for tool in TOOLS},
+        'disk_free': disk_free,
+        'base_exists': raw.get('base_exists') == '1',
+    }
+
+
+class HostFacts:
+    """一台主机的信息缓存，带有效期，可显式失效"""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, privileged: Callable[[str], tuple[int, str, str]] | None = None):
+        """
+        Args:
+            privileged: 以root执行命令的函数（见ssh_pool.PooledConnection.run_privileged），
+                非root登录时登录用户无权创建的目录改用它创建
+        """
+        self.ttl = ttl
+        self.privileged = privileged
+        self.facts: dict | None = None
+        self.base_dir: str | None = None
+        self.collected_at: float | None = None
+        # 已确认存在的远程目录，避免重复mkdir -p
+        self.ready_dirs: set[str] = set()
+        self._lock = threading.Lock()
+
+    def is_fresh(self, base_dir: str | None = None) -> bool:
+        if self.facts is None or self.collected_at is None:
+            return False
+        if base_dir is not None and base_dir != self.base_dir:
+            return False
+        return time.monotonic() - self.collected_at < self.ttl
+
+    @staticmethod
+    def build_script(base_dir: str) -> str:
+        """生成探测脚本（其他SSH实现可自行执行后交给store()）"""
+        return _FACTS_SCRIPT.format(tools=' '.join(TOOLS), base=shlex.quote(base_dir))
+
+    def refresh(self, client, base_dir: str, timeout: float = 10) -> dict:
+        """执行一次远程探测并更新缓存"""
+        stdin, stdout, stderr = client.exec_command(self.build_script(base_dir), timeout=timeout)
+        return self.store(stdout.read().decode('utf-8', errors='ignore'), base_dir)
+
+    def store(self, output: str, base_dir: str) -> dict:
+        """解析探测脚本的输出并更新缓存"""
+        facts = parse_facts(output)
+        with self._lock:
+            self.facts = facts
+            self.base_dir = base_dir
+            self.collected_at = time.monotonic()
+            # 目录状态与其他信息同一有效期，重新探测后需要重新确认
+            self.ready_dirs.clear()
+        return facts
+
+    def get(self, client, base_dir: str) -> dict:
+        """读取缓存，过期或基础目录不同时重新探测"""
+        if self.is_fresh(base_dir):
+            return self.facts
+        return self.refresh(client, base_dir)
+
+    def invalidate(self):
+        with self._lock:
+            self.facts = None
+            self.collected_at = None
+            self.ready_dirs.clear()
+
+    def ensure_dirs(self, client, *dirs: str, timeout: float = 5):
+        """
+        创建尚未确认存在的目录，已创建过的目录不再发起远程调用；
+        登录用户没有权限（如 /docker/naspt 属于root）时经sudo创建
+        """
+        missing = [d for d in dirs if d not in self.ready_dirs]
+        if not missing:
+            return
+        command = f"mkdir -p {' '.join(shlex.quote(d) for d in missing)}"
+        stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+        if stdout.channel.recv_exit_status() != 0:
+            error = stderr.read().decode('utf-8', errors='ignore').strip()
+            if self.privileged is not None:
+                status, _, error = self.privileged(command)
+                if status == 0:
+                    error = None
+            if error is not None:
+                raise Exception(f"创建目录失败: {error}")
+        with self._lock:
+            self.ready_dirs.update(missing)
+
+    def snapshot(self) -> dict:
+        """返回可发送给前端的信息"""
+        with self._lock:
+            if self.facts is None:
+                return {}
+            return dict(self.facts, base_dir=self.base_dir,
+                        age_seconds=round(time.monotonic() - self.collected_at, 1))
@@ -5,14 +5,21 @@
 用于解析飞牛分享链接，获取文件列表和下载链接
 """
 
+import os
 import requests
 import re
 import json
 import time
 import hashlib
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse, parse_qs
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from requests.adapters import HTTPAdapter
+
+from resumable_download import download_resumable, probe, DownloadResult
 
 # 尝试导入selenium（可选）
 try:
@@ -25,6 +32,70 @@ try:
 except ImportError:
     SELENIUM_AVAILABLE = False
 
+# 并发获取各文件下载链接的线程数上限，可通过 NASPT_SHARE_LINK_WORKERS 配置
+LINK_RESOLVE_WORKERS = int(os.environ.get('NASPT_SHARE_LINK_WORKERS', 8))
+# _generate_authx支持的签名方法
+SIGN_METHODS = tuple(range(6))
+
+
+class SignMethodRegistry:
+    """
+    按飞牛服务地址（base_url）记住验证通过的签名方法
+
+    下次解析先尝试上次成功的方法，正常情况下获取文件列表只需一次请求；
+    签名被拒绝的方法按连续失败次数排到后面，服务端更换算法后新的可用方法会逐渐排到前面
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # base_url -> {'preferred': 方法或None, 'methods': {方法: {'success', 'failure', 'streak'}}}
+        self._hosts: Dict[str, Dict] = {}
+
+    def _host(self, base_url: str) -> Dict:
+        host = self._hosts.get(base_url)
+        if host is None:
+            host = self._hosts[base_url] = {
+                'preferred': None,
+                'methods': {method: {'success': 0, 'failure': 0, 'streak': 0} for method in SIGN_METHODS},
+            }
+        return host
+
+    def order(self, base_url: str) -> List[int]:
+        """尝试顺序：上次成功的方法，其余按连续失败次数从少到多（相同时按编号）"""
+        with self._lock:
+            host = self._host(base_url)
+            return sorted(SIGN_METHODS, key=lambda m: (m != host['preferred'], host['methods'][m]['streak'], m))
+
+    def record(self, base_url: str, method: int, success: bool):
+        with self._lock:
+            host = self._host(base_url)
+            counts = host['methods'][method]
+            if success:
+                counts['success'] += 1
+                counts['streak'] = 0
+                host['preferred'] = method
+            else:
+                counts['failure'] += 1
+                counts['streak'] += 1
+                if host['preferred'] == method:
+                    host['preferred'] = None
+
+    def stats(self) -> Dict:
+        """各服务地址当前使用的方法和每个方法的成功/失败次数"""
+        with self._lock:
+            return {
+                base_url: {
+                    'preferred': host['preferred'],
+                    'probes': sum(c['success'] + c['failure'] for c in host['methods'].values()),
+                    'methods': {str(m): dict(c) for m, c in host['methods'].items() if c['success'] or c['failure']},
+                }
+                for base_url, host in self._hosts.items()
+            }
+
+
+# 进程内共用
+sign_methods = SignMethodRegistry()
+
 
 class FeiNiuShareParser:
     """飞牛分享链接解析器"""
@@ -49,6 +120,10 @@ class FeiNiuShareParser:
         self.session = requests.Session()
         # 明确禁用代理，避免读取环境变量中的代理设置
         self.session.proxies = {}
+        # 并发获取下载链接时共用连接池，每个线程一个连接
+        adapter = HTTPAdapter(pool_maxsize=max(10, LINK_RESOLVE_WORKERS))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36',
             'Accept': 'application/json, text/plain, */*',
@@ -505,12 +580,13 @@ class FeiNiuShareParser:
         except Exception as e:
             raise Exception(f"获取文件列表失败: {str(e)}")
     
-    def get_file_list(self, path: str = "/", sign_method: int = 0) -> List[Dict]:
+    def get_file_list(self, path: str = "/", sign_method: int = 0, file_id=None) -> List[Dict]:
         """
         获取文件列表
         
         Args:
             path: 要列出的路径，默认为根路径
+            file_id: 要列出的目录的fileId（子目录），根路径为None
             
         Returns:
             文件列表
@@ -523,7 +599,7 @@ class FeiNiuShareParser:
         data = {
             "shareId": self.share_id,
             "path": path,
-            "fileId": None
+            "fileId": file_id
         }
         
         headers = {
@@ -762,76 +838,96 @@ class FeiNiuShareParser:
         except Exception as e:
             raise Exception(f"获取下载链接失败: {str(e)}")
     
-    def download_file(self, download_url: str, save_path: str = None, chunk_size: int = 8192) -> str:
+    def download_file(self, download_url: str, save_path: str = None, chunk_size: int = 8192,
+                      segments: Optional[int] = None, expected_hash: Optional[str] = None) -> str:
         """
-        下载文件
+        下载文件（支持断点续传，见resumable_download）
         
         Args:
             download_url: 下载链接
             save_path: 保存路径，如果为None则使用文件名
-            chunk_size: 下载块大小
+            chunk_size: 保留参数，读取块大小由resumable_download决定
+            segments: 分段并行下载的段数，None使用默认值
+            expected_hash: 期望的sha256（十六进制），不一致时删除文件并报错
             
         Returns:
             保存的文件路径
         """
-        import os
-        from urllib.parse import urlparse, parse_qs
-        
         # 确保有auth和cookie
         if not self.auth:
             self.get_share_info()
         
-        # 从URL中提取文件名（如果有）
-        parsed = urlparse(download_url)
-        query_params = parse_qs(parsed.query)
-        
-        # 如果没有指定保存路径，尝试从URL或响应头获取文件名
-        if not save_path:
-            # 尝试从Content-Disposition头获取文件名
-            response = self.session.head(download_url, cookies=self.cookies, allow_redirects=True)
-            content_disposition = response.headers.get('Content-Disposition', '')
-            if 'filename=' in content_disposition:
-                filename = content_disposition.split('filename=')[1].strip('"\'')
-                save_path = filename
-            else:
-                # 默认使用share_id作为文件名
-                save_path = f"download_{self.share_id}.bin"
-        
-        # 确保目录存在
-        os.makedirs(os.path.dirname(save_path) if os.path.dirname(save_path) else '.', exist_ok=True)
-        
         # 下载文件
         headers = {
             'Referer': f'{self.base_url}/s/{self.share_id}',
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
         }
         
-        print(f"  开始下载到: {save_path}")
-        response = self.session.get(download_url, headers=headers, cookies=self.cookies, stream=True)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('Content-Length', 0))
-        downloaded = 0
-        
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        percent = (downloaded / total_size) * 100
-                        print(f"\r  进度: {percent:.1f}% ({downloaded}/{total_size} 字节)", end='', flush=True)
+        # 如果没有指定保存路径，尝试从响应头获取文件名
+        if not save_path:
+            info = probe(self.session, download_url, headers, self.cookies)
+            # 默认使用share_id作为文件名
+            save_path = info.filename or f"download_{self.share_id}.bin"
         
-        print(f"\n  ✓ 下载完成: {save_path}")
+        print(f"  开始下载到: {save_path}")
+        result = download_resumable(self.session, download_url, save_path, headers=headers, cookies=self.cookies,
+                                    segments=segments, expected_hash=expected_hash, progress=_print_progress)
+        _print_result(result, indent='  ')
         return save_path
     
-    def parse_all(self) -> Dict:
+    def list_files(self, path: str = "/", file_id=None) -> Tuple[List[Dict], Optional[int]]:
+        """
+        按sign_methods给出的顺序尝试签名方法获取文件列表，并记录各方法的结果
+        
+        Returns:
+            (文件列表, 成功的签名方法)，所有方法的签名都被拒绝时为([], None)
+        """
+        for method in sign_methods.order(self.base_url):
+            try:
+                file_list = self.get_file_list(path, sign_method=method, file_id=file_id)
+                # 如果get_file_list没有抛出异常，说明签名验证通过
+                sign_methods.record(self.base_url, method, True)
+                print(f"  ✓ 成功！使用签名方法 {method}")
+                return file_list, method
+            except Exception as e:
+                error_msg = str(e).lower()
+                if "invalid sign" in error_msg or "5000" in error_msg:
+                    # 签名错误，继续尝试下一个方法
+                    sign_methods.record(self.base_url, method, False)
+                    continue
+                else:
+                    # 其他错误，直接抛出
+                    raise
+        return [], None
+    
+    def parse_all(self, link_workers: Optional[int] = None, recursive: bool = False,
+                  max_depth: Optional[int] = None, pattern: Optional[str] = None) -> Dict:
         """
         解析分享链接，获取所有信息
         
+        Args:
+            link_workers: 并发获取各文件下载链接的线程数，None使用LINK_RESOLVE_WORKERS
+            recursive: 展开子目录（见share_walker），子目录中的文件在file_download_map中以相对路径为键
+            max_depth: recursive时最多展开的目录层数，None不限制
+            pattern: recursive时只保留匹配的文件（glob，匹配文件名或相对路径）
+        
         Returns:
             包含文件列表和下载链接的字典
         """
+        for event, payload in self.iter_parse(link_workers, recursive, max_depth, pattern):
+            if event == 'done':
+                return payload
+    
+    def iter_parse(self, link_workers: Optional[int] = None, recursive: bool = False,
+                   max_depth: Optional[int] = None, pattern: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        逐步解析分享链接（参数同parse_all），每得到一项信息就产出一个 (事件, 内容)：
+            share: {'share_id', 'share_url', 'auth'}，获取到分享信息后
+            file: 文件列表中的一个条目（recursive时每个目录列出后立即产出）
+            link: {'file', 'url'}，每个文件的下载链接获取完成时（按完成的先后），失败时url为None并带error；
+                  使用提供的下载token构建的链接file为None
+            done: 与parse_all相同的结果，file_download_map仍按文件列表的顺序
+        """
         print(f"正在解析分享链接: {self.share_url}")
         
         # 1. 获取分享信息
@@ -839,14 +935,26 @@ class FeiNiuShareParser:
         share_info = self.get_share_info()
         print(f"  - 分享ID: {self.share_id}")
         print(f"  - Auth: {self.auth}")
+        yield 'share', {'share_id': self.share_id, 'share_url': self.share_url, 'auth': self.auth}
         
         # 2. 获取文件列表
         print("\n步骤2: 获取文件列表...")
         file_list = []
         successful_method = None
         
+        # 展开子目录时直接使用API请求（每个目录都要单独列出）
+        if recursive:
+            from share_walker import ShareWalker
+            walker = ShareWalker(self, max_depth=max_depth, pattern=pattern)
+            for item in walker.walk():
+                file_list.append(item)
+                yield 'file', item
+            successful_method = walker.sign_method
+            for error in walker.errors:
+                print(f"  - 警告: 目录 {error['path']} 列出失败: {error['error']}")
+        
         # 首先尝试使用Selenium拦截API请求（最可靠的方法）
-        if SELENIUM_AVAILABLE:
+        elif SELENIUM_AVAILABLE:
             try:
                 print("  - 尝试使用Selenium拦截API请求...")
                 file_list = self.get_file_list_via_api_intercept()
@@ -857,26 +965,9 @@ class FeiNiuShareParser:
                 print(f"  - Selenium拦截失败: {str(e)}")
                 print("  - 回退到API请求方法...")
         
-        # 如果Selenium失败，尝试API请求方法（尝试不同的签名方法）
-        if not file_list:
-            for method in range(6):
-                try:
-                    file_list = self.get_file_list(sign_method=method)
-                    # 检查是否成功（有文件列表且不是错误响应）
-                    if file_list or (isinstance(file_list, list) and len(file_list) >= 0):
-                        # 验证响应不是错误
-                        # 如果get_file_list没有抛出异常，说明可能成功了
-                        successful_method = method
-                        print(f"  ✓ 成功！使用签名方法 {method}")
-                        break
-                except Exception as e:
-                    error_msg = str(e).lower()
-                    if "invalid sign" in error_msg or "5000" in error_msg:
-                        # 签名错误，继续尝试下一个方法
-                        continue
-                    else:
-                        # 其他错误，直接抛出
-                        raise
+        # 如果Selenium失败，尝试API请求方法（尝试不同的签名方法，上次在该服务上成功的方法优先）
+        if not file_list and not recursive:
+            file_list, successful_method = self.list_files()
         
         if successful_method is None:
             print("  - 警告: 所有方法都失败了")
@@ -889,6 +980,8 @@ class FeiNiuShareParser:
         for item in file_list:
             item_type = "文件夹" if item.get('isDir') else "文件"
             print(f"    - {item_type}: {item.get('path', 'N/A')} (ID: {item.get('fileId', 'N/A')})")
+            if not recursive:
+                yield 'file', item
         
         # 3. 获取下载链接
         download_links = []
@@ -901,6 +994,7 @@ class FeiNiuShareParser:
                 direct_download_link = f"{self.base_url}/s/download/{self.share_id}?token={download_token}"
                 download_links.append(direct_download_link)
                 print(f"  - 使用提供的下载token构建链接: {direct_download_link}")
+                yield 'link', {'file': None, 'url': direct_download_link}
         
         # 方法2: 如果有文件列表且签名方法成功，为每个文件单独获取下载链接
         if file_list and successful_method is not None and successful_method != 'selenium':
@@ -908,22 +1002,48 @@ class FeiNiuShareParser:
             files_to_download = [f for f in file_list if not f.get('isDir', False)]
             
             if files_to_download:
-                print(f"  - 为 {len(files_to_download)} 个文件获取单独的下载链接...")
-                for file_item in files_to_download:
+                workers = max(1, min(link_workers or LINK_RESOLVE_WORKERS, len(files_to_download)))
+                print(f"  - 为 {len(files_to_download)} 个文件获取单独的下载链接（并发 {workers}）...")
+                
+                def resolve(file_item):
+                    file_name = file_item.get('file', '未知文件')
+                    return self.get_download_link([_strip_walk_fields(file_item)], download_filename=file_name,
+                                                  sign_method=successful_method)
+                
+                # 子目录中的文件可能与其他目录重名，使用相对路径
+                file_names = [f['path'].lstrip('/') if f.get('depth') else f.get('file', '未知文件')
+                              for f in files_to_download]
+                # 各请求共用同一个session（Cookie和连接池），每个链接获取完成就产出，
+                # 结果最后按文件列表的顺序汇总，与逐个获取时一致
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(resolve, file_item): index
+                               for index, file_item in enumerate(files_to_download)}
                     try:
-                        file_name = file_item.get('file', '未知文件')
-                        download_link = self.get_download_link([file_item], download_filename=file_name, sign_method=successful_method)
-                        if download_link and download_link not in download_links:
-                            download_links.append(download_link)
-                            file_download_map[file_name] = download_link
-                            print(f"    ✓ {file_name}: {download_link}")
-                    except Exception as e:
-                        print(f"    ✗ {file_name}: 获取失败 - {str(e)}")
+                        for future in as_completed(futures):
+                            file_name = file_names[futures[future]]
+                            try:
+                                download_link = future.result()
+                            except Exception as e:
+                                print(f"    ✗ {file_name}: 获取失败 - {str(e)}")
+                                yield 'link', {'file': file_name, 'url': None, 'error': str(e)}
+                                continue
+                            if download_link:
+                                print(f"    ✓ {file_name}: {download_link}")
+                                yield 'link', {'file': file_name, 'url': download_link}
+                    finally:
+                        # 调用方提前结束时不再发出排队中的请求
+                        for future in futures:
+                            future.cancel()
+                for future, index in futures.items():
+                    download_link = None if future.exception() else future.result()
+                    if download_link and download_link not in download_links:
+                        download_links.append(download_link)
+                        file_download_map[file_names[index]] = download_link
         
         if not download_links:
             print("  - 警告: 未能获取下载链接")
         
-        return {
+        yield 'done', {
             'share_id': self.share_id,
             'share_url': self.share_url,
             'auth': self.auth,
@@ -933,9 +1053,30 @@ class FeiNiuShareParser:
         }
 
 
-def download_file_from_result(download_url: str, share_id: str, auth: str, share_url: str, save_path: str = None):
+def _strip_walk_fields(file_item: Dict) -> Dict:
+    """去掉share_walker附加的字段，按列表接口返回的原样提交给下载接口"""
+    return {k: v for k, v in file_item.items() if k not in ('depth', 'parent', 'index')}
+
+
+def _print_progress(downloaded: int, total: Optional[int], indent: str = '  '):
+    if total:
+        percent = (downloaded / total) * 100
+        print(f"\r{indent}进度: {percent:.1f}% ({downloaded}/{total} 字节)", end='', flush=True)
+    else:
+        print(f"\r{indent}已下载: {downloaded} 字节", end='', flush=True)
+
+
+def _print_result(result: DownloadResult, indent: str = ''):
+    if result.resumed_bytes:
+        print(f"\n{indent}从断点继续，复用已下载的 {result.resumed_bytes} 字节", end='')
+    print(f"\n{indent}✓ 下载完成: {result.path} ({result.size} 字节，{result.segments} 段)")
+    print(f"{indent}  {result.hash_algorithm}: {result.digest}")
+
+
+def download_file_from_result(download_url: str, share_id: str, auth: str, share_url: str, save_path: str = None,
+                              segments: Optional[int] = None, expected_hash: Optional[str] = None):
     """
-    从解析结果下载文件
+    从解析结果下载文件（支持断点续传，见resumable_download）
     
     Args:
         download_url: 下载链接
@@ -943,6 +1084,8 @@ def download_file_from_result(download_url: str, share_id: str, auth: str, share
         auth: auth值
         share_url: 分享链接
         save_path: 保存路径
+        segments: 分段并行下载的段数，None使用默认值（NASPT_DOWNLOAD_SEGMENTS）
+        expected_hash: 期望的sha256（十六进制），不一致时删除文件并报错
     """
     import re
     
@@ -978,23 +1121,10 @@ def download_file_from_result(download_url: str, share_id: str, auth: str, share
     
     print(f"下载: {save_path}")
     
-    # 下载文件
-    response = session.get(download_url, headers=headers, stream=True)
-    response.raise_for_status()
-    
-    total_size = int(response.headers.get('Content-Length', 0))
-    downloaded = 0
-    
-    with open(save_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-                downloaded += len(chunk)
-                if total_size > 0:
-                    percent = (downloaded / total_size) * 100
-                    print(f"\r进度: {percent:.1f}% ({downloaded}/{total_size} 字节)", end='', flush=True)
-    
-    print(f"\n✓ 下载完成: {save_path} ({downloaded} 字节)")
+    # 下载文件（中断后再次执行会从断点继续）
+    result = download_resumable(session, download_url, save_path, headers=headers, segments=segments,
+                                expected_hash=expected_hash, progress=lambda done, total: _print_progress(done, total, indent=''))
+    _print_result(result)
     return save_path
 
 
@@ -1048,26 +1178,58 @@ def main():
         return
     
     # 解析模式
-    if len(sys.argv) < 2:
+    args = []
+    refresh = recursive = False
+    max_depth = pattern = None
+    argv = iter(sys.argv[1:])
+    for arg in argv:
+        if arg == '--refresh':
+            refresh = True
+        elif arg == '--recursive':
+            recursive = True
+        elif arg == '--max-depth':
+            value = next(argv, '')
+            if not value.isdigit():
+                print("错误: --max-depth 需要一个非负整数", file=sys.stderr)
+                sys.exit(1)
+            max_depth = int(value)
+        elif arg == '--pattern':
+            pattern = next(argv, None)
+        else:
+            args.append(arg)
+    if not args:
         print("用法:")
-        print("  解析分享链接: python parse_share_link.py <分享链接> [auth值] [download_token]")
+        print("  解析分享链接: python parse_share_link.py <分享链接> [auth值] [download_token] [--refresh]")
+        print("               [--recursive [--max-depth 层数] [--pattern 通配符]]")
         print("  下载文件: python parse_share_link.py <share_result.json> [文件1] [文件2] ...")
         print("\n示例:")
         print("  python parse_share_link.py https://fn.frp.naspt.vip/s/53060aaa3fb449dea2")
+        print("  python parse_share_link.py https://fn.frp.naspt.vip/s/53060aaa3fb449dea2 --recursive --pattern '*.tgz'")
         print("  python parse_share_link.py share_result_53060aaa3fb449dea2.json")
         print("  python parse_share_link.py share_result_53060aaa3fb449dea2.json clash.tgz roon.tgz")
         print("\n提示:")
         print("  - auth值: 从浏览器开发者工具的Network标签中获取请求头中的 'Auth' 值")
         print("  - download_token: 从浏览器中获取的下载token（32位十六进制字符串）")
+        print("  - 设置 NASPT_SHARE_CACHE_FILE 时解析结果缓存到该文件（与Web服务共用），--refresh 忽略缓存重新解析")
+        print("  - --recursive 展开子目录（子目录中的文件以相对路径为名），--max-depth 限制展开的层数，")
+        print("    --pattern 只保留匹配的文件（匹配文件名或相对路径）")
         sys.exit(1)
     
-    share_url = sys.argv[1]
-    auth = sys.argv[2] if len(sys.argv) > 2 else None
-    download_token = sys.argv[3] if len(sys.argv) > 3 else None
+    share_url = args[0]
+    auth = args[1] if len(args) > 1 else None
+    download_token = args[2] if len(args) > 2 else None
     
     try:
-        parser = FeiNiuShareParser(share_url, auth=auth, download_token=download_token)
-        result = parser.parse_all()
+        if auth or download_token:
+            # 手动提供的认证信息只用于本次解析，不经过缓存
+            result = FeiNiuShareParser(share_url, auth=auth, download_token=download_token).parse_all(
+                recursive=recursive, max_depth=max_depth, pattern=pattern)
+        else:
+            from share_cache import share_cache
+            result, cached = share_cache.get(share_url, refresh=refresh, recursive=recursive,
+                                             max_depth=max_depth, pattern=pattern)
+            if cached:
+                print(f"使用缓存的解析结果（--refresh 重新解析）: {share_url}")
         
         print("\n" + "="*60)
         print("解析结果:")
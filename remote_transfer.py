@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+远程文件传输
+通过已有传输上的SFTP会话写入文件，内容与远程一致时跳过上传；
+先写临时文件再原子重命名，不会留下写了一半的文件。
+SFTP以登录用户的身份读写，非root登录时目标目录属于root会权限不足：此时先上传到登录用户的主目录，
+再经sudo（见ssh_pool.PooledConnection.run_privileged）移动到目标位置，读取和删除同样改用sudo
+"""
+
+import errno
+import hashlib
+import os
+import posixpath
+import shlex
+import threading
+import uuid
+from typing import Callable
+
+import paramiko
+
+# 上传本地文件时每次读取的大小
+FILE_CHUNK_SIZE = 256 * 1024
+
+
+class RemoteTransfer:
+    """一个SSH连接上的文件传输（复用同一个SFTP会话）"""
+
+    def __init__(self, client: paramiko.SSHClient, privileged: Callable[[str], tuple[int, str, str]] | None = None):
+        """
+        Args:
+            privileged: 以root执行命令的函数，返回(退出码, stdout, stderr)；None时权限不足直接报错
+        """
+        self.client = client
+        self.privileged = privileged
+        self._sftp: paramiko.SFTPClient | None = None
+        # 远程路径 -> (sha256, 大小, 修改时间)，记录本连接上传过的内容
+        self._memo: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        # paramiko的SFTP会话不支持多个线程同时发请求（多主机任务与终端可能同时上传），同一连接上的上传逐个进行
+        self._io_lock = threading.Lock()
+
+    def sftp(self) -> paramiko.SFTPClient:
+        """获取SFTP会话，断开后自动重新打开"""
+        with self._lock:
+            if self._sftp is None or self._sftp.get_channel().closed:
+                self._sftp = self.client.open_sftp()
+            return self._sftp
+
+    def remote_sha256(self, remote_path: str) -> str | None:
+        """在远程计算文件的sha256，远程没有sha256sum时返回None"""
+        stdin, stdout, stderr = self.client.exec_command(f'sha256sum {shlex.quote(remote_path)} 2>/dev/null', timeout=10)
+        output = stdout.read().decode('utf-8', errors='ignore').split()
+        return output[0] if output else None
+
+    def is_unchanged(self, remote_path: str, digest: str, size: int) -> bool:
+        """判断远程文件内容是否与给定的sha256一致"""
+        try:
+            st = self.sftp().stat(remote_path)
+        except IOError:
+            return False
+        if st.st_size != size:
+            return False
+        if self._memo.get(remote_path) == (digest, st.st_size, st.st_mtime):
+            return True
+        if self.remote_sha256(remote_path) == digest:
+            self._memo[remote_path] = (digest, st.st_size, st.st_mtime)
+            return True
+        return False
+
+    def put_bytes(self, remote_path: str, data: bytes, mode: int = 0o644) -> bool:
+        """
+        写入远程文件，内容未变化时跳过
+
+        Returns:
+            是否实际上传了文件
+        """
+        with self._io_lock:
+            return self._put_bytes(remote_path, data, mode)
+
+    def _put_bytes(self, remote_path: str, data: bytes, mode: int) -> bool:
+        digest = hashlib.sha256(data).hexdigest()
+        if self.is_unchanged(remote_path, digest, len(data)):
+            return False
+        self._write_atomic(remote_path, lambda f: f.write(data), mode, digest)
+        return True
+
+    def put_file(self, local_path: str, remote_path: str, digest: str | None = None, mode: int = 0o644,
+                 callback=None) -> bool:
+        """
+        上传本地文件（分块读取，大文件不整个读入内存），内容未变化时跳过
+
+        Args:
+            digest: 本地文件的sha256，None时现场计算
+            callback: 回调(已上传字节数, 总字节数)
+
+        Returns:
+            是否实际上传了文件
+        """
+        size = os.path.getsize(local_path)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(local_path, 'rb') as src:
+                for chunk in iter(lambda: src.read(FILE_CHUNK_SIZE), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+
+        def write(f):
+            sent = 0
+            with open(local_path, 'rb') as src:
+                for chunk in iter(lambda: src.read(FILE_CHUNK_SIZE), b''):
+                    f.write(chunk)
+                    sent += len(chunk)
+                    if callback is not None:
+                        callback(sent, size)
+
+        with self._io_lock:
+            if self.is_unchanged(remote_path, digest, size):
+                return False
+            self._write_atomic(remote_path, write, mode, digest)
+            return True
+
+    def put_stream(self, reader, remote_path: str, mode: int = 0o644, callback=None) -> str:
+        """
+        上传一个边读边产生的数据流（如download_relay中边获取边上传的文件），不与远程内容比较
+
+        Args:
+            reader: 有read(size)方法的对象，返回b''表示结束
+            callback: 回调(已上传字节数, None)
+
+        Returns:
+            上传内容的sha256
+        """
+        sha = hashlib.sha256()
+        started = False
+
+        def write(f):
+            nonlocal started
+            if started:
+                # 数据流只能读取一次，不能在直接写入失败后再经sudo重写
+                raise PermissionError(errno.EACCES, f'写入失败: {remote_path}')
+            started = True
+            sent = 0
+            for chunk in iter(lambda: reader.read(FILE_CHUNK_SIZE), b''):
+                sha.update(chunk)
+                f.write(chunk)
+                sent += len(chunk)
+                if callback is not None:
+                    callback(sent, None)
+
+        with self._io_lock:
+            self._write_atomic(remote_path, write, mode, None)
+            self._remember(remote_path, sha.hexdigest())
+        return sha.hexdigest()
+
+    def _write_atomic(self, remote_path: str, write, mode: int, digest: str | None):
+        """write(f)写入临时文件后原子重命名为remote_path；目标目录无写权限时改用sudo"""
+        try:
+            self._write_direct(remote_path, write, mode)
+        except PermissionError:
+            if self.privileged is None:
+                raise
+            self._write_privileged(remote_path, write, mode)
+        if digest is not None:
+            self._remember(remote_path, digest)
+
+    def _remember(self, remote_path: str, digest: str):
+        """记录刚上传的内容，下次上传相同内容时不再计算远程sha256"""
+        try:
+            st = self.sftp().stat(remote_path)
+            self._memo[remote_path] = (digest, st.st_size, st.st_mtime)
+        except IOError:
+            # 登录用户无法访问目标目录时不记录，下次按内容比较
+            self._memo.pop(remote_path, None)
+
+    def _write_direct(self, remote_path: str, write, mode: int):
+        sftp = self.sftp()
+        tmp_path = posixpath.join(posixpath.dirname(remote_path),
+                                  f'.{posixpath.basename(remote_path)}.naspt-{uuid.uuid4().hex[:8]}')
+        try:
+            with sftp.open(tmp_path, 'wb') as f:
+                f.set_pipelined(True)
+                write(f)
+            sftp.chmod(tmp_path, mode)
+            try:
+                sftp.posix_rename(tmp_path, remote_path)
+            except IOError:
+                # 服务器不支持posix-rename扩展时，先删除再重命名
+                try:
+                    sftp.remove(remote_path)
+                except IOError:
+                    pass
+                sftp.rename(tmp_path, remote_path)
+        except Exception:
+            try:
+                sftp.remove(tmp_path)
+            except IOError:
+                pass
+            raise
+
+    def _write_privileged(self, remote_path: str, write, mode: int):
+        """先写到登录用户主目录下的临时文件，再以root安装到目标目录并原子重命名"""
+        sftp = self.sftp()
+        suffix = uuid.uuid4().hex[:8]
+        staged = posixpath.join(sftp.normalize('.'), f'.naspt-upload-{suffix}')
+        target_tmp = posixpath.join(posixpath.dirname(remote_path),
+                                    f'.{posixpath.basename(remote_path)}.naspt-{suffix}')
+        try:
+            with sftp.open(staged, 'wb') as f:
+                f.set_pipelined(True)
+                write(f)
+            status, _, error = self.privileged(
+                f'install -m {mode:o} {shlex.quote(staged)} {shlex.quote(target_tmp)} && '
+                f'mv -f {shlex.quote(target_tmp)} {shlex.quote(remote_path)} || '
+                f'{{ rm -f {shlex.quote(target_tmp)}; exit 1; }}')
+            if status != 0:
+                raise PermissionError(errno.EACCES, f'写入失败（sudo）: {error or remote_path}')
+        finally:
+            try:
+                sftp.remove(staged)
+            except IOError:
+                pass
+
+    def put_text(self, remote_path: str, text: str, mode: int = 0o644) -> bool:
+        return self.put_bytes(remote_path, text.encode('utf-8'), mode)
+
+    def get_text(self, remote_path: str) -> str | None:
+        """读取远程文本文件，文件不存在时返回None；登录用户无读取权限时经sudo读取"""
+        with self._io_lock:
+            try:
+                with self.sftp().open(remote_path, 'rb') as f:
+                    f.prefetch()
+                    return f.read().decode('utf-8', errors='replace')
+            except PermissionError:
+                if self.privileged is None:
+                    return None
+            except IOError:
+                return None
+        status, output, _ = self.privileged(f'cat {shlex.quote(remote_path)}')
+        return output if status == 0 else None
+
+    def remove(self, remote_path: str) -> bool:
+        """删除远程文件，返回是否删除成功（文件不存在时为False）"""
+        with self._io_lock:
+            self._memo.pop(remote_path, None)
+            try:
+                self.sftp().remove(remote_path)
+                return True
+            except PermissionError:
+                if self.privileged is None:
+                    return False
+            except IOError:
+                return False
+        status, _, _ = self.privileged(f'rm -f {shlex.quote(remote_path)}')
+        return status == 0
+
+    def close(self):
+        with self._lock:
+            if self._sftp is not None:
+                try:
+                    self._sftp.close()
+                except Exception:
+                    pass
+                self._sftp = None
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+断点续传下载（本地命令行使用，远程主机上的下载见download_jobs）
+下载先写入 .part 文件，旁边的 .part.json 记录服务端的ETag、Last-Modified、文件大小和各分段的进度；
+再次下载同一文件时，校验信息一致就用Range请求从断点继续，服务端支持Range且文件足够大时分段并行下载。
+完成后校验文件大小，提供了哈希值（或服务端返回Digest头）时校验哈希，不一致的文件不会留下
+"""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+# 默认分段数，可通过 NASPT_DOWNLOAD_SEGMENTS 配置；1表示不分段（仍支持断点续传）
+DEFAULT_SEGMENTS = int(os.environ.get('NASPT_DOWNLOAD_SEGMENTS', 1))
+# 分段数上限
+MAX_SEGMENTS = 16
+# 每段的最小字节数，文件小于 分段数 * MIN_SEGMENT_SIZE 时减少分段
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+# 单次读取的字节数
+CHUNK_SIZE = 64 * 1024
+# 保存进度和回调进度的间隔（秒）
+STATE_SAVE_INTERVAL = 1.0
+
+# Digest / Repr-Digest 头中的算法名 -> hashlib算法名
+_DIGEST_ALGORITHMS = {'sha-256': 'sha256', 'sha-512': 'sha512', 'md5': 'md5', 'sha': 'sha1'}
+_CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class DownloadError(Exception):
+    """下载失败（服务端不支持续传、大小不一致、哈希校验失败等）"""
+
+
+class RemoteFileInfo:
+    """服务端返回的文件信息，用于判断能否续传以及校验结果"""
+
+    def __init__(self, size: Optional[int] = None, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 accept_ranges: bool = False, digests: Optional[Dict[str, str]] = None, filename: Optional[str] = None):
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.accept_ranges = accept_ranges
+        # hashlib算法名 -> 十六进制哈希
+        self.digests = digests or {}
+        self.filename = filename
+
+    @property
+    def validator(self) -> Dict:
+        """判断 .part 文件是否仍属于同一个文件的依据"""
+        return {'size': self.size, 'etag': self.etag, 'last_modified': self.last_modified}
+
+    @property
+    def can_resume(self) -> bool:
+        """服务端支持Range，并且有办法确认文件没有变化"""
+        return self.accept_ranges and bool(self.etag or self.last_modified or self.size)
+
+
+class DownloadResult:
+    """下载结果"""
+
+    def __init__(self, path: str, size: int, hash_algorithm: str, digest: str, resumed_bytes: int, segments: int):
+        self.path = path
+        self.size = size
+        self.hash_algorithm = hash_algorithm
+        self.digest = digest
+        # 从上次中断处继续的字节数，0表示从头下载
+        self.resumed_bytes = resumed_bytes
+        self.segments = segments
+
+
+def parse_digest_header(value: Optional[str]) -> Dict[str, str]:
+    """解析 Digest: sha-256=<base64>, md5=<base64>（RFC 3230）或 Repr-Digest: sha-256=:<base64>:（RFC 9530）"""
+    digests = {}
+    for part in (value or '').split(','):
+        name, _, encoded = part.strip().partition('=')
+        algorithm = _DIGEST_ALGORITHMS.get(name.strip().lower())
+        if not algorithm or not encoded:
+            continue
+        try:
+            digests[algorithm] = base64.b64decode(encoded.strip().strip(':')).hex()
+        except ValueError:
+            continue
+    return digests
+
+
+def _filename_from_disposition(value: str) -> Optional[str]:
+    match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", value or '', re.I)
+    if match:
+        from urllib.parse import unquote
+        return unquote(match.group(1).strip('"\''))
+    if 'filename=' in (value or ''):
+        return value.split('filename=')[1].split(';')[0].strip('"\'')
+    return None
+
+
+def probe(session: requests.Session, url: str, headers: Optional[Dict] = None, cookies: Optional[Dict] = None,
+          timeout: float = 20) -> RemoteFileInfo:
+    """
+    获取文件大小、ETag等信息：先发HEAD请求，不支持HEAD时改用只取1个字节的Range请求
+    """
+    response = None
+    try:
+        response = session.head(url, headers=headers, cookies=cookies, allow_redirects=True, timeout=timeout)
+        if response.status_code >= 400:
+            response = None
+    except requests.RequestException:
+        response = None
+
+    if response is None:
+        range_headers = dict(headers or {}, Range='bytes=0-0')
+        response = session.get(url, headers=range_headers, cookies=cookies, stream=True, timeout=timeout)
+        response.close()
+        response.raise_for_status()
+
+    size = None
+    accept_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    match = _CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+    if response.status_code == 206 and match:
+        accept_ranges = True
+        size = int(match.group(3)) if match.group(3) != '*' else None
+    elif response.headers.get('Content-Length', '').isdigit() and 'Content-Encoding' not in response.headers:
+        size = int(response.headers['Content-Length'])
+
+    digests = parse_digest_header(response.headers.get('Repr-Digest') or response.headers.get('Digest'))
+    if response.headers.get('Content-MD5') and 'md5' not in digests:
+        digests.update(parse_digest_header(f"md5={response.headers['Content-MD5']}"))
+    return RemoteFileInfo(size=size, etag=response.headers.get('ETag'),
+                          last_modified=response.headers.get('Last-Modified'), accept_ranges=accept_ranges,
+                          digests=digests, filename=_filename_from_disposition(response.headers.get('Content-Disposition')))
+
+
+def _plan_segments(size: Optional[int], segments: int, accept_ranges: bool) -> List[List]:
+    """划分分段：[[起始位置, 结束位置（含，未知大小时为None）, 已下载字节数], ...]"""
+    if not size or not accept_ranges:
+        return [[0, size - 1 if size else None, 0]]
+    count = max(1, min(segments, MAX_SEGMENTS, size // MIN_SEGMENT_SIZE or 1))
+    step = -(-size // count)
+    return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+
+
+def _load_state(state_path: str) -> Optional[Dict]:
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(state_path: str, state: Dict):
+    tmp_path = f'{state_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def file_digest(path: str, algorithm: str = 'sha256') -> str:
+    """计算文件的哈希（十六进制）"""
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE * 16), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def download_resumable(session: requests.Session, url: str, save_path: str, headers: Optional[Dict] = None,
+                       cookies: Optional[Dict] = None, segments: Optional[int] = None,
+                       expected_hash: Optional[str] = None, hash_algorithm: str = 'sha256',
+                       progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                       timeout: float = 30) -> DownloadResult:
+    """
+    断点续传下载到save_path
+
+    Args:
+        session: requests会话（分段下载时多个线程共用）
+        headers / cookies: 每个请求附带的请求头和Cookie
+        segments: 分段数，None使用DEFAULT_SEGMENTS；服务端不支持Range或文件较小时自动减少
+        expected_hash: 期望的哈希值（十六进制），不一致时删除文件并抛出DownloadError
+        hash_algorithm: expected_hash的算法；未提供expected_hash时使用服务端Digest头中的哈希（如果有）
+        progress: 回调(已下载字节数, 总字节数或None)，大约每秒一次
+
+    Returns:
+        DownloadResult
+    """
+    # 压缩传输时Content-Length和Range都针对压缩后的内容，续传和大小校验需要原始字节
+    headers = dict(headers or {}, **{'Accept-Encoding': 'identity'})
+    info = probe(session, url, headers, cookies, timeout=timeout)
+    part_path = f'{save_path}.part'
+    state_path = f'{part_path}.json'
+    os.makedirs(os.path.dirname(save_path) or '.', exist_ok=True)
+
+    # 上次中断的进度只有在文件未变化、服务端支持续传时才继续使用
+    state = _load_state(state_path)
+    if (state is None or state.get('validator') != info.validator or not info.can_resume
+            or not os.path.exists(part_path)):
+        state = {'validator': info.validator,
+                 'segments': _plan_segments(info.size, segments or DEFAULT_SEGMENTS, info.accept_ranges)}
+        with open(part_path, 'wb') as f:
+            if info.size and len(state['segments']) > 1:
+                f.truncate(info.size)
+    ranges = state['segments']
+    if len(ranges) == 1:
+        # 单段下载时以实际写入的文件大小为准
+        ranges[0][2] = min(os.path.getsize(part_path), ranges[0][2]) if info.can_resume else 0
+    resumed_bytes = sum(done for _, _, done in ranges)
+    _save_state(state_path, state)
+
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def fetch(segment: List):
+        start, end, done = segment
+        if end is not None and start + done > end:
+            return
+        request_headers = dict(headers)
+        if done or end is not None and len(ranges) > 1:
+            request_headers['Range'] = f"bytes={start + done}-{'' if end is None else end}"
+            # 文件在两次请求之间发生变化时服务端返回200完整内容，而不是206
+            if info.etag or info.last_modified:
+                request_headers['If-Range'] = info.etag or info.last_modified
+        response = session.get(url, headers=request_headers, cookies=cookies, stream=True, timeout=timeout)
+        try:
+            response.raise_for_status()
+            if 'Range' in request_headers:
+                match = _CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+                if response.status_code != 206 or not match or int(match.group(1)) != start + done:
+                    if len(ranges) > 1:
+                        raise DownloadError('服务端未按Range返回内容，无法分段下载')
+                    # 单段续传被拒绝：从头下载
+                    with lock:
+                        segment[2] = done = 0
+            with open(part_path, 'r+b') as f:
+                f.seek(start + done)
+                if len(ranges) == 1:
+                    f.truncate()
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if stop.is_set():
+                        return
+                    if end is not None:
+                        chunk = chunk[:end - start + 1 - segment[2]]
+                    f.write(chunk)
+                    # 先写入再记录进度，进程被中断时 .part.json 不会超前于文件内容
+                    f.flush()
+                    with lock:
+                        segment[2] += len(chunk)
+                    if end is not None and start + segment[2] > end:
+                        break
+        finally:
+            response.close()
+
+    def report():
+        with lock:
+            _save_state(state_path, state)
+            downloaded = sum(done for _, _, done in ranges)
+        if progress is not None:
+            progress(downloaded, info.size)
+
+    executor = ThreadPoolExecutor(max_workers=len(ranges))
+    try:
+        futures = [executor.submit(fetch, segment) for segment in ranges]
+        pending = futures
+        while pending:
+            done_futures, pending = wait(pending, timeout=STATE_SAVE_INTERVAL, return_when=FIRST_EXCEPTION)
+            report()
+            for future in done_futures:
+                # 任一分段失败时停止其他分段，已下载的进度保留在 .part.json 中
+                if future.exception() is not None:
+                    stop.set()
+                    raise future.exception()
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        with lock:
+            _save_state(state_path, state)
+
+    size = os.path.getsize(part_path)
+    if info.size is not None and size != info.size:
+        for path in (part_path, state_path):
+            os.remove(path)
+        raise DownloadError(f'文件大小不一致: 期望 {info.size} 字节，实际 {size} 字节')
+
+    # 校验哈希：优先使用调用方提供的，其次是服务端Digest头
+    if not expected_hash and info.digests:
+        hash_algorithm, expected_hash = next(iter(info.digests.items()))
+    digest = file_digest(part_path, hash_algorithm)
+    if expected_hash and digest.lower() != expected_hash.lower():
+        for path in (part_path, state_path):
+            os.remove(path)
+        raise DownloadError(f'{hash_algorithm}校验失败: 期望 {expected_hash}，实际 {digest}')
+
+    os.replace(part_path, save_path)
+    os.remove(state_path)
+    return DownloadResult(save_path, size, hash_algorithm, digest, resumed_bytes, len(ranges))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务模式负载基准测试：默认模式（Flask-SocketIO + eventlet + paramiko）vs asyncio模式（ASGI + asyncssh）
+
+针对本地测试sshd，在子进程中分别启动两种服务，用N个Socket.IO客户端同时打开终端，测量：
+- 建立N个终端的总耗时
+- 服务进程每个终端增加的内存（RSS差值 / N）
+- 所有终端同时输入时的回显延迟（p50 / p95）
+- 同时发起的/api/parse-share-link请求（解析本地模拟的分享服务）的响应延迟p95，覆盖Flask路由中的阻塞调用
+
+依赖: pip install asyncssh uvicorn "python-socketio[asyncio_client]"
+用法:
+    python scripts/bench_server_modes.py [会话数列表，如10,100,300] [回显轮数]
+"""
+
+import asyncio
+import http.server
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_share_parse import StubShareHandler  # noqa: E402
+from bench_sshd import TEST_PASSWORD  # noqa: E402
+
+# 测试sshd也在独立进程中运行，避免与客户端争用GIL
+SSHD_CODE = ("import sys, time; sys.path.insert(0, 'scripts'); from bench_sshd import LocalSSHServer; "
+             "LocalSSHServer(port={port}).start(); time.sleep(1e9)")
+
+MODES = {
+    'eventlet': "import app; app.socketio.run(app.app, host='127.0.0.1', port={port}, debug=False, "
+                "allow_unsafe_werkzeug=True, log_output=False)",
+    'asyncio': "import app_async; app_async.main('127.0.0.1', {port})",
+}
+# 同时发起的接口请求数上限（每个请求解析一个不同的分享）
+API_REQUESTS = 20
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def rss_bytes(pid: int) -> int:
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def start_process(code: str, port: int, name: str) -> subprocess.Popen:
+    env = dict(os.environ, NASPT_LOG_LEVEL='WARNING', NASPT_MAX_SESSIONS='0', NASPT_MAX_SESSIONS_PER_HOST='0')
+    proc = subprocess.Popen([sys.executable, '-c', code.format(port=port)], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f'{name} 未能启动')
+
+
+class Terminal:
+    """一个浏览器终端的模拟"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.connected = asyncio.Event()
+        self.buffer = bytearray()
+        self.received = 0
+        self.waiter: tuple[bytes, asyncio.Future] | None = None
+        self.client.on('ssh_connected', self._on_connected)
+        self.client.on('ssh_output', self._on_output)
+
+    async def _on_connected(self, data):
+        self.connected.set()
+
+    async def _on_output(self, data):
+        chunk = data['data']
+        self.received += len(chunk)
+        self.buffer += chunk
+        if self.waiter and self.waiter[0] in self.buffer and not self.waiter[1].done():
+            self.waiter[1].set_result(time.perf_counter())
+        # 与浏览器一样确认已处理的输出，避免触发输出流控
+        await self.client.emit('ssh_output_ack', {'bytes': self.received})
+
+    async def open(self, ssh_port: int):
+        await self.client.connect(self.url, transports=['websocket'])
+        await self.client.emit('ssh_connect', {'host': '127.0.0.1', 'port': ssh_port,
+                                               'username': 'root', 'password': TEST_PASSWORD})
+        await asyncio.wait_for(self.connected.wait(), 30)
+
+    async def echo(self, marker: bytes) -> float:
+        self.buffer.clear()
+        future = asyncio.get_running_loop().create_future()
+        self.waiter = (marker, future)
+        start = time.perf_counter()
+        await self.client.emit('ssh_input', {'command': marker.decode()})
+        end = await asyncio.wait_for(future, 30)
+        return (end - start) * 1000
+
+    async def close(self):
+        await self.client.disconnect()
+
+
+def parse_share(url: str, share_url: str) -> float:
+    """请求一次/api/parse-share-link（跳过缓存），返回响应耗时（毫秒）"""
+    body = json.dumps({'url': share_url, 'refresh': True}).encode()
+    request = urllib.request.Request(f'{url}/api/parse-share-link', data=body,
+                                     headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=30) as response:
+        if not json.load(response).get('success'):
+            raise RuntimeError('分享解析失败')
+    return (time.perf_counter() - start) * 1000
+
+
+async def run_level(url: str, ssh_port: int, pid: int, count: int, echo_rounds: int, share_base: str) -> dict:
+    base_rss = rss_bytes(pid)
+    terminals = [Terminal(url) for _ in range(count)]
+    start = time.perf_counter()
+    await asyncio.gather(*(t.open(ssh_port) for t in terminals))
+    connect_seconds = time.perf_counter() - start
+    await asyncio.sleep(1)
+    per_session = (rss_bytes(pid) - base_rss) / count
+
+    latencies = []
+    for round_no in range(echo_rounds):
+        latencies += await asyncio.gather(*(t.echo(f'<{round_no}-{i}>'.encode()) for i, t in enumerate(terminals)))
+    # 终端仍然打开时并发请求接口：Flask路由中的阻塞调用不能卡住，也不能阻塞终端
+    api_count = min(count, API_REQUESTS)
+    api_latencies = sorted(await asyncio.gather(*(
+        asyncio.to_thread(parse_share, url, f'{share_base}/s/{i:02x}{"0" * 14}') for i in range(api_count))))
+    await asyncio.gather(*(t.close() for t in terminals))
+    await asyncio.sleep(1)
+    latencies.sort()
+    return {
+        'connect_s': connect_seconds,
+        'kb_per_session': per_session / 1024,
+        'p50_ms': statistics.median(latencies),
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1],
+        'api_p95_ms': api_latencies[max(int(len(api_latencies) * 0.95) - 1, 0)],
+    }
+
+
+def main():
+    levels = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '10,100,300').split(',')]
+    echo_rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    ssh_port = free_port()
+    sshd = start_process(SSHD_CODE, ssh_port, 'sshd')
+    # 模拟的分享服务：每个分享3个文件，下载接口延迟0.1秒
+    StubShareHandler.file_count, StubShareHandler.delay = 3, 0.1
+    share_server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubShareHandler)
+    threading.Thread(target=share_server.serve_forever, daemon=True).start()
+    share_base = f'http://127.0.0.1:{share_server.server_address[1]}'
+    print(f"本地sshd: 127.0.0.1:{ssh_port}，回显轮数: {echo_rounds}，并发接口请求: 至多{API_REQUESTS}")
+    print(f"{'模式':<10}{'会话数':>8}{'建立耗时(s)':>14}{'每会话内存(KB)':>16}{'回显p50(ms)':>14}{'回显p95(ms)':>14}"
+          f"{'接口p95(ms)':>14}")
+    try:
+        for mode in MODES:
+            for count in levels:
+                port = free_port()
+                proc = start_process(MODES[mode], port, f'{mode} 服务')
+                try:
+                    result = asyncio.run(run_level(f'http://127.0.0.1:{port}', ssh_port, proc.pid, count, echo_rounds,
+                                                   share_base))
+                    print(f"{mode:<10}{count:>8}{result['connect_s']:>14.2f}{result['kb_per_session']:>16.1f}"
+                          f"{result['p50_ms']:>14.2f}{result['p95_ms']:>14.2f}{result['api_p95_ms']:>14.2f}",
+                          flush=True)
+                except Exception as e:
+                    print(f"{mode:<10}{count:>8}  失败: {e!r}", flush=True)
+                finally:
+                    proc.terminate()
+                    proc.wait(10)
+    finally:
+        share_server.shutdown()
+        sshd.terminate()
+        sshd.wait(10)
+
+
+if __name__ == '__main__':
+    main()
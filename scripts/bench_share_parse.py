@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞牛分享解析基准测试：逐个获取 vs 并发获取每个文件的下载链接
+
+在本地启动一个模拟的分享服务（分享页面、文件列表、下载接口，下载接口每次请求延迟固定时间），
+分别以不同的并发数执行FeiNiuShareParser.parse_all，测量总耗时，并确认各次的file_download_map
+内容和顺序完全一致
+
+用法:
+    python scripts/bench_share_parse.py [文件数] [下载接口延迟毫秒] [并发数列表，如1,4,8]
+"""
+
+import contextlib
+import http.server
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parse_share_link import FeiNiuShareParser  # noqa: E402
+
+SHARE_ID = 'e403bd7176654230a2'
+AUTH = 'a' * 32
+
+
+class StubShareHandler(http.server.BaseHTTPRequestHandler):
+    """模拟飞牛分享服务：签名不做校验，下载接口按文件返回固定的token"""
+
+    protocol_version = 'HTTP/1.1'
+    file_count = 40
+    delay = 0.2
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        body = b'<html></html>'
+        self.send_response(200)
+        self.send_header('Set-Cookie', f'{SHARE_ID}={AUTH}; Path=/')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path.endswith('/api/v1/share/list'):
+            files = [{'file': f'bundle{i:02d}.tgz', 'path': f'/bundle{i:02d}.tgz', 'fileId': i, 'isDir': False}
+                     for i in range(self.file_count)]
+            self._send_json({'code': 0, 'data': {'files': files}})
+        elif self.path.endswith('/api/v1/share/download'):
+            time.sleep(self.delay)
+            file_id = data['files'][0]['fileId']
+            token = f'{file_id:032x}'
+            self._send_json({'code': 0, 'data': {'path': f'/s/download/{SHARE_ID}?token={token}'}})
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+
+def run_parse(share_url: str, workers: int) -> tuple[float, dict]:
+    parser = FeiNiuShareParser(share_url)
+    start = time.perf_counter()
+    # parse_all的过程输出较多，测试时不显示
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = parser.parse_all(link_workers=workers)
+    return time.perf_counter() - start, result['file_download_map']
+
+
+def main():
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    delay_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    worker_counts = [int(n) for n in (sys.argv[3] if len(sys.argv) > 3 else '1,4,8').split(',')]
+
+    StubShareHandler.file_count = file_count
+    StubShareHandler.delay = delay_ms / 1000
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubShareHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    share_url = f'http://127.0.0.1:{server.server_address[1]}/s/{SHARE_ID}'
+
+    print(f'文件数 {file_count}，下载接口延迟 {delay_ms}ms')
+    baseline = None
+    try:
+        for workers in worker_counts:
+            elapsed, file_map = run_parse(share_url, workers)
+            ordered = list(file_map.items())
+            if baseline is None:
+                baseline = ordered
+            same = '一致' if ordered == baseline else '不一致'
+            print(f'  并发 {workers:>2}: {elapsed:6.2f}s，{len(file_map)} 个链接，结果与第一次{same}')
+            if len(file_map) != file_count or not all(re.search(r'token=[0-9a-f]{32}$', link) for _, link in ordered):
+                print('    警告: 下载链接数量或格式不正确')
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞牛分享目录遍历基准测试：不同并发数下列出一个多层目录的分享
+
+在本地启动模拟的分享服务（每个目录有若干子目录和文件，列表接口每次请求延迟固定时间），
+分别以不同的并发数执行ShareWalker.run，测量总耗时和列表请求数，并确认各次的清单完全一致。
+并发足够时总耗时接近 (层数+1) × 延迟，而不是 目录数 × 延迟
+
+用法:
+    python scripts/bench_share_walk.py [每个目录的子目录数] [层数] [列表接口延迟毫秒] [并发数列表，如1,8,32]
+"""
+
+import contextlib
+import http.server
+import io
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_share_parse import SHARE_ID, StubShareHandler  # noqa: E402
+from parse_share_link import FeiNiuShareParser  # noqa: E402
+from share_walker import ShareWalker  # noqa: E402
+
+
+class StubTreeHandler(StubShareHandler):
+    """模拟多层目录：每个目录有branches个子目录和2个文件，超过depth层的目录为空"""
+
+    branches = 3
+    depth = 4
+    files_per_dir = 2
+
+    @staticmethod
+    def _entry(path: str, is_dir: bool) -> dict:
+        return {'file': path.rsplit('/', 1)[-1], 'path': path, 'fileId': zlib.crc32(path.encode()), 'isDir': is_dir}
+
+    def do_POST(self):
+        if not self.path.endswith('/api/v1/share/list'):
+            return super().do_POST()
+        data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.delay)
+        parent = data.get('path') or '/'
+        level = 0 if parent == '/' else parent.count('/')
+        files = []
+        if level <= self.depth:
+            base = parent.rstrip('/')
+            for i in range(self.branches if level < self.depth else 0):
+                files.append(self._entry(f'{base}/d{i}', True))
+            for i in range(self.files_per_dir):
+                files.append(self._entry(f'{base}/pkg{i}.tgz', False))
+        self._send_json({'code': 0, 'data': {'files': files}})
+
+
+def run_walk(share_url: str, workers: int) -> tuple[float, dict]:
+    walker = ShareWalker(FeiNiuShareParser(share_url), workers)
+    # 解析器的过程输出较多，测试时不显示
+    with contextlib.redirect_stdout(io.StringIO()):
+        walker.parser.get_share_info()
+        start = time.perf_counter()
+        manifest = walker.run()
+    return time.perf_counter() - start, manifest
+
+
+def main():
+    branches = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    delay_ms = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    worker_counts = [int(n) for n in (sys.argv[4] if len(sys.argv) > 4 else '1,8,32').split(',')]
+
+    StubTreeHandler.branches = branches
+    StubTreeHandler.depth = depth
+    StubTreeHandler.delay = delay_ms / 1000
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubTreeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    share_url = f'http://127.0.0.1:{server.server_address[1]}/s/{SHARE_ID}'
+
+    dirs = sum(branches ** level for level in range(depth + 1))
+    print(f'子目录数 {branches}，层数 {depth}（共 {dirs} 个目录），列表接口延迟 {delay_ms}ms，'
+          f'最深路径约 {(depth + 1) * delay_ms / 1000:.2f}s')
+    baseline = None
+    try:
+        for workers in worker_counts:
+            elapsed, manifest = run_walk(share_url, workers)
+            entries = [(entry['index'], entry['path']) for entry in manifest['entries']]
+            if baseline is None:
+                baseline = entries
+            same = '一致' if entries == baseline else '不一致'
+            print(f'  并发 {workers:>2}: {elapsed:6.2f}s，{manifest["listed"]} 次列表请求，'
+                  f'{manifest["files"]} 个文件，{manifest["dirs"]} 个目录，清单与第一次{same}')
+            if manifest['errors']:
+                print(f'    警告: {len(manifest["errors"])} 个目录列出失败')
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
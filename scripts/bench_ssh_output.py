@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSH输出读取基准测试：50ms轮询 vs 就绪驱动
+
+测量两项指标：
+- 空闲CPU：N个会话无输出时，读取线程在T秒内消耗的CPU时间
+- 回显延迟：发送一个字节到读取线程收到回显的耗时
+
+用法:
+    python scripts/bench_ssh_output.py [会话数] [空闲秒数] [回显次数]
+"""
+
+import os
+import statistics
+import sys
+import threading
+import time
+
+import paramiko
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_sshd import LocalSSHServer, TEST_PASSWORD  # noqa: E402
+from ssh_stream import wait_channel_readable, drain_channel, channel_finished  # noqa: E402
+
+
+def polling_reader(channel, on_data, stop):
+    """旧实现：recv_ready + sleep(0.05)，每次最多读4096字节"""
+    while not stop.is_set():
+        if channel.closed:
+            break
+        if channel.recv_ready():
+            data = channel.recv(4096)
+            if data:
+                on_data(data)
+        else:
+            time.sleep(0.05)
+
+
+def event_reader(channel, on_data, stop):
+    """新实现：等待通道可读后一次读空"""
+    while not stop.is_set():
+        if not wait_channel_readable(channel, timeout=1.0):
+            continue
+        data = drain_channel(channel)
+        if data:
+            on_data(data)
+        elif channel_finished(channel):
+            break
+
+
+def idle_baseline(server, clients, idle_seconds):
+    """不启动读取线程，测量paramiko传输线程本身的空闲开销"""
+    time.sleep(0.5)
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    return time.process_time() - cpu_start
+
+
+def open_shells(server, count):
+    clients = []
+    for _ in range(count):
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(server.host, server.port, username='bench', password=TEST_PASSWORD,
+                    look_for_keys=False, allow_agent=False)
+        channel = ssh.invoke_shell(term='xterm-256color')
+        clients.append((ssh, channel))
+    return clients
+
+
+def run_mode(name, reader, clients, idle_seconds, echo_rounds, baseline):
+    stop = threading.Event()
+    echoed = threading.Event()
+    threads = []
+    for index, (_, channel) in enumerate(clients):
+        on_data = (lambda data: echoed.set()) if index == 0 else (lambda data: None)
+        thread = threading.Thread(target=reader, args=(channel, on_data, stop), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    # 空闲CPU
+    time.sleep(0.5)
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    idle_cpu = time.process_time() - cpu_start - baseline
+
+    # 回显延迟
+    channel = clients[0][1]
+    latencies = []
+    for _ in range(echo_rounds):
+        echoed.clear()
+        start = time.perf_counter()
+        channel.send(b'x')
+        echoed.wait(5)
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.01)
+
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=2)
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<10} 空闲CPU: {idle_cpu * 1000:8.1f} ms / {idle_seconds:.0f}s   "
+          f"回显延迟: 中位数 {statistics.median(latencies):6.2f} ms  p95 {p95:6.2f} ms")
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    idle_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    echo_rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    server = LocalSSHServer().start()
+    print(f"测试SSH服务器: {server.host}:{server.port}，会话数: {sessions}")
+    try:
+        clients = open_shells(server, sessions)
+        try:
+            baseline = idle_baseline(server, clients, idle_seconds)
+        finally:
+            for ssh, _ in clients:
+                ssh.close()
+        print(f"paramiko传输线程基线空闲CPU: {baseline * 1000:.1f} ms / {idle_seconds:.0f}s（已从下面结果中扣除）")
+        for name, reader in (('轮询', polling_reader), ('就绪驱动', event_reader)):
+            clients = open_shells(server, sessions)
+            try:
+                run_mode(name, reader, clients, idle_seconds, echo_rounds, baseline)
+            finally:
+                for ssh, _ in clients:
+                    ssh.close()
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试用的本地SSH服务器（基于paramiko，仅供测试使用）
+- 任意用户名 + 固定密码登录
+- shell会话：原样回显输入
+- exec会话：在本机用 sh -c 执行命令
+- sftp子系统：直接读写本机文件系统
+"""
+
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+TEST_PASSWORD = 'naspt'
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self):
+        # chanid -> 命令（shell会话为None）
+        self.requests = {}
+        self.cond = threading.Condition()
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL if password == TEST_PASSWORD else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_REQUEST
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_window_change_request(self, channel, width, height, pixelwidth, pixelheight):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        with self.cond:
+            self.requests[channel.get_id()] = None
+            self.cond.notify_all()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        with self.cond:
+            self.requests[channel.get_id()] = command.decode('utf-8', errors='ignore')
+            self.cond.notify_all()
+        return True
+
+    def wait_request(self, chanid, timeout=10):
+        with self.cond:
+            if not self.cond.wait_for(lambda: chanid in self.requests, timeout):
+                raise TimeoutError(chanid)
+            return self.requests.pop(chanid)
+
+
+class _LocalSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class _LocalSFTPServer(paramiko.SFTPServerInterface):
+    """把SFTP请求直接映射到本机文件系统"""
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def list_folder(self, path):
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        f = os.fdopen(fd, mode)
+        handle = _LocalSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        if attr.st_mode is not None:
+            return self._call(os.chmod, path, attr.st_mode)
+        return paramiko.SFTP_OK
+
+
+def _run_echo_shell(channel):
+    try:
+        while True:
+            data = channel.recv(32768)
+            if not data:
+                break
+            channel.sendall(data)
+    except Exception:
+        pass
+    finally:
+        channel.close()
+
+
+def _run_exec(channel, command):
+    try:
+        proc = subprocess.run(['sh', '-c', command], capture_output=True)
+        channel.sendall(proc.stdout)
+        channel.sendall_stderr(proc.stderr)
+        channel.send_exit_status(proc.returncode)
+    except Exception:
+        channel.send_exit_status(255)
+    finally:
+        channel.close()
+
+
+class LocalSSHServer:
+    """在127.0.0.1的随机端口上运行的测试SSH服务器"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(1024)
+        self.host, self.port = self.sock.getsockname()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+
+    def start(self) -> 'LocalSSHServer':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while not self._stopped:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle_client, args=(client,), daemon=True).start()
+
+    def _handle_client(self, client):
+        # 与OpenSSH交互会话一致，关闭Nagle算法
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _LocalSFTPServer)
+        try:
+            transport.start_server(server=_ServerInterface())
+        except Exception:
+            return
+        while transport.is_active():
+            channel = transport.accept(timeout=1)
+            if channel is None:
+                continue
+            threading.Thread(target=self._handle_channel, args=(channel,), daemon=True).start()
+
+    def _handle_channel(self, channel):
+        server = channel.get_transport().server_object
+        try:
+            command = server.wait_request(channel.get_id())
+        except TimeoutError:
+            channel.close()
+            return
+        if command is None:
+            _run_echo_shell(channel)
+        else:
+            _run_exec(channel, command)
+
+
+if __name__ == '__main__':
+    server = LocalSSHServer().start()
+    print(f"测试SSH服务器已启动: {server.host}:{server.port} 密码: {TEST_PASSWORD}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
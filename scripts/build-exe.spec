@@ -29,6 +29,23 @@ a = Analysis(
         'cryptography.hazmat.backends',
         'cryptography.hazmat.backends.openssl',
         'parse_share_link',
+        'ssh_stream',
+        'ssh_log',
+        'ssh_pool',
+        'ssh_escalation',
+        'host_facts',
+        'remote_transfer',
+        'ssh_sessions',
+        'ssh_input',
+        'session_registry',
+        'ssh_exec',
+        'ssh_fanout',
+        'download_cache',
+        'download_jobs',
+        'download_relay',
+        'resumable_download',
+        'share_cache',
+        'share_walker',
         'requests',
         'urllib3',
         'certifi',
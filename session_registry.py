@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+终端会话登记表
+记录每个会话归属的工作进程、所在主机和当前附加的sid，并按登记表统一做容量限制。
+单进程时使用进程内实现；多个工作进程共用一个Redis（或KeyDB、Valkey等兼容服务）时：
+- 会话数上限按所有进程合计，工作进程定期续期心跳，进程退出后其会话在心跳过期时自动不再计数
+- Socket.IO事件经Redis发布订阅在进程间转发，任一进程都能向其他进程上的浏览器发送消息
+- 浏览器重新附加到其他进程持有的会话时，输入等事件经SessionRelay转发给持有会话的进程
+"""
+
+import itertools
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+from typing import Callable
+
+import socketio
+
+# 当前工作进程的标识
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}'
+# 工作进程心跳的有效期（秒），应大于心跳间隔的两倍
+HEARTBEAT_TTL = 90
+# 转发事件等待持有会话进程回复的最长时间（秒）
+RELAY_TIMEOUT = 65.0
+# 等待回复时的轮询间隔（秒）
+RELAY_POLL_INTERVAL = 0.005
+# Redis键前缀
+KEY_PREFIX = 'naspt:'
+
+# 原子地清理失效进程的登记、统计现有会话并占用名额；返回触发的限制（'total' / 'host'），未超限时返回nil
+_RESERVE_SCRIPT = """
+local entries = redis.call('HGETALL', KEYS[1])
+local total, host_count, alive = 0, 0, {[ARGV[8]] = true}
+for i = 1, #entries, 2 do
+    local key, info = entries[i], cjson.decode(entries[i + 1])
+    if alive[info.worker] == nil then
+        alive[info.worker] = redis.call('EXISTS', ARGV[6] .. info.worker) == 1
+    end
+    if not alive[info.worker] then
+        redis.call('HDEL', KEYS[1], key)
+    elseif key ~= ARGV[5] then
+        total = total + 1
+        if info.host == ARGV[2] then
+            host_count = host_count + 1
+        end
+    end
+end
+if tonumber(ARGV[3]) > 0 and total >= tonumber(ARGV[3]) then
+    return 'total'
+end
+if tonumber(ARGV[4]) > 0 and host_count >= tonumber(ARGV[4]) then
+    return 'host'
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[7])
+return nil
+"""
+
+
+class MemorySessionRegistry:
+    """进程内登记表（单进程部署）"""
+
+    shared = False
+
+    def __init__(self):
+        self._entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key: str, host: str, max_sessions: int, max_per_host: int,
+                exclude: str | None = None) -> str | None:
+        """
+        检查容量并登记key（待建立的会话），超出限制时不登记
+
+        Args:
+            exclude: 不计入的已有会话（即将被替换的会话）
+
+        Returns:
+            触发的限制：'total' 总数 / 'host' 单主机数；未超限时返回None
+        """
+        with self._lock:
+            others = [info for k, info in self._entries.items() if k != exclude]
+            if max_sessions and len(others) >= max_sessions:
+                return 'total'
+            if max_per_host and sum(1 for info in others if info['host'] == host) >= max_per_host:
+                return 'host'
+            self._entries[key] = {'worker': WORKER_ID, 'host': host}
+        return None
+
+    def add(self, key: str, info: dict, replaces: str | None = None):
+        """登记会话；replaces为占用名额时登记的key，与新登记原子地替换，计数不会短暂重复"""
+        with self._lock:
+            self._entries[key] = dict(info, worker=WORKER_ID)
+            if replaces is not None:
+                self._entries.pop(replaces, None)
+
+    def update(self, key: str, **fields):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key].update(fields)
+
+    def remove(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            info = self._entries.get(key)
+            return dict(info) if info is not None else None
+
+    def is_alive(self, worker: str) -> bool:
+        return worker == WORKER_ID
+
+    def heartbeat(self):
+        pass
+
+    def client_manager(self):
+        """单进程不需要跨进程的Socket.IO客户端管理器"""
+        return None
+
+    def publish(self, worker: str, message: dict):
+        raise RuntimeError('进程内登记表不支持跨进程消息')
+
+    def listen(self):
+        return iter(())
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = list(self._entries.values())
+        return {'backend': 'memory', 'worker': WORKER_ID, 'workers': [WORKER_ID], 'sessions': len(entries)}
+
+
+class RedisSessionRegistry:
+    """基于Redis的共享登记表（多进程部署）"""
+
+    shared = True
+
+    def __init__(self, url: str, redis_module=None):
+        if redis_module is None:
+            import redis as redis_module
+        self.url = url
+        self.redis = redis_module.Redis.from_url(url)
+        self._sessions_key = f'{KEY_PREFIX}sessions'
+        self._worker_prefix = f'{KEY_PREFIX}worker:'
+        self._reserve = self.redis.register_script(_RESERVE_SCRIPT)
+
+    def _relay_channel(self, worker: str) -> str:
+        return f'{KEY_PREFIX}relay:{worker}'
+
+    def reserve(self, key: str, host: str, max_sessions: int, max_per_host: int,
+                exclude: str | None = None) -> str | None:
+        info = json.dumps({'worker': WORKER_ID, 'host': host})
+        result = self._reserve(keys=[self._sessions_key],
+                               args=[key, host, max_sessions or 0, max_per_host or 0, exclude or '',
+                                     self._worker_prefix, info, WORKER_ID])
+        return result.decode() if isinstance(result, bytes) else result
+
+    def add(self, key: str, info: dict, replaces: str | None = None):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._sessions_key, key, json.dumps(dict(info, worker=WORKER_ID)))
+        if replaces is not None:
+            pipe.hdel(self._sessions_key, replaces)
+        pipe.execute()
+
+    def update(self, key: str, **fields):
+        # 只有持有会话的进程会更新自己的登记，读改写之间不存在竞争
+        info = self.get(key)
+        if info is not None:
+            info.update(fields)
+            self.redis.hset(self._sessions_key, key, json.dumps(info))
+
+    def remove(self, *keys: str):
+        if keys:
+            self.redis.hdel(self._sessions_key, *keys)
+
+    def get(self, key: str) -> dict | None:
+        value = self.redis.hget(self._sessions_key, key)
+        return json.loads(value) if value is not None else None
+
+    def is_alive(self, worker: str) -> bool:
+        return worker == WORKER_ID or bool(self.redis.exists(self._worker_prefix + worker))
+
+    def heartbeat(self):
+        """续期当前进程的心跳（由定期清理任务调用）"""
+        self.redis.set(self._worker_prefix + WORKER_ID, int(time.time()), ex=HEARTBEAT_TTL)
+
+    def client_manager(self) -> 'RedisClientManager':
+        return RedisClientManager(self.redis)
+
+    def publish(self, worker: str, message: dict):
+        self.redis.publish(self._relay_channel(worker), json.dumps(message))
+
+    def listen(self):
+        """逐条返回发给当前进程的转发消息（阻塞）"""
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._relay_channel(WORKER_ID))
+        for message in pubsub.listen():
+            if message.get('type') == 'message':
+                yield json.loads(message['data'])
+
+    def stats(self) -> dict:
+        workers = sorted(key.decode()[len(self._worker_prefix):]
+                         for key in self.redis.scan_iter(match=self._worker_prefix + '*'))
+        per_worker = {}
+        for value in self.redis.hvals(self._sessions_key):
+            worker = json.loads(value)['worker']
+            if worker in workers:
+                per_worker[worker] = per_worker.get(worker, 0) + 1
+        return {
+            'backend': 'redis',
+            'worker': WORKER_ID,
+            'workers': workers,
+            'sessions': sum(per_worker.values()),
+            'per_worker': per_worker,
+        }
+
+
+class RedisClientManager(socketio.PubSubManager):
+    """
+    经Redis发布订阅在工作进程间转发Socket.IO消息
+
+    与python-socketio自带的RedisManager相比：复用登记表的Redis连接（eventlet下为绿色socket，不阻塞事件循环）；
+    发给本进程上单个sid的消息直接发送，不经过Redis，终端输出不会因为多进程部署增加延迟
+    """
+    name = 'naspt-redis'
+
+    def __init__(self, redis_client, channel: str = f'{KEY_PREFIX}socketio'):
+        super().__init__(channel=channel)
+        self.redis = redis_client
+
+    def emit(self, event, data, namespace=None, room=None, skip_sid=None, callback=None, to=None, **kwargs):
+        room = to or room
+        if room is not None and skip_sid is None and self.is_connected(room, namespace or '/'):
+            return super().emit(event, data, namespace=namespace, room=room, callback=callback,
+                                ignore_queue=True)
+        return super().emit(event, data, namespace=namespace, room=room, skip_sid=skip_sid,
+                            callback=callback, **kwargs)
+
+    def _publish(self, data):
+        self.redis.publish(self.channel, self.json.dumps(data))
+
+    def _listen(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            if message.get('type') == 'message':
+                yield message['data']
+
+
+class SessionRelay:
+    """
+    把浏览器事件转发给持有会话的工作进程
+
+    浏览器重新附加时可能连到另一个进程，SSH通道无法跨进程移动：接收连接的进程记录 sid -> 持有进程，
+    之后该sid的事件都发给持有进程处理；持有进程直接向该sid发送输出（经Socket.IO消息队列送达）
+    """
+
+    def __init__(self, registry, handlers: dict[str, Callable], start_task: Callable, sleep: Callable,
+                 logger=None):
+        self.registry = registry
+        # 事件名 -> 处理函数(sid, data)，返回值作为回复
+        self.handlers = handlers
+        self.start_task = start_task
+        self.sleep = sleep
+        self.logger = logger
+        # sid -> 持有会话的工作进程（仅附加到其他进程会话的sid）
+        self.routes: dict[str, str] = {}
+        self._replies: dict[str, object] = {}
+        self._ids = itertools.count(1)
+        self._started = False
+
+    def start(self):
+        """启动接收转发消息的后台任务（只启动一次，仅共享登记表需要）"""
+        if self._started or not self.registry.shared:
+            return
+        self._started = True
+        self.start_task(self._listen)
+
+    def route(self, sid: str) -> str | None:
+        return self.routes.get(sid)
+
+    def forward(self, worker: str, event: str, sid: str, data: dict | None = None, wait: bool = False,
+                timeout: float = RELAY_TIMEOUT):
+        """
+        把事件发给持有会话的进程
+
+        Args:
+            wait: 是否等待处理结果
+
+        Returns:
+            处理函数的返回值；不等待时返回None；持有进程已退出或超时时返回 {'success': False, ...}
+        """
+        if not self.registry.is_alive(worker):
+            self.routes.pop(sid, None)
+            return {'success': False, 'message': '会话所在的服务进程已退出'}
+        message = {'event': event, 'sid': sid, 'data': data or {}}
+        if wait:
+            message['reply_to'] = WORKER_ID
+            message['id'] = f'{WORKER_ID}:{next(self._ids)}'
+            self._replies[message['id']] = None
+        self.registry.publish(worker, message)
+        if not wait:
+            return None
+        deadline = time.monotonic() + timeout
+        try:
+            while self._replies[message['id']] is None:
+                if time.monotonic() > deadline:
+                    return {'success': False, 'message': '会话所在的服务进程未响应'}
+                self.sleep(RELAY_POLL_INTERVAL)
+            return self._replies[message['id']]['result']
+        finally:
+            self._replies.pop(message['id'], None)
+
+    def _listen(self):
+        while True:
+            try:
+                for message in self.registry.listen():
+                    if 'reply' in message:
+                        if message['reply'] in self._replies:
+                            self._replies[message['reply']] = message
+                    else:
+                        # 处理函数可能等待通道写入，不能阻塞接收
+                        self.start_task(self._handle, message)
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.warning("[SSH] 接收转发消息失败，稍后重试: %s", e)
+                self.sleep(1)
+
+    def _handle(self, message: dict):
+        handler = self.handlers.get(message.get('event'))
+        try:
+            result = handler(message['sid'], message.get('data') or {}) if handler else None
+        except Exception as e:
+            result = {'success': False, 'message': str(e)}
+        if message.get('reply_to'):
+            self.registry.publish(message['reply_to'], {'reply': message['id'], 'result': result})
+
+
+def create_registry(url: str | None = None, green: bool = False):
+    """
+    按配置创建登记表
+
+    Args:
+        url: 为空时使用进程内登记表；redis://... 时使用Redis
+        green: 是否使用eventlet绿色socket访问Redis（eventlet模式下不阻塞事件循环）
+    """
+    if not url or url == 'memory':
+        return MemorySessionRegistry()
+    if not url.startswith(('redis://', 'rediss://', 'unix://')):
+        raise ValueError(f'不支持的会话登记表: {url}')
+    try:
+        if green:
+            from eventlet import patcher
+            redis_module = patcher.import_patched('redis')
+        else:
+            import redis as redis_module
+    except ImportError:
+        raise RuntimeError('使用Redis会话登记表需要安装redis: pip install redis')
+    return RedisSessionRegistry(url, redis_module)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞牛分享解析结果缓存
+parse_all要请求分享页面、探测签名方法、列出文件并为每个文件获取下载链接，结果按share_id缓存：
+- 有效期默认NASPT_SHARE_CACHE_TTL秒；下载链接带有过期时间（expires等参数）时，在它之前提前失效
+- 同一分享同时有多个请求时只解析一次，其他请求等待并共用结果
+- 设置NASPT_SHARE_CACHE_FILE时缓存写入该文件，Web服务和命令行共用
+- 展开子目录（recursive，见share_walker）的结果与只列出根目录的结果分开缓存，层数和筛选条件不同时也分开
+下载时遇到401/403/410说明token已失效，调用invalidate()后下次重新解析（该分享的所有结果）；
+stream()在解析过程中逐步产出分享信息、文件和下载链接，供流式接口使用
+"""
+
+import copy
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+from urllib.parse import urlparse, parse_qs
+
+from parse_share_link import FeiNiuShareParser
+
+# 解析结果的有效期（秒），可通过 NASPT_SHARE_CACHE_TTL 配置，0表示不缓存
+DEFAULT_TTL = int(os.environ.get('NASPT_SHARE_CACHE_TTL', 600))
+# 持久化文件，可通过 NASPT_SHARE_CACHE_FILE 配置，留空只缓存在内存中
+DEFAULT_CACHE_FILE = os.environ.get('NASPT_SHARE_CACHE_FILE', '')
+# 下载链接过期前这段时间（秒）就不再使用缓存，留出下载开始前的余量
+EXPIRY_MARGIN = 60
+
+_SHARE_ID_PATTERN = re.compile(r'/s/([a-f0-9]+)')
+# 下载链接中表示过期时间（Unix时间戳）的参数
+_EXPIRY_PARAMS = ('expires', 'expire', 'expires_at', 'exp', 'deadline')
+
+
+def share_id_from_url(share_url: str) -> str:
+    """与FeiNiuShareParser相同的规则提取分享ID"""
+    match = _SHARE_ID_PATTERN.search(share_url)
+    if match is None:
+        raise ValueError(f"无法从URL中提取分享ID: {share_url}")
+    return match.group(1)
+
+
+def link_expiry(url: str) -> float | None:
+    """下载链接中的过期时间（Unix时间戳，毫秒值会换算成秒），没有时返回None"""
+    query = parse_qs(urlparse(url).query)
+    for name in _EXPIRY_PARAMS:
+        value = (query.get(name) or [''])[0]
+        if value.isdigit():
+            expiry = int(value)
+            return expiry / 1000 if expiry > 10 ** 11 else float(expiry)
+    return None
+
+
+def walk_options(recursive: bool = False, max_depth: int | None = None, pattern: str | None = None) -> dict:
+    """parse_all / iter_parse的子目录展开参数，不展开时为空（层数和筛选条件只在展开时有效）"""
+    if not recursive:
+        return {}
+    return {'recursive': True, 'max_depth': max_depth, 'pattern': pattern or None}
+
+
+def cache_key(share_id: str, options: dict) -> str:
+    """缓存键：只列出根目录时为share_id，展开子目录时附加层数和筛选条件"""
+    if not options:
+        return share_id
+    max_depth = options.get('max_depth')
+    return f"{share_id}/r{'' if max_depth is None else max_depth}/{options.get('pattern') or ''}"
+
+
+class _Flight:
+    """一次进行中的解析，其他请求等待它的结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ShareCache:
+    """
+    按share_id（展开子目录时附加参数，见cache_key）缓存parse_all的结果
+
+    get()是阻塞调用（未命中时请求飞牛服务），返回结果的副本，调用方可以随意修改
+    """
+
+    def __init__(self, ttl: int = DEFAULT_TTL, path: str = DEFAULT_CACHE_FILE,
+                 parser_factory: Callable = FeiNiuShareParser, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.path = path
+        self._parser_factory = parser_factory
+        self._clock = clock
+        # 缓存键 -> {'result': parse_all的结果, 'expires_at': 过期时间}
+        self._entries: dict[str, dict] = {}
+        self._flights: dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        # 等待其他请求的解析结果的次数
+        self.joined = 0
+
+    def _expires_at(self, result: dict) -> float:
+        expires_at = self._clock() + self.ttl
+        for link in result.get('download_links') or []:
+            expiry = link_expiry(link)
+            if expiry is not None:
+                expires_at = min(expires_at, expiry - EXPIRY_MARGIN)
+        return expires_at
+
+    def _valid_entry(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry['expires_at'] <= self._clock():
+            del self._entries[key]
+            return None
+        return entry
+
+    def _begin(self, key: str, refresh: bool) -> tuple[dict | None, _Flight | None, bool]:
+        """
+        查找缓存或加入进行中的解析
+
+        Returns:
+            (缓存的结果, 解析, 是否由调用方负责解析)；结果不为None时直接使用
+        """
+        with self._lock:
+            self._load()
+            entry = None if refresh else self._valid_entry(key)
+            if entry is not None:
+                self.hits += 1
+                return copy.deepcopy(entry['result']), None, False
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.joined += 1
+            return None, flight, leader
+
+    @staticmethod
+    def _wait(flight: _Flight) -> dict:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return copy.deepcopy(flight.result)
+
+    def _finish(self, key: str, flight: _Flight, result: dict | None, error: BaseException | None):
+        """
+        结束由调用方负责的解析：成功时写入缓存，再唤醒等待的请求
+
+        写入缓存、移除解析和唤醒在同一把锁内完成，之后到达的请求总能命中缓存或加入这次解析，不会重复解析
+        """
+        flight.result = result
+        flight.error = error
+        with self._lock:
+            # 未获取到认证信息或下载链接的结果不缓存，下次重新解析
+            if error is None and self.ttl > 0 and result.get('auth') and result.get('download_links'):
+                self._entries[key] = {'result': result, 'expires_at': self._expires_at(result)}
+                self._save()
+            self._flights.pop(key, None)
+            flight.done.set()
+
+    def get(self, share_url: str, refresh: bool = False, recursive: bool = False,
+            max_depth: int | None = None, pattern: str | None = None) -> tuple[dict, bool]:
+        """
+        获取分享的解析结果
+
+        Args:
+            refresh: 忽略已缓存的结果重新解析（同一分享正在解析时仍然等待那次的结果）
+            recursive / max_depth / pattern: 同FeiNiuShareParser.parse_all
+
+        Returns:
+            (parse_all的结果, 是否未请求飞牛服务)
+        """
+        options = walk_options(recursive, max_depth, pattern)
+        key = cache_key(share_id_from_url(share_url), options)
+        result, flight, leader = self._begin(key, refresh)
+        if result is not None:
+            return result, True
+        if not leader:
+            return self._wait(flight), True
+
+        try:
+            result = self._parser_factory(share_url).parse_all(**options)
+        except BaseException as e:
+            self._finish(key, flight, None, e)
+            raise
+        self._finish(key, flight, result, None)
+        return copy.deepcopy(result), False
+
+    def stream(self, share_url: str, refresh: bool = False, recursive: bool = False,
+               max_depth: int | None = None, pattern: str | None = None) -> Iterator[tuple[str, dict]]:
+        """
+        逐步产出解析过程中的事件（阻塞调用，事件同FeiNiuShareParser.iter_parse，参数同get），最后一个事件为
+        ('done', {'result': parse_all的结果, 'cached': 是否未请求飞牛服务})
+
+        缓存命中或同一分享正在解析时，等到完整结果后一次产出所有事件；解析由本次请求负责时，
+        与get()共用缓存和并发合并，结果同样写入缓存
+        """
+        options = walk_options(recursive, max_depth, pattern)
+        key = cache_key(share_id_from_url(share_url), options)
+        result, flight, leader = self._begin(key, refresh)
+        if result is None and not leader:
+            result = self._wait(flight)
+        if result is not None:
+            yield from replay_events(result)
+            yield 'done', {'result': result, 'cached': True}
+            return
+
+        result = None
+        error = None
+        try:
+            for event, payload in self._parser_factory(share_url).iter_parse(**options):
+                if event == 'done':
+                    result = payload
+                else:
+                    yield event, payload
+        except GeneratorExit:
+            # 调用方提前结束（如客户端断开），等待同一分享的其他请求改为报错，下次重新解析
+            error = Exception('解析已中断')
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._finish(key, flight, result, error)
+        yield 'done', {'result': copy.deepcopy(result), 'cached': False}
+
+    def invalidate(self, share_id: str):
+        """下载链接已失效（token过期等），该分享的所有结果（含展开子目录的）下次重新解析"""
+        with self._lock:
+            self._load()
+            removed = [key for key in self._entries if key == share_id or key.startswith(f'{share_id}/')]
+            for key in removed:
+                del self._entries[key]
+            if removed:
+                self._save(removed=removed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = self._clock()
+            return {
+                'entries': sum(1 for entry in self._entries.values() if entry['expires_at'] > now),
+                'in_flight': len(self._flights),
+                'hits': self.hits,
+                'misses': self.misses,
+                'joined': self.joined,
+                'ttl': self.ttl,
+                'persistent': bool(self.path)
+            }
+
+    def _read_file(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = self._clock()
+        return {share_id: entry for share_id, entry in data.items()
+                if isinstance(entry, dict) and entry.get('expires_at', 0) > now and 'result' in entry}
+
+    def _load(self):
+        """第一次使用时读取持久化文件（调用方持有_lock）"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.path:
+            self._entries.update(self._read_file())
+
+    def _save(self, removed: Iterable[str] = ()):
+        """
+        写入持久化文件（调用方持有_lock）；先合并文件中其他进程写入的结果，同一分享保留较晚过期的
+        """
+        if not self.path:
+            return
+        entries = self._read_file()
+        for key in removed:
+            entries.pop(key, None)
+        for share_id, entry in self._entries.items():
+            if entry['expires_at'] >= entries.get(share_id, {}).get('expires_at', 0):
+                entries[share_id] = entry
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # 结果中包含分享的认证信息，只允许当前用户读写
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # 持久化失败不影响内存中的缓存
+            pass
+
+
+def replay_events(result: dict) -> Iterator[tuple[str, dict]]:
+    """由完整的解析结果生成与iter_parse相同顺序的share、file、link事件"""
+    yield 'share', {key: result.get(key) for key in ('share_id', 'share_url', 'auth')}
+    for item in result.get('files') or []:
+        yield 'file', item
+    file_download_map = result.get('file_download_map') or {}
+    mapped = set(file_download_map.values())
+    for url in result.get('download_links') or []:
+        if url not in mapped:
+            yield 'link', {'file': None, 'url': url}
+    for file_name, url in file_download_map.items():
+        yield 'link', {'file': file_name, 'url': url}
+
+
+# Web服务和命令行共用的缓存
+share_cache = ShareCache()
+
+
+def parse_share(share_url: str) -> dict:
+    """经共用缓存解析分享链接（阻塞调用）"""
+    return share_cache.get(share_url)[0]
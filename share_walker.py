@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞牛分享目录遍历
+/api/v1/share/list每次只列出一个目录。ShareWalker从根目录开始逐层展开子目录：多个目录的列表请求同时进行
+（并发数有上限），发现的子目录立即提交，不等待同一层的其他目录，总耗时取决于最深的路径而不是目录数量。
+walk()是生成器，每个目录的列表返回后立即产出其中的条目；遍历结束后manifest()返回编号的扁平清单
+"""
+
+import fnmatch
+import os
+import posixpath
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator
+
+from parse_share_link import FeiNiuShareParser
+
+# 同时列出的目录数上限，可通过 NASPT_SHARE_WALK_WORKERS 配置
+WALK_WORKERS = int(os.environ.get('NASPT_SHARE_WALK_WORKERS', 8))
+
+
+def entry_path(entry: dict, parent: str) -> str:
+    """条目的完整路径：列表接口返回的path，没有时用上级目录和文件名拼出"""
+    return entry.get('path') or posixpath.join(parent, entry.get('file') or str(entry.get('fileId', '')))
+
+
+class ShareWalker:
+    """
+    遍历一个分享的所有目录
+
+    产出的条目是列表接口返回的字典，附加depth（根目录下为0）和parent（上级目录路径）
+    """
+
+    def __init__(self, parser: FeiNiuShareParser, workers: int | None = None, max_depth: int | None = None,
+                 pattern: str | None = None, include_dirs: bool = True, sign_method: int | None = None):
+        """
+        Args:
+            parser: 分享的解析器，共用它的认证信息、Cookie和连接池
+            workers: 同时列出的目录数，None使用WALK_WORKERS
+            max_depth: 最多展开的目录层数（0只列出根目录），None不限制
+            pattern: 只产出匹配的文件（glob，匹配文件名或不带开头/的相对路径），目录仍然展开
+            include_dirs: 是否产出目录条目
+            sign_method: 已知可用的签名方法，None时列出根目录时按sign_methods的顺序探测
+        """
+        self.parser = parser
+        self.workers = max(1, workers or WALK_WORKERS)
+        self.max_depth = max_depth
+        self.pattern = pattern
+        self.include_dirs = include_dirs
+        self.sign_method = sign_method
+        # 列出失败的子目录：{'path', 'error'}
+        self.errors: list[dict] = []
+        self.listed = 0
+        # (在树中的位置, 条目)，manifest()按位置排序，与遍历时各请求完成的先后无关
+        self._found: list[tuple[tuple, dict]] = []
+
+    def _matches(self, entry: dict) -> bool:
+        if entry.get('isDir'):
+            return self.include_dirs
+        if not self.pattern:
+            return True
+        relative = entry['path'].lstrip('/')
+        return fnmatch.fnmatch(relative, self.pattern) or fnmatch.fnmatch(posixpath.basename(relative), self.pattern)
+
+    def _expand(self, entry: dict) -> bool:
+        return bool(entry.get('isDir')) and (self.max_depth is None or entry['depth'] < self.max_depth)
+
+    def _list_root(self) -> list[dict]:
+        if not self.parser.auth:
+            self.parser.get_share_info()
+        if self.sign_method is not None:
+            return self.parser.get_file_list('/', sign_method=self.sign_method)
+        file_list, self.sign_method = self.parser.list_files('/')
+        if self.sign_method is None:
+            raise Exception("获取文件列表失败: 所有签名方法都被拒绝")
+        return file_list
+
+    def _list_dir(self, entry: dict) -> list[dict]:
+        return self.parser.get_file_list(entry['path'], sign_method=self.sign_method, file_id=entry.get('fileId'))
+
+    def walk(self) -> Iterator[dict]:
+        """
+        逐个产出条目（阻塞调用）：根目录列出失败时抛出异常，子目录失败记录在errors中并跳过
+        """
+        self.errors = []
+        self.listed = 0
+        self._found = []
+        # 根目录要先探测签名方法，单独列出
+        listings = [((), '/', 0, self._list_root())]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+            try:
+                while listings or pending:
+                    for position, parent, depth, file_list in listings:
+                        self.listed += 1
+                        for offset, item in enumerate(file_list or []):
+                            entry = dict(item, depth=depth, parent=parent)
+                            entry['path'] = entry_path(item, parent)
+                            entry_position = position + (offset,)
+                            if self._expand(entry):
+                                future = executor.submit(self._list_dir, entry)
+                                pending[future] = (entry_position, entry)
+                            if self._matches(entry):
+                                self._found.append((entry_position, entry))
+                                yield entry
+                    listings = []
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        entry_position, entry = pending.pop(future)
+                        try:
+                            listings.append((entry_position, entry['path'], entry['depth'] + 1, future.result()))
+                        except Exception as e:
+                            self.errors.append({'path': entry['path'], 'error': str(e)})
+            finally:
+                # 调用方提前结束遍历时不再发出新的请求
+                for future in pending:
+                    future.cancel()
+
+    def manifest(self) -> dict:
+        """
+        遍历结束后的扁平清单：条目按目录树的顺序（与服务端的列表顺序一致）编号，
+        by_path为路径到编号的映射
+        """
+        entries = [dict(entry, index=index) for index, (_, entry) in enumerate(sorted(self._found, key=lambda f: f[0]))]
+        return {
+            'share_id': self.parser.share_id,
+            'entries': entries,
+            'by_path': {entry['path']: entry['index'] for entry in entries},
+            'files': sum(1 for entry in entries if not entry.get('isDir')),
+            'dirs': sum(1 for entry in entries if entry.get('isDir')),
+            'listed': self.listed,
+            'errors': list(self.errors),
+        }
+
+    def run(self) -> dict:
+        """遍历整个分享并返回manifest()"""
+        for _ in self.walk():
+            pass
+        return self.manifest()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+交互式shell提权（sudo -i）状态机
+读取PTY输出，看到密码提示立即发送密码，看到疑似root提示符后用 id -u 确认，不依赖固定的sleep
+"""
+
+import re
+import select
+import time
+from typing import Callable
+
+from ssh_stream import wait_channel_readable, drain_channel, channel_finished
+
+# sudo密码提示；命令行里写成 'NASPT''_SUDO_PASSWORD:'，终端回显的命令不会被误判为提示
+SUDO_PROMPT = 'NASPT_SUDO_PASSWORD:'
+SUDO_COMMAND = "sudo -S -p 'NASPT''_SUDO_PASSWORD:' -i\n"
+# 确认提权结果的命令，同样拆开写，回显的命令不会被误判为结果
+PROBE_COMMAND = "echo NASPT''_UID:$(id -u)\n"
+# 等待提权完成的最长时间（秒）
+ESCALATION_TIMEOUT = 10.0
+
+_ANSI_RE = re.compile(r'\x1b\[[0-9;?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[()][0-9A-Za-z]|\r')
+# sudo命令的回显（提示本身不带引号），root提示符只在它或密码提示之后查找，登录横幅中以#结尾的行不算
+_COMMAND_ECHO = "_SUDO_PASSWORD:'"
+_PROBE_RESULT_RE = re.compile(r'NASPT_UID:(\d+)')
+_PROBE_RESULT_BYTES_RE = re.compile(rb'NASPT_UID:\d+[^\n]*\n')
+_FAILURE_PATTERNS = (
+    'Sorry, try again',
+    'incorrect password',
+    'is not in the sudoers',
+    'may not run sudo',
+    'sudo: command not found',
+    'sudo: not found',
+    '抱歉，请重试',
+    '不在 sudoers',
+)
+
+
+def strip_ansi(text: str) -> str:
+    """去掉终端控制序列，便于匹配提示符"""
+    return _ANSI_RE.sub('', text)
+
+
+class EscalationResult:
+    """提权结果"""
+
+    def __init__(self, success: bool | None, output: bytes, elapsed: float):
+        # True: 已是root；False: 明确失败；None: 超时，结果未知
+        self.success = success
+        # 提权过程中读到的输出（已去除密码），需要转发给终端
+        self.output = output
+        self.elapsed = elapsed
+
+
+class SudoEscalation:
+    """
+    在交互式shell中执行 sudo -i 的状态机
+
+    run()直接读取paramiko通道；其他SSH实现可以自行读取输出，按 start() -> feed() -> finish() 驱动，
+    channel只需要提供send()
+
+    状态流转: wait_prompt --(密码提示)--> sent_password --(root提示符)--> probing --(id -u为0)--> done
+              wait_prompt --(root提示符，免密sudo)--> probing
+              任意状态 --(失败提示/重复要求密码/id -u不为0/通道关闭)--> failed
+
+    root提示符只认sudo命令回显或密码提示之后、最后一行以#结尾的输出；
+    这只是候选，再执行 id -u 确认，避免把以#结尾的普通提示符当作提权成功
+    """
+
+    def __init__(self, channel, password: str, select_func: Callable = select.select,
+                 timeout: float = ESCALATION_TIMEOUT):
+        self.channel = channel
+        self.password = password
+        self.select_func = select_func
+        self.timeout = timeout
+        self.state = 'start'
+        self._output = bytearray()
+        self._prompt_count = 0
+        # 发送确认命令时已读到的输出长度，用于从转发的输出中去掉确认命令
+        self._probe_at = None
+        self._started_at = time.monotonic()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ('done', 'failed')
+
+    def start(self):
+        """发送sudo命令，开始等待提示"""
+        self._started_at = time.monotonic()
+        self.channel.send(SUDO_COMMAND)
+        self.state = 'wait_prompt'
+
+    def feed(self, data: bytes):
+        """处理读到的一段输出；data为空表示通道已结束"""
+        if not data:
+            self.state = 'failed'
+            return
+        self._output += data
+        self._advance()
+
+    def finish(self, closed: bool = False) -> EscalationResult:
+        """结束提权（完成、失败或超时），失败时取消等待中的sudo"""
+        if self.state == 'failed' and not closed:
+            # 取消还在等待密码的sudo，回到普通用户shell
+            self.channel.send('\x03')
+        success = {'done': True, 'failed': False}.get(self.state)
+        return EscalationResult(success, self._scrubbed_output(), time.monotonic() - self._started_at)
+
+    def run(self) -> EscalationResult:
+        """在paramiko通道上同步执行提权"""
+        self.start()
+        deadline = self._started_at + self.timeout
+        while not self.finished:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not wait_channel_readable(self.channel, remaining, self.select_func):
+                continue
+            data = drain_channel(self.channel)
+            if data or channel_finished(self.channel):
+                self.feed(data)
+        return self.finish(closed=self.channel.closed)
+
+    def _advance(self):
+        text = strip_ansi(self._output[-4096:].decode('utf-8', errors='ignore'))
+        prompt_count = text.count(SUDO_PROMPT)
+        if any(pattern in text for pattern in _FAILURE_PATTERNS):
+            self.state = 'failed'
+            return
+        if self.state == 'wait_prompt':
+            if prompt_count > self._prompt_count:
+                self._prompt_count = prompt_count
+                self.channel.send(f'{self.password}\n')
+                self.state = 'sent_password'
+            elif _has_root_prompt(text, _COMMAND_ECHO):
+                # sudo免密或凭据仍在有效期内
+                self._probe()
+        elif self.state == 'sent_password':
+            if prompt_count > self._prompt_count:
+                # 再次要求输入密码，说明密码错误
+                self.state = 'failed'
+            elif _has_root_prompt(text, SUDO_PROMPT):
+                self._probe()
+        elif self.state == 'probing':
+            match = _PROBE_RESULT_RE.search(text)
+            if match:
+                self.state = 'done' if match.group(1) == '0' else 'failed'
+
+    def _probe(self):
+        self._probe_at = len(self._output)
+        self.channel.send(PROBE_COMMAND)
+        self.state = 'probing'
+
+    def _scrubbed_output(self) -> bytes:
+        output = bytes(self._output)
+        if self._probe_at is not None:
+            # 去掉候选提示符所在的行、确认命令的回显和结果，只保留确认后的提示符
+            match = _PROBE_RESULT_BYTES_RE.search(output, self._probe_at)
+            if match:
+                head = output[:self._probe_at]
+                output = head[:head.rfind(b'\n') + 1] + output[match.end():]
+        if self.password:
+            output = output.replace(self.password.encode('utf-8'), b'')
+        return output.replace(SUDO_PROMPT.encode('utf-8'), '[sudo] password: '.encode('utf-8'))
+
+
+def _has_root_prompt(text: str, marker: str) -> bool:
+    """marker之后已换行，且收到的最后一行以#结尾（看起来是root提示符）"""
+    position = text.rfind(marker)
+    if position < 0:
+        return False
+    after = text[position + len(marker):]
+    return '\n' in after and after.rsplit('\n', 1)[1].rstrip().endswith('#')
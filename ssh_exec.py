@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+exec通道上执行命令
+与交互式终端共用池化的SSH传输，但每条命令有自己的通道：stdout和stderr分开按行读取，结束时得到退出码，
+不会排在终端里正在运行的程序后面。非root登录时先尝试sudo执行（sudo不可用或被拒绝时以登录用户执行）
+"""
+
+import codecs
+import secrets
+import shlex
+import time
+from typing import Callable
+
+from ssh_stream import wait_channel_readable, drain_channel, close_channel, RECV_CHUNK_SIZE, DRAIN_LIMIT
+
+# 等待通道事件的兜底间隔（秒），用于检查取消和超时
+EXEC_POLL_INTERVAL = 1.0
+# 每个终端会话同时进行的操作数上限
+MAX_SESSION_OPERATIONS = 8
+
+
+def build_exec_command(command: str, username: str, sudo_root: bool | None) -> tuple[str, bytes | None]:
+    """
+    组装exec通道上执行的命令
+
+    Args:
+        username: 实际登录的用户名
+        sudo_root: 该连接sudo能否切换到root（None表示未知）
+
+    Returns:
+        (命令, 需要写入stdin的数据)；非root时stdin写入sudo密码，命令本身的stdin为/dev/null
+    """
+    quoted = shlex.quote(command)
+    if username == 'root' or sudo_root is False:
+        return f'sh -c {quoted} </dev/null', None
+    # sudo -v 从stdin读取密码（免密sudo时不读取），验证失败时以登录用户执行
+    return (f"if sudo -S -p '' -v 2>/dev/null; then exec sudo -n sh -c {quoted} </dev/null; "
+            f"else exec sh -c {quoted} </dev/null; fi"), b''
+
+
+class LineSplitter:
+    """把字节流解码并切分成完整的行，不完整的行留到下次"""
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial = ''
+
+    def feed(self, data: bytes) -> list[str]:
+        text = self._partial + self._decoder.decode(data)
+        lines = text.split('\n')
+        self._partial = lines.pop()
+        return [line.rstrip('\r') for line in lines]
+
+    def flush(self) -> list[str]:
+        text = self._partial + self._decoder.decode(b'', final=True)
+        self._partial = ''
+        return [text.rstrip('\r')] if text else []
+
+
+def _drain_stderr(channel, max_bytes: int = DRAIN_LIMIT) -> bytes:
+    chunks = []
+    total = 0
+    while total < max_bytes and channel.recv_stderr_ready():
+        chunk = channel.recv_stderr(min(RECV_CHUNK_SIZE, max_bytes - total))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        total += len(chunk)
+    return b''.join(chunks)
+
+
+class ExecResult:
+    """命令执行结果"""
+
+    def __init__(self, exit_status: int | None, elapsed: float, cancelled: bool = False, timed_out: bool = False):
+        # 远程进程的退出码；被取消、超时或通道异常关闭时为None
+        self.exit_status = exit_status
+        self.elapsed = elapsed
+        self.cancelled = cancelled
+        self.timed_out = timed_out
+
+    @property
+    def success(self) -> bool:
+        return self.exit_status == 0
+
+
+def run_command(lease, command: str, password: str | None,
+                on_output: Callable[[str, list[str]], None],
+                select_func: Callable,
+                blocking_call: Callable = lambda func, *args: func(*args),
+                timeout: float | None = None,
+                is_cancelled: Callable[[], bool] = lambda: False) -> ExecResult:
+    """
+    在池化连接上新开exec通道执行命令，输出按行回调
+
+    Args:
+        lease: SSHLease
+        password: 非root登录时用于sudo的密码
+        on_output: 回调(stream, lines)，stream为 'stdout' 或 'stderr'
+        select_func: 与异步模式匹配的select（见ssh_stream.get_select）
+        blocking_call: 执行阻塞调用的函数（见ssh_stream.get_blocking_call），用于打开通道
+        timeout: 最长执行时间（秒），None表示不限制
+        is_cancelled: 返回True时关闭通道并结束
+    """
+    start = time.monotonic()
+    wrapped, stdin_data = build_exec_command(command, lease.username, lease.conn.sudo_root)
+    channel = blocking_call(lease.transport.open_session)
+    try:
+        blocking_call(channel.exec_command, wrapped)
+        if stdin_data is not None and password:
+            channel.sendall((password + '\n').encode('utf-8'))
+        channel.shutdown_write()
+
+        splitters = {'stdout': LineSplitter(), 'stderr': LineSplitter()}
+        while True:
+            if is_cancelled():
+                return ExecResult(None, time.monotonic() - start, cancelled=True)
+            if timeout is not None and time.monotonic() - start > timeout:
+                return ExecResult(None, time.monotonic() - start, timed_out=True)
+            wait_channel_readable(channel, timeout=EXEC_POLL_INTERVAL, select_func=select_func)
+            for stream, data in (('stdout', drain_channel(channel)), ('stderr', _drain_stderr(channel))):
+                if data:
+                    lines = splitters[stream].feed(data)
+                    if lines:
+                        on_output(stream, lines)
+            if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+            if channel.closed and not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+
+        for stream, splitter in splitters.items():
+            lines = splitter.flush()
+            if lines:
+                on_output(stream, lines)
+        exit_status = channel.recv_exit_status() if channel.exit_status_ready() else None
+        return ExecResult(exit_status, time.monotonic() - start)
+    finally:
+        close_channel(channel)
+
+
+class RemoteOperation:
+    """终端会话上的一次操作（部署、查看日志、下载脚本），在独立的exec通道上执行，不经过终端"""
+
+    def __init__(self, kind: str, title: str):
+        self.id = secrets.token_hex(6)
+        self.kind = kind
+        self.title = title
+        self.status = 'running'
+        self.exit_status = None
+        self.message = ''
+        self.started_at = time.time()
+        self.elapsed = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def finish(self, result: ExecResult):
+        """根据执行结果设置状态：done（退出码0）、failed 或 cancelled"""
+        self.exit_status = result.exit_status
+        self.elapsed = result.elapsed
+        if result.cancelled:
+            self.status, self.message = 'cancelled', '已取消'
+        elif result.timed_out:
+            self.status, self.message = 'failed', '执行超时'
+        elif result.exit_status is None:
+            self.status, self.message = 'failed', '连接已断开，未收到退出码'
+        else:
+            self.status = 'done' if result.success else 'failed'
+
+    def fail(self, message: str):
+        self.status = 'failed'
+        self.message = message
+        self.elapsed = time.time() - self.started_at
+
+    @property
+    def finished(self) -> bool:
+        return self.status != 'running'
+
+    def snapshot(self) -> dict:
+        return {
+            'operation_id': self.id,
+            'kind': self.kind,
+            'title': self.title,
+            'status': self.status,
+            'exit_code': self.exit_status,
+            'message': self.message,
+            'started_at': self.started_at,
+            'elapsed': round(self.elapsed, 2) if self.elapsed is not None else None
+        }
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多主机并行执行
+把同一个操作（compose启停、shell命令、批量下载）同时下发到多台已保存的主机：
+最多parallelism台同时执行，其余排队；每台主机的状态、输出和退出码实时回报，总耗时约等于最慢的一台
+"""
+
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+# 默认并发主机数，可通过 NASPT_FANOUT_PARALLELISM 配置
+DEFAULT_PARALLELISM = int(os.environ.get('NASPT_FANOUT_PARALLELISM', 8))
+# 并发主机数上限
+MAX_PARALLELISM = 64
+# 单个任务的主机数上限
+MAX_TARGETS = 200
+
+# 主机状态
+QUEUED = 'queued'
+CONNECTING = 'connecting'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+def clamp_parallelism(value) -> int:
+    """把前端传入的并发数限制在 [1, MAX_PARALLELISM]，无效值使用默认值"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = DEFAULT_PARALLELISM
+    return max(1, min(value, MAX_PARALLELISM))
+
+
+class FanoutTarget:
+    """一台目标主机及其执行状态"""
+
+    def __init__(self, target_id: str, host: str, port, username: str, password: str, name: str = ''):
+        self.id = target_id
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.name = name or f'{username}@{host}'
+        self.status = QUEUED
+        self.exit_code = None
+        self.message = ''
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def elapsed(self) -> float | None:
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def snapshot(self) -> dict:
+        """发送给前端的状态（不含密码）"""
+        elapsed = self.elapsed
+        return {
+            'target_id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'exit_code': self.exit_code,
+            'message': self.message,
+            'elapsed': round(elapsed, 2) if elapsed is not None else None
+        }
+
+
+class FanoutJob:
+    """
+    一次多主机执行任务
+
+    run()启动min(parallelism, 主机数)个工作任务，每个任务从队列中取主机执行host_task，
+    host_task返回退出码（0为成功），抛出异常视为失败；取消后排队的主机不再执行，
+    正在执行的主机由host_task通过job.cancelled自行结束
+    """
+
+    def __init__(self, targets: list[FanoutTarget], operation: dict, parallelism: int,
+                 start_task: Callable, on_update: Callable, on_done: Callable, owner: str | None = None):
+        """
+        Args:
+            operation: 操作描述，由host_task解释
+            start_task: 启动后台任务的函数（socketio.start_background_task）
+            on_update: 回调(job, target)，主机状态变化时调用
+            on_done: 回调(job)，所有主机结束后调用一次
+            owner: 发起任务的Socket.IO sid
+        """
+        self.id = secrets.token_hex(6)
+        self.targets = targets
+        self.operation = operation
+        self.parallelism = clamp_parallelism(parallelism)
+        self.owner = owner
+        self.cancelled = False
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._start_task = start_task
+        self._on_update = on_update
+        self._on_done = on_done
+        self._queue = deque(targets)
+        self._lock = threading.Lock()
+        self._running_workers = 0
+
+    def run(self, host_task: Callable):
+        """启动工作任务后立即返回"""
+        self.started_at = time.monotonic()
+        workers = min(self.parallelism, len(self.targets))
+        self._running_workers = workers
+        for _ in range(workers):
+            self._start_task(self._worker, host_task)
+        if workers == 0:
+            self._finish()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def update(self, target: FanoutTarget, status: str, message: str = ''):
+        """更新主机状态并通知前端"""
+        target.status = status
+        if message:
+            target.message = message
+        if status in FINISHED_STATES:
+            target.finished_at = time.monotonic()
+        self._on_update(self, target)
+
+    def _next_target(self) -> FanoutTarget | None:
+        with self._lock:
+            if self.cancelled or not self._queue:
+                return None
+            return self._queue.popleft()
+
+    def _worker(self, host_task: Callable):
+        try:
+            while True:
+                target = self._next_target()
+                if target is None:
+                    break
+                target.started_at = time.monotonic()
+                self.update(target, CONNECTING)
+                try:
+                    target.exit_code = host_task(self, target)
+                except Exception as e:
+                    self.update(target, FAILED, str(e))
+                    continue
+                if self.cancelled and target.exit_code is None:
+                    self.update(target, CANCELLED, '已取消')
+                elif target.exit_code == 0:
+                    self.update(target, DONE)
+                else:
+                    self.update(target, FAILED, target.message or f'退出码 {target.exit_code}')
+        finally:
+            with self._lock:
+                self._running_workers -= 1
+                last = self._running_workers == 0
+            if last:
+                self._finish()
+
+    def _finish(self):
+        # 取消时还在排队的主机
+        for target in self._queue:
+            if target.status == QUEUED:
+                target.status = CANCELLED
+                target.message = '已取消'
+                self._on_update(self, target)
+        self._queue.clear()
+        self.finished_at = time.monotonic()
+        self._on_done(self)
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def summary(self) -> dict:
+        counts = {}
+        for target in self.targets:
+            counts[target.status] = counts.get(target.status, 0) + 1
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.monotonic()) - self.started_at, 2)
+        return {
+            'job_id': self.id,
+            'total': len(self.targets),
+            'parallelism': self.parallelism,
+            'counts': counts,
+            'cancelled': self.cancelled,
+            'elapsed': elapsed,
+            'slowest': max((t.elapsed or 0 for t in self.targets), default=0),
+            'targets': [target.snapshot() for target in self.targets]
+        }
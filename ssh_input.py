@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSH终端输入写入
+同一会话的输入先进入缓冲区，由一个写入者合并后分块发送：
+通道窗口已满时让出事件循环等待，而不是阻塞在channel.send里；
+大段粘贴按块发送并回报进度，调用方可以等待自己的数据真正写入通道后再继续
+"""
+
+import threading
+import time
+from typing import Callable
+
+# 单次channel.send的最大字节数（与paramiko默认最大包大小一致）
+SEND_CHUNK_SIZE = 32768
+# 通道窗口已满时的等待间隔（秒）
+WINDOW_WAIT_INTERVAL = 0.01
+# 等待数据写入通道的最长时间（秒）
+FLUSH_TIMEOUT = 60.0
+
+
+class InputWriter:
+    """一个shell通道的输入写入者"""
+
+    def __init__(self, channel, sleep_func: Callable = time.sleep):
+        self.channel = channel
+        self.sleep = sleep_func
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._flushing = False
+        # 累计入队/已写入通道的字节数，用于等待某段数据写完
+        self.queued = 0
+        self.sent = 0
+        self.flushes = 0
+
+    @property
+    def pending(self) -> int:
+        return self.queued - self.sent
+
+    def write(self, data: bytes | str) -> int:
+        """
+        数据入队，返回写完这段数据后的累计偏移量（传给wait_sent）
+
+        不负责发送，调用flush()或wait_sent()触发发送
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._lock:
+            self._buffer += data
+            self.queued += len(data)
+            return self.queued
+
+    def flush(self, on_progress: Callable[[int], None] | None = None, deadline: float | None = None) -> bool:
+        """
+        把缓冲区写入通道；已有其他调用方在写时直接返回False，由它把新数据一起写出
+
+        先让出一次事件循环，让同时到达的输入事件先入队，再合并发送
+
+        Args:
+            deadline: time.monotonic()的截止时间，None为FLUSH_TIMEOUT秒后；远程窗口一直已满
+                （远程程序不读取输入）到截止时间时抛出TimeoutError，未写出的数据留在缓冲区
+        """
+        if deadline is None:
+            deadline = time.monotonic() + FLUSH_TIMEOUT
+        with self._lock:
+            if self._flushing:
+                return False
+            self._flushing = True
+        try:
+            self.sleep(0)
+            self.flushes += 1
+            while True:
+                with self._lock:
+                    if not self._buffer:
+                        break
+                    chunk = bytes(self._buffer[:SEND_CHUNK_SIZE])
+                if self.channel.closed:
+                    raise EOFError('SSH通道已关闭')
+                if not self.channel.send_ready():
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError('发送超时，远程终端未读取输入')
+                    # 远程窗口已满：让出事件循环，等待对端消费
+                    self.sleep(WINDOW_WAIT_INTERVAL)
+                    continue
+                sent = self.channel.send(chunk)
+                if sent <= 0:
+                    raise EOFError('SSH通道已关闭')
+                with self._lock:
+                    del self._buffer[:sent]
+                    self.sent += sent
+                if on_progress is not None:
+                    on_progress(self.sent)
+                if self._buffer:
+                    # 分块之间让出事件循环，大段输入不会长时间占用hub
+                    self.sleep(0)
+        finally:
+            with self._lock:
+                self._flushing = False
+        return True
+
+    def wait_sent(self, offset: int, timeout: float = FLUSH_TIMEOUT,
+                  on_progress: Callable[[int], None] | None = None) -> bool:
+        """
+        等待累计偏移量offset之前的数据全部写入通道
+
+        没有其他写入者时由当前调用方负责写；否则等待对方写完
+
+        Returns:
+            是否在超时前写完
+        """
+        deadline = time.monotonic() + timeout
+        while self.sent < offset:
+            if self.channel.closed:
+                raise EOFError('SSH通道已关闭')
+            try:
+                flushed = self.flush(on_progress, deadline)
+            except TimeoutError:
+                return False
+            if not flushed:
+                if time.monotonic() > deadline:
+                    return False
+                self.sleep(WINDOW_WAIT_INTERVAL)
+        return True
+
+    def clear(self):
+        """丢弃尚未写入的数据（会话关闭时调用）"""
+        with self._lock:
+            self.sent += len(self._buffer)
+            self._buffer.clear()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步分级日志
+日志记录只做一次入队操作，由后台线程统一写入stdout，终端高频路径不会阻塞在日志I/O上
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+LOGGER_NAME = 'naspt'
+# 日志队列上限，写入线程跟不上时丢弃新日志而不是阻塞调用方
+LOG_QUEUE_SIZE = 10000
+# 标记需要采样的高频日志（每个数据块、每次按键），用法: logger.debug(..., extra=SAMPLED)
+SAMPLED = {'sampled': True}
+
+_listener = None
+_lock = threading.Lock()
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志并计数，不阻塞、不打印异常"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """停止时等待队列腾出位置再放入结束标记：队列已满时标准实现的put_nowait会抛出queue.Full"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class SamplingFilter(logging.Filter):
+    """对标记了SAMPLED的日志每N条只保留一条，其余日志不受影响"""
+
+    def __init__(self, every: int = 1):
+        super().__init__()
+        self.every = max(1, every)
+        self._count = 0
+
+    def filter(self, record):
+        if self.every == 1 or not getattr(record, 'sampled', False):
+            return True
+        self._count += 1
+        return self._count % self.every == 1
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def setup_logging(level: str | None = None, sample_every: int | None = None) -> logging.Logger:
+    """
+    初始化日志（重复调用只生效一次）
+
+    Args:
+        level: 日志级别，默认读取环境变量 NASPT_LOG_LEVEL（默认INFO）；
+               DEBUG级别才会输出每个数据块/每次按键的日志
+        sample_every: 高频日志采样间隔，默认读取 NASPT_LOG_SAMPLE_EVERY（默认1，即不采样）
+
+    Returns:
+        naspt根logger
+    """
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    with _lock:
+        if _listener is not None:
+            return logger
+
+        level_name = (level or os.environ.get('NASPT_LOG_LEVEL', 'INFO')).upper()
+        logger.setLevel(getattr(logging, level_name, logging.INFO))
+        logger.propagate = False
+
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        queue_handler = _DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(
+            sample_every if sample_every is not None else _env_int('NASPT_LOG_SAMPLE_EVERY', 1)
+        ))
+        logger.addHandler(queue_handler)
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter('%(message)s'))
+        _listener = _QueueListener(log_queue, stream_handler)
+        _listener.start()
+        atexit.register(shutdown_logging)
+    return logger
+
+
+def shutdown_logging():
+    """停止后台写入线程，并写出队列中剩余的日志"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str | None = None) -> logging.Logger:
+    """获取naspt下的子logger"""
+    setup_logging()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+
+def get_dropped_count() -> int:
+    """返回因队列已满而被丢弃的日志条数"""
+    for handler in logging.getLogger(LOGGER_NAME).handlers:
+        if isinstance(handler, _DroppingQueueHandler):
+            return handler.dropped
+    return 0
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSH传输连接池
+按 (主机, 端口, 用户名) 缓存已认证的paramiko传输，交互shell、exec通道和SFTP都在同一传输上打开，
+通过引用计数管理生命周期，空闲超时后自动关闭
+"""
+
+import hashlib
+import hmac
+import socket
+import threading
+import time
+
+import paramiko
+
+from host_facts import HostFacts
+from remote_transfer import RemoteTransfer
+from ssh_exec import build_exec_command
+
+# 空闲连接保留时间（秒）
+DEFAULT_IDLE_TIMEOUT = 300.0
+# 建立连接的超时时间（秒）
+DEFAULT_CONNECT_TIMEOUT = 10
+# 传输层keepalive间隔（秒），及时发现断开的连接
+KEEPALIVE_INTERVAL = 30
+# 以root执行的辅助命令（创建目录、移动上传的文件）的超时时间（秒）
+PRIVILEGED_TIMEOUT = 60
+
+
+def _password_digest(password: str) -> bytes:
+    return hashlib.sha256(password.encode('utf-8')).digest()
+
+
+def _open_client(host: str, port, username: str, password: str, timeout: float) -> paramiko.SSHClient:
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect(hostname=host, port=int(port), username=username, password=password, timeout=timeout)
+    # 多个终端共用一个传输，按键包紧挨着发送时不能被Nagle算法合并等待（OpenSSH交互会话同样关闭）
+    try:
+        ssh.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (AttributeError, OSError):
+        pass
+    return ssh
+
+
+def connect_client(host: str, port, username: str, password: str, timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                   method: str | None = None):
+    """
+    建立SSH连接；用户名不是root时优先使用相同密码直接登录root
+
+    Args:
+        method: 上次成功的登录方式（'root' 直接登录root；'sudo'/'user' 登录原用户），
+                为None时root登录和原用户登录并发进行，总耗时约为一次握手
+
+    Returns:
+        (SSHClient, 实际登录的用户名)
+    """
+    if username.lower() == 'root' or method in ('sudo', 'user'):
+        return _open_client(host, port, username, password, timeout), username
+    if method == 'root':
+        try:
+            return _open_client(host, port, 'root', password, timeout), 'root'
+        except Exception:
+            # root登录不再可用，回退到原用户
+            return _open_client(host, port, username, password, timeout), username
+
+    # 并发尝试root登录和原用户登录
+    results = {}
+    done = threading.Condition()
+
+    def attempt(login_name):
+        try:
+            client, error = _open_client(host, port, login_name, password, timeout), None
+        except Exception as e:
+            client, error = None, e
+        with done:
+            results[login_name] = (client, error)
+            done.notify_all()
+
+    for login_name in ('root', username):
+        threading.Thread(target=attempt, args=(login_name,), daemon=True).start()
+
+    with done:
+        # root优先：root成功立即返回；root失败则等待原用户的结果
+        done.wait_for(lambda: 'root' in results and (results['root'][0] is not None or username in results))
+
+    def close_later(login_name):
+        # 另一路连接不再需要，在其完成后关闭
+        with done:
+            done.wait_for(lambda: login_name in results)
+            client = results[login_name][0]
+        if client is not None:
+            client.close()
+
+    root_client, _ = results['root']
+    if root_client is not None:
+        threading.Thread(target=close_later, args=(username,), daemon=True).start()
+        return root_client, 'root'
+    user_client, user_error = results[username]
+    if user_client is None:
+        raise user_error
+    return user_client, username
+
+
+class PooledConnection:
+    """连接池中的一个已认证连接"""
+
+    def __init__(self, key: tuple, client: paramiko.SSHClient, username: str, password: str):
+        self.key = key
+        self.client = client
+        self.username = username
+        self.password_digest = _password_digest(password)
+        # 非root登录时，创建目录、写入文件遇到权限不足改用sudo执行，需要登录密码
+        self._sudo_password = password if username != 'root' else None
+        self.refcount = 0
+        # sudo能否切换到root（None表示尚未检测）
+        self.sudo_root = None
+        # 主机信息缓存，同一主机的多个会话共享
+        self.facts = HostFacts(privileged=self.run_privileged)
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.transport = client.get_transport()
+        self.transport.set_keepalive(KEEPALIVE_INTERVAL)
+        # 文件传输（复用同一个SFTP会话）
+        self.transfer = RemoteTransfer(client, privileged=self.run_privileged)
+
+    def is_active(self) -> bool:
+        return self.transport is not None and self.transport.is_active()
+
+    def run_privileged(self, command: str, timeout: float = PRIVILEGED_TIMEOUT) -> tuple[int, str, str]:
+        """
+        以root执行命令（阻塞调用）：root登录时直接执行，否则与run_command相同经sudo执行
+
+        Returns:
+            (退出码, stdout, stderr)
+        """
+        wrapped, stdin_data = build_exec_command(command, self.username, self.sudo_root)
+        stdin, stdout, stderr = self.client.exec_command(wrapped, timeout=timeout)
+        if stdin_data is not None and self._sudo_password:
+            stdin.write(self._sudo_password + '\n')
+            stdin.flush()
+        stdin.channel.shutdown_write()
+        output = stdout.read().decode('utf-8', errors='replace')
+        error = stderr.read().decode('utf-8', errors='ignore').strip()
+        return stdout.channel.recv_exit_status(), output, error
+
+    def matches_password(self, password: str) -> bool:
+        return hmac.compare_digest(self.password_digest, _password_digest(password))
+
+    def close(self):
+        self.transfer.close()
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class SSHLease:
+    """对连接池中连接的一次引用，用完调用release()（可重复调用）"""
+
+    def __init__(self, pool: 'SSHTransportPool', conn: PooledConnection, reused: bool):
+        self._pool = pool
+        self.conn = conn
+        self.reused = reused
+        self.released = False
+
+    @property
+    def client(self) -> paramiko.SSHClient:
+        return self.conn.client
+
+    @property
+    def transport(self) -> paramiko.Transport:
+        return self.conn.transport
+
+    @property
+    def username(self) -> str:
+        return self.conn.username
+
+    def open_shell(self, term: str = 'xterm-256color', width: int = 80, height: int = 24) -> paramiko.Channel:
+        """在池化传输上打开一个新的交互式shell"""
+        channel = self.conn.transport.open_session()
+        channel.get_pty(term=term, width=width, height=height)
+        channel.invoke_shell()
+        return channel
+
+    def exec_command(self, command: str, timeout: float | None = None):
+        """在池化传输上打开exec通道执行命令，返回 (stdin, stdout, stderr)"""
+        return self.conn.client.exec_command(command, timeout=timeout)
+
+    def open_sftp(self) -> paramiko.SFTPClient:
+        """在池化传输上打开SFTP会话"""
+        return paramiko.SFTPClient.from_transport(self.conn.transport)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._pool.release(self.conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class SSHTransportPool:
+    """按 (主机, 端口, 用户名) 复用已认证的SSH传输"""
+
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._conns: dict[tuple, PooledConnection] = {}
+        # 每个 (主机, 端口, 用户名) 上次成功的登录方式: root / sudo / user
+        self.login_methods: dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(host: str, port, username: str) -> tuple:
+        return (host, int(port), username)
+
+    def acquire(self, host: str, port, username: str, password: str) -> SSHLease:
+        """
+        获取一个已认证的连接；池中有可用连接且密码一致时直接复用，否则新建
+
+        Returns:
+            SSHLease，用完必须release()
+        """
+        key = self.make_key(host, port, username)
+        stale = []
+        with self._lock:
+            conn = self._conns.get(key)
+            if conn is not None and (not conn.is_active() or not conn.matches_password(password)):
+                # 连接已断开或密码已变更，不能复用
+                if conn.refcount == 0 or not conn.is_active():
+                    stale.append(self._conns.pop(key))
+                conn = None
+            if conn is not None:
+                conn.refcount += 1
+                conn.last_used = time.monotonic()
+                lease = SSHLease(self, conn, reused=True)
+        for old in stale:
+            old.close()
+        if conn is not None:
+            return lease
+
+        # 在锁外完成TCP、密钥交换和认证
+        client, effective_username = connect_client(host, port, username, password, timeout=self.connect_timeout,
+                                                    method=self.login_methods.get(key))
+        if effective_username == 'root' and username.lower() != 'root':
+            self.login_methods[key] = 'root'
+        elif self.login_methods.get(key) == 'root':
+            del self.login_methods[key]
+        new_conn = PooledConnection(key, client, effective_username, password)
+        with self._lock:
+            existing = self._conns.get(key)
+            if existing is not None and existing.is_active() and existing.matches_password(password):
+                # 并发获取时别人已经建好了，使用已有连接
+                existing.refcount += 1
+                existing.last_used = time.monotonic()
+                conn, reused = existing, True
+            else:
+                if existing is None or existing.refcount == 0:
+                    self._conns[key] = new_conn
+                new_conn.refcount += 1
+                conn, reused = new_conn, False
+        if conn is not new_conn:
+            new_conn.close()
+        self.sweep()
+        return SSHLease(self, conn, reused=reused)
+
+    def release(self, conn: PooledConnection):
+        """归还连接；不在池中的连接（被替换或已断开）在引用归零时直接关闭"""
+        close_now = False
+        with self._lock:
+            conn.refcount = max(0, conn.refcount - 1)
+            conn.last_used = time.monotonic()
+            if conn.refcount == 0 and (self._conns.get(conn.key) is not conn or not conn.is_active()):
+                if self._conns.get(conn.key) is conn:
+                    del self._conns[conn.key]
+                close_now = True
+        if close_now:
+            conn.close()
+
+    def sweep(self) -> int:
+        """关闭空闲超时或已断开的连接，返回关闭的数量"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, conn in list(self._conns.items()):
+                if conn.refcount == 0 and (now - conn.last_used > self.idle_timeout or not conn.is_active()):
+                    expired.append(self._conns.pop(key))
+        for conn in expired:
+            conn.close()
+        return len(expired)
+
+    def remember_login_method(self, conn: PooledConnection, method: str):
+        """记录非root用户的提权结果（'sudo' 或 'user'），下次连接跳过root登录尝试"""
+        with self._lock:
+            self.login_methods[conn.key] = method
+
+    def invalidate(self, host: str, port, username: str):
+        """从池中移除指定连接（不影响正在使用它的会话）"""
+        key = self.make_key(host, port, username)
+        with self._lock:
+            conn = self._conns.pop(key, None)
+            close_now = conn is not None and conn.refcount == 0
+        if close_now:
+            conn.close()
+
+    def stats(self) -> list[dict]:
+        """返回池中连接的状态"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'host': conn.key[0],
+                    'port': conn.key[1],
+                    'username': conn.key[2],
+                    'effective_username': conn.username,
+                    'refcount': conn.refcount,
+                    'idle_seconds': round(now - conn.last_used, 1) if conn.refcount == 0 else 0,
+                    'active': conn.is_active(),
+                }
+                for conn in self._conns.values()
+            ]
+
+    def close_all(self):
+        with self._lock:
+            conns = list(self._conns.values())
+            self._conns.clear()
+        for conn in conns:
+            conn.close()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSH会话生命周期管理
+登记终端会话，负责容量限制（总数、单主机数）、空闲超时回收、关闭时释放通道和池化连接，并统计资源占用。
+会话与Socket.IO连接解耦：浏览器断开后会话进入分离状态，继续把输出写入回滚缓冲区，
+刷新页面后凭会话令牌重新附加，立即收到缓冲的屏幕内容，无需重新登录。
+会话的归属和容量计数记录在登记表（session_registry）中，多个工作进程可共用同一份登记
+"""
+
+import collections
+import hmac
+import os
+import secrets
+import threading
+import time
+from typing import Callable
+
+from session_registry import MemorySessionRegistry, WORKER_ID
+from ssh_input import InputWriter
+from ssh_stream import close_channel, OutputWindow
+
+# 会话总数上限（0表示不限制）
+DEFAULT_MAX_SESSIONS = int(os.environ.get('NASPT_MAX_SESSIONS', 50))
+# 单台主机的会话上限（0表示不限制）
+DEFAULT_MAX_SESSIONS_PER_HOST = int(os.environ.get('NASPT_MAX_SESSIONS_PER_HOST', 10))
+# 无输入也无输出超过该时间（秒）的会话会被关闭（0表示不回收）
+DEFAULT_IDLE_TIMEOUT = float(os.environ.get('NASPT_SESSION_IDLE_TIMEOUT', 1800))
+# 浏览器断开后会话保留的时间（秒），期间可重新附加（0表示断开即关闭）
+DEFAULT_DETACH_TIMEOUT = float(os.environ.get('NASPT_SESSION_DETACH_TIMEOUT', 600))
+# 每个会话的回滚缓冲区大小（字节）
+DEFAULT_SCROLLBACK_BYTES = int(os.environ.get('NASPT_SCROLLBACK_BYTES', 256 * 1024))
+
+
+class SessionLimitError(Exception):
+    """超出会话数量限制"""
+
+
+class ScrollbackBuffer:
+    """按字节预算保存最近输出的环形缓冲区，超出预算时丢弃最早的帧"""
+
+    def __init__(self, max_bytes: int = DEFAULT_SCROLLBACK_BYTES):
+        self.max_bytes = max_bytes
+        self._frames: collections.deque[bytes] = collections.deque()
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, data: bytes):
+        if not data or self.max_bytes <= 0:
+            return
+        if len(data) > self.max_bytes:
+            data = data[-self.max_bytes:]
+        self._frames.append(data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            old = self._frames.popleft()
+            self.size -= len(old)
+            self.dropped += len(old)
+
+    def snapshot(self) -> bytes:
+        return b''.join(self._frames)
+
+    def clear(self):
+        self._frames.clear()
+        self.size = 0
+
+
+class SSHSession:
+    """一个终端会话：shell通道 + 连接池租约；sid为当前附加的Socket.IO连接，分离时为None"""
+
+    def __init__(self, sid: str, host: str, port, username: str, lease, channel,
+                 sleep_func: Callable = time.sleep, scrollback_bytes: int = DEFAULT_SCROLLBACK_BYTES,
+                 password: str | None = None, event_factory: Callable = threading.Event):
+        # 重新附加用的令牌，只发给创建会话的浏览器
+        self.token = secrets.token_urlsafe(16)
+        self.sid = sid
+        self.detached_at: float | None = None
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.lease = lease
+        self.channel = channel
+        # 输入缓冲与分块写入，sleep_func需与Socket.IO异步模式一致
+        self.writer = InputWriter(channel, sleep_func)
+        # 输出流控：未确认的输出达到上限时暂停读取通道，event_factory需与Socket.IO异步模式一致
+        self.output = OutputWindow(event_factory=event_factory)
+        self.scrollback = ScrollbackBuffer(scrollback_bytes)
+        self.created_at = time.time()
+        self.last_activity = time.monotonic()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.closed = False
+        self.close_reason = None
+        # 非root登录时exec通道上的操作用它执行sudo（交互式终端的sudo -i对其他通道无效）
+        self.password = password
+        # 正在进行的操作：operation_id -> RemoteOperation
+        self.operations = {}
+
+    @property
+    def ssh(self):
+        return self.lease.client
+
+    @property
+    def facts(self):
+        return self.lease.conn.facts
+
+    @property
+    def transfer(self):
+        return self.lease.conn.transfer
+
+    def record_input(self, size: int):
+        self.bytes_in += size
+        self.last_activity = time.monotonic()
+
+    def record_output(self, data: bytes):
+        self.bytes_out += len(data)
+        self.scrollback.append(data)
+        self.last_activity = time.monotonic()
+
+    def touch(self):
+        """有操作输出时刷新活动时间，长时间的部署或下载不会被当作空闲回收"""
+        self.last_activity = time.monotonic()
+
+    @property
+    def attached(self) -> bool:
+        return self.sid is not None
+
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_activity
+
+    def close(self, reason: str | None = None):
+        """关闭shell通道并归还连接（可重复调用）"""
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        self.output.wake()
+        self.writer.clear()
+        self.scrollback.clear()
+        # 操作与终端共用连接，归还连接前中断它们
+        for operation in list(self.operations.values()):
+            operation.cancel()
+        self.password = None
+        try:
+            close_channel(self.channel)
+        except Exception:
+            pass
+        self.lease.release()
+
+    def registry_info(self) -> dict:
+        """登记到会话登记表的信息（其他工作进程据此判断会话归属）"""
+        return {
+            'host': self.host,
+            'port': self.port,
+            'username': self.username,
+            'sid': self.sid,
+            'created_at': self.created_at,
+        }
+
+    def stats(self) -> dict:
+        return {
+            'sid': self.sid,
+            'attached': self.attached,
+            'detached_seconds': round(time.monotonic() - self.detached_at, 1) if self.detached_at else 0,
+            'host': self.host,
+            'port': self.port,
+            'username': self.username,
+            'effective_username': self.lease.username,
+            'age_seconds': round(time.time() - self.created_at, 1),
+            'idle_seconds': round(self.idle_seconds(), 1),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'input_pending': self.writer.pending,
+            'output_unacked': self.output.unacked,
+            'output_pauses': self.output.pauses,
+            'scrollback_bytes': self.scrollback.size,
+            'operations': len(self.operations),
+        }
+
+
+class SessionManager:
+    """登记终端会话：按令牌保存会话，并记录每个Socket.IO sid当前附加的会话"""
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS,
+                 max_per_host: int = DEFAULT_MAX_SESSIONS_PER_HOST,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 detach_timeout: float = DEFAULT_DETACH_TIMEOUT, registry=None):
+        self.max_sessions = max_sessions
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.detach_timeout = detach_timeout
+        # 会话登记表：容量按登记表中所有进程的会话合计
+        self.registry = registry if registry is not None else MemorySessionRegistry()
+        # 令牌 -> 会话（仅本进程持有的会话）
+        self._sessions: dict[str, SSHSession] = {}
+        # sid -> 令牌（仅附加中的会话）
+        self._by_sid: dict[str, str] = {}
+        # 正在建立连接的会话 sid -> host，计入容量，避免并发连接时超出上限
+        self._pending: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.total_opened = 0
+        self.total_closed = 0
+        self.total_reattached = 0
+
+    def get(self, sid: str) -> SSHSession | None:
+        """返回sid当前附加的会话"""
+        token = self._by_sid.get(sid)
+        return self._sessions.get(token) if token is not None else None
+
+    def owner(self, token: str) -> str | None:
+        """返回持有该会话的其他工作进程；会话在本进程、不存在或所在进程已退出时返回None"""
+        if not token or token in self._sessions:
+            return None
+        info = self.registry.get(token)
+        if info is None or info['worker'] == WORKER_ID or not self.registry.is_alive(info['worker']):
+            return None
+        return info['worker']
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self._by_sid
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def reserve(self, sid: str, host: str):
+        """
+        为即将建立的会话占用名额，超出限制时抛出SessionLimitError；
+        同一sid已附加的会话不计入（重新连接时会被替换）
+        """
+        existing = self.get(sid)
+        limit = self.registry.reserve(self._pending_key(sid), host, self.max_sessions, self.max_per_host,
+                                      exclude=existing.token if existing else None)
+        if limit == 'total':
+            raise SessionLimitError(f'会话数已达上限（{self.max_sessions}），请关闭其他终端后重试')
+        if limit == 'host':
+            raise SessionLimitError(f'主机 {host} 的会话数已达上限（{self.max_per_host}）')
+        with self._lock:
+            self._pending[sid] = host
+
+    @staticmethod
+    def _pending_key(sid: str) -> str:
+        return f'pending:{sid}'
+
+    def cancel(self, sid: str):
+        """连接失败时释放占用的名额"""
+        with self._lock:
+            self._pending.pop(sid, None)
+        self.registry.remove(self._pending_key(sid))
+
+    def register(self, session: SSHSession) -> SSHSession | None:
+        """登记已建立的会话并附加到session.sid，返回被替换的旧会话（已关闭）"""
+        with self._lock:
+            self._pending.pop(session.sid, None)
+            old = self._sessions.pop(self._by_sid.get(session.sid), None)
+            self._sessions[session.token] = session
+            self._by_sid[session.sid] = session.token
+            self.total_opened += 1
+        self.registry.add(session.token, session.registry_info(), replaces=self._pending_key(session.sid))
+        if old is not None:
+            self._close(old, '已被新的连接替换')
+        return old
+
+    def attach(self, token: str, sid: str, host: str, port, username: str,
+               password: str) -> tuple[SSHSession | None, str | None]:
+        """
+        把已有会话附加到新的sid（浏览器刷新或网络重连后）
+
+        令牌、主机、端口、用户名和密码都一致时才附加；会话原先附加在其他sid上时从那里移走
+
+        Returns:
+            (会话, 被移走的原sid)，无法附加时会话为None
+        """
+        with self._lock:
+            session = self._sessions.get(token) if token else None
+            if (session is None or session.closed or session.channel.closed
+                    or not hmac.compare_digest(session.token, token)
+                    or (session.host, session.port, session.username) != (host, int(port), username)
+                    or not session.lease.conn.matches_password(password)):
+                return None, None
+            previous_sid = session.sid if session.sid != sid else None
+            if previous_sid is not None:
+                self._by_sid.pop(previous_sid, None)
+            replaced = self._sessions.get(self._by_sid.get(sid))
+            if replaced is session:
+                replaced = None
+            elif replaced is not None:
+                del self._sessions[replaced.token]
+            self._by_sid[sid] = token
+            session.sid = sid
+            session.detached_at = None
+            session.last_activity = time.monotonic()
+            # 新的浏览器从零开始确认输出
+            session.output.reset()
+            self.total_reattached += 1
+        self.registry.update(token, sid=sid)
+        if replaced is not None:
+            self._close(replaced, '已被新的连接替换')
+        return session, previous_sid
+
+    def detach(self, sid: str) -> SSHSession | None:
+        """浏览器断开时分离会话（保留通道，继续写入回滚缓冲区）；不允许保留时直接关闭"""
+        if not self.detach_timeout:
+            return self.close(sid, '客户端已断开')
+        with self._lock:
+            pending = self._pending.pop(sid, None)
+            session = self._sessions.get(self._by_sid.pop(sid, None))
+            if session is not None:
+                session.sid = None
+                session.detached_at = time.monotonic()
+        if pending is not None:
+            self.registry.remove(self._pending_key(sid))
+        if session is not None:
+            # 暂停中的读取任务改为只写入回滚缓冲区
+            session.output.wake()
+            self.registry.update(session.token, sid=None)
+        return session
+
+    def close(self, sid: str, reason: str | None = None) -> SSHSession | None:
+        """移除并关闭sid附加的会话，返回被关闭的会话"""
+        with self._lock:
+            pending = self._pending.pop(sid, None)
+            session = self._sessions.pop(self._by_sid.pop(sid, None), None)
+        if pending is not None:
+            self.registry.remove(self._pending_key(sid))
+        if session is not None:
+            self._close(session, reason)
+        return session
+
+    def discard(self, session: SSHSession, reason: str | None = None) -> bool:
+        """会话仍在登记中时移除并关闭（用于读取任务结束时清理，不会误关同一sid的新会话）"""
+        with self._lock:
+            if self._sessions.get(session.token) is not session:
+                return False
+            del self._sessions[session.token]
+            if session.sid is not None and self._by_sid.get(session.sid) == session.token:
+                del self._by_sid[session.sid]
+        self._close(session, reason)
+        return True
+
+    def _close(self, session: SSHSession, reason: str | None):
+        self.registry.remove(session.token)
+        if not session.closed:
+            session.close(reason)
+            self.total_closed += 1
+
+    def reap_idle(self) -> list[SSHSession]:
+        """关闭空闲超时、分离超时或通道已关闭的会话，返回被关闭的会话（sid为关闭前附加的sid）"""
+        expired = []
+        now = time.monotonic()
+        with self._lock:
+            for token, session in list(self._sessions.items()):
+                if session.channel.closed:
+                    reason = '通道已关闭'
+                elif session.detached_at is not None and now - session.detached_at > self.detach_timeout:
+                    reason = '客户端断开后未重新连接，已关闭'
+                elif self.idle_timeout and session.idle_seconds() > self.idle_timeout:
+                    reason = f'空闲超过 {int(self.idle_timeout)} 秒，已自动断开'
+                else:
+                    continue
+                del self._sessions[token]
+                if session.sid is not None:
+                    self._by_sid.pop(session.sid, None)
+                expired.append((session, reason))
+        for session, reason in expired:
+            self._close(session, reason)
+        return [session for session, _ in expired]
+
+    def close_all(self, reason: str | None = None):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._by_sid.clear()
+            pending = list(self._pending)
+            self._pending.clear()
+        self.registry.remove(*(self._pending_key(sid) for sid in pending))
+        for session in sessions:
+            self._close(session, reason)
+
+    def stats(self) -> dict:
+        """返回会话数量、限制和每个会话的资源占用"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            pending = len(self._pending)
+        per_host = {}
+        for session in sessions:
+            per_host[session.host] = per_host.get(session.host, 0) + 1
+        return {
+            'active': len(sessions),
+            'detached': sum(1 for s in sessions if not s.attached),
+            'pending': pending,
+            'max_sessions': self.max_sessions,
+            'max_per_host': self.max_per_host,
+            'idle_timeout': self.idle_timeout,
+            'detach_timeout': self.detach_timeout,
+            'total_opened': self.total_opened,
+            'total_closed': self.total_closed,
+            'total_reattached': self.total_reattached,
+            'per_host': per_host,
+            'bytes_in': sum(s.bytes_in for s in sessions),
+            'bytes_out': sum(s.bytes_out for s in sessions),
+            'scrollback_bytes': sum(s.scrollback.size for s in sessions),
+            'sessions': [s.stats() for s in sessions],
+        }
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSH通道数据流辅助函数
+基于paramiko通道的fileno()实现就绪驱动的读取，替代固定间隔的轮询
+输出按大小/时间合并成帧，以二进制形式发送给前端，由前端的流式解码器还原文本
+"""
+
+import select
+import sys
+import threading
+import time
+from typing import Callable
+
+# 单次recv读取的最大字节数
+RECV_CHUNK_SIZE = 32768
+# 单次唤醒最多读取的字节数，避免单个会话长时间占用事件循环
+DRAIN_LIMIT = 1024 * 1024
+# 空闲时的兜底检查间隔（秒），只用于发现会话已被移除等情况
+IDLE_CHECK_INTERVAL = 30.0
+# 输出帧的最大字节数
+FRAME_MAX_BYTES = 64 * 1024
+# 连续输出时两帧之间的最小间隔（秒）
+FRAME_MAX_DELAY = 0.01
+# 每个会话已发送但浏览器尚未确认的输出上限（字节），超过后暂停读取通道
+OUTPUT_WINDOW = 256 * 1024
+# 暂停期间的兜底检查间隔（秒）：确认到达、会话关闭或分离时会立即唤醒，只用于发现其他情况
+OUTPUT_ACK_WAIT_TIMEOUT = 1.0
+
+
+def get_select(async_mode: str | None) -> Callable:
+    """
+    根据Socket.IO的异步模式返回合适的select实现
+
+    eventlet模式下必须使用绿色select，否则等待会阻塞整个hub
+    """
+    if async_mode == 'eventlet':
+        from eventlet.green import select as green_select
+        return green_select.select
+    return select.select
+
+
+def get_event_factory(async_mode: str | None) -> Callable:
+    """
+    根据Socket.IO的异步模式返回创建事件（set/clear/wait）的函数
+
+    eventlet模式下使用绿色Event，等待时让出hub而不是阻塞整个进程
+    """
+    if async_mode == 'eventlet':
+        from eventlet.green import threading as green_threading
+        return green_threading.Event
+    return threading.Event
+
+
+def get_semaphore_factory(async_mode: str | None) -> Callable:
+    """
+    根据Socket.IO的异步模式返回创建信号量的函数：factory(value)
+
+    eventlet模式下使用绿色信号量，等待名额时让出hub而不是占用线程池中的线程
+    """
+    if async_mode == 'eventlet':
+        from eventlet.semaphore import Semaphore
+        return Semaphore
+    return threading.Semaphore
+
+
+def get_blocking_call(async_mode: str | None) -> Callable:
+    """
+    根据Socket.IO的异步模式返回执行阻塞调用的函数：blocking_call(func, *args, **kwargs)
+
+    eventlet模式下把建立连接、SFTP上传等阻塞的paramiko调用交给原生线程池，等待期间hub照常调度；
+    其他模式下每个任务本来就在自己的线程中，直接调用。
+    eventlet模式下只有hub调度的协程才经过线程池：其他原生线程（如asyncio模式下挂载Flask路由的WSGI工作线程）
+    没有运行中的hub，经tpool等待结果会报 Cannot switch to a different thread，在这些线程中直接调用
+    """
+    if async_mode == 'eventlet':
+        import greenlet
+        from eventlet import tpool
+
+        def blocking_call(func, *args, **kwargs):
+            # hub调度的协程的父greenlet是hub；原生线程的主greenlet没有父greenlet
+            if greenlet.getcurrent().parent is None:
+                return func(*args, **kwargs)
+            return tpool.execute(func, *args, **kwargs)
+        return blocking_call
+    return lambda func, *args, **kwargs: func(*args, **kwargs)
+
+
+def wait_channel_readable(channel, timeout: float | None = IDLE_CHECK_INTERVAL, select_func: Callable = select.select) -> bool:
+    """
+    等待通道可读（有数据、收到EOF或已关闭）
+
+    paramiko会在缓冲区有数据、EOF或关闭时置位fileno()对应的管道，
+    因此这里只在真正有事件时才被唤醒，空闲时不消耗CPU
+
+    Args:
+        channel: paramiko通道
+        timeout: 最长等待时间（秒），None表示一直等待
+        select_func: select实现，见get_select
+
+    Returns:
+        通道是否可读；超时返回False
+    """
+    if channel.closed or channel.recv_ready():
+        return True
+    try:
+        readable, _, _ = select_func([channel], [], [], timeout)
+    except (OSError, ValueError):
+        # 通道在等待期间被关闭，文件描述符已失效
+        return True
+    return bool(readable)
+
+
+def close_channel(channel):
+    """
+    关闭通道（可在读取任务仍在等待该通道时调用）
+
+    paramiko关闭通道时会关闭fileno()对应的管道；eventlet下若有绿色线程正在select这个管道，
+    hub里会残留它的监听，文件描述符被新通道复用后就会报"Second simultaneous read"。
+    因此先通知hub该描述符已失效，唤醒等待者（其select会收到IOClosed），再关闭通道
+    """
+    pipe = getattr(channel, '_pipe', None)
+    if pipe is not None and 'eventlet' in sys.modules:
+        try:
+            from eventlet import hubs
+            hubs.get_hub().mark_as_reopened(pipe.fileno())
+        except Exception:
+            pass
+    channel.close()
+
+
+def drain_channel(channel, max_bytes: int = DRAIN_LIMIT) -> bytes:
+    """
+    一次性读取通道缓冲区中所有可用的数据
+
+    Args:
+        channel: paramiko通道
+        max_bytes: 本次最多读取的字节数
+
+    Returns:
+        读取到的数据，没有数据时返回空字节串
+    """
+    chunks = []
+    total = 0
+    while total < max_bytes and channel.recv_ready():
+        chunk = channel.recv(min(RECV_CHUNK_SIZE, max_bytes - total))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        total += len(chunk)
+    return b''.join(chunks)
+
+
+def channel_finished(channel) -> bool:
+    """判断通道是否已结束（关闭或收到EOF且缓冲区已读空）"""
+    if channel.closed:
+        return True
+    return channel.eof_received and not channel.recv_ready()
+
+
+def read_output_frame(channel, last_flush: float, select_func: Callable = select.select,
+                      max_bytes: int = FRAME_MAX_BYTES, max_delay: float = FRAME_MAX_DELAY) -> bytes:
+    """
+    读取一帧输出（调用前通道应已可读）
+
+    距离上一帧超过max_delay时立即返回已读到的数据，保证交互回显没有额外延迟；
+    连续大量输出时则继续合并，直到帧达到max_bytes或距上一帧满max_delay，
+    从而限制每个会话每秒发送的包数
+
+    Args:
+        channel: paramiko通道
+        last_flush: 上一帧发送的时间（time.monotonic()）
+        select_func: select实现，见get_select
+        max_bytes: 帧的最大字节数
+        max_delay: 连续输出时两帧之间的最小间隔（秒）
+
+    Returns:
+        帧数据，通道已结束且无数据时返回空字节串
+    """
+    frame = bytearray(drain_channel(channel, max_bytes))
+    if not frame:
+        return b''
+    deadline = last_flush + max_delay
+    while len(frame) < max_bytes:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not wait_channel_readable(channel, remaining, select_func):
+            break
+        more = drain_channel(channel, max_bytes - len(frame))
+        if not more:
+            break
+        frame += more
+    return bytes(frame)
+
+
+class OutputWindow:
+    """
+    基于确认的输出流控
+
+    记录已发送给浏览器的字节数和浏览器确认已渲染的字节数，
+    未确认的数据达到上限时读取任务停止读取通道：paramiko缓冲区写满后不再调整SSH窗口，
+    背压一直传递到远程进程，服务端内存占用与输出总量无关。
+    暂停的读取任务等待room_event，由ack()、reset()和wake()唤醒
+    """
+
+    def __init__(self, window: int = OUTPUT_WINDOW, event_factory: Callable = threading.Event):
+        """
+        Args:
+            event_factory: 创建room_event的函数，需与读取任务的并发模型一致（见get_event_factory；asyncio为asyncio.Event）
+        """
+        self.window = window
+        self.sent = 0
+        self.acked = 0
+        self.pauses = 0
+        self.room_event = event_factory()
+
+    @property
+    def unacked(self) -> int:
+        return self.sent - self.acked
+
+    def is_full(self) -> bool:
+        return self.unacked >= self.window
+
+    def room(self) -> int:
+        """不超出上限还能发送的字节数"""
+        return max(0, self.window - self.unacked)
+
+    def on_sent(self, size: int):
+        self.sent += size
+
+    def ack(self, acked_total: int):
+        """处理浏览器的累计确认（已渲染的总字节数），忽略过期或超出已发送量的确认"""
+        self.acked = max(self.acked, min(int(acked_total), self.sent))
+        if not self.is_full():
+            self.room_event.set()
+
+    def reset(self):
+        """浏览器重新开始计数时（例如重新连接）清零"""
+        self.sent = 0
+        self.acked = 0
+        self.room_event.set()
+
+    def wake(self):
+        """唤醒等待中的读取任务（会话关闭或分离时），由它重新检查状态"""
+        self.room_event.set()
+
+    def wait_for_room(self, is_closed: Callable[[], bool] = lambda: False,
+                      timeout: float = OUTPUT_ACK_WAIT_TIMEOUT) -> bool:
+        """
+        等待未确认数据回落到上限以下（与event_factory相同并发模型的阻塞调用）
+
+        Returns:
+            False表示等待期间会话已关闭
+        """
+        if not self.is_full():
+            return True
+        self.pauses += 1
+        while self.is_full():
+            if is_closed():
+                return False
+            self.room_event.clear()
+            # 清除后再检查一次，避免错过清除前到达的确认
+            if self.is_full() and not is_closed():
+                self.room_event.wait(timeout)
+        return True
+
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""测试直接导入仓库根目录下的模块；模拟非root登录时的远程文件系统"""
+
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from remote_transfer import RemoteTransfer  # noqa: E402
+
+
+class LocalSFTP:
+    """在本地文件系统上模拟SFTP会话；protected下的路径对登录用户只读"""
+
+    def __init__(self, home, protected):
+        self.home = home
+        self.protected = protected
+
+    def _check_write(self, path):
+        if path.startswith(self.protected + '/'):
+            raise PermissionError(13, 'Permission denied')
+
+    def normalize(self, path):
+        return self.home if path == '.' else path
+
+    def open(self, path, mode):
+        if 'w' in mode:
+            self._check_write(path)
+        f = open(path, mode)
+        f.set_pipelined = lambda pipelined: None
+        f.prefetch = lambda: None
+        return f
+
+    def chmod(self, path, mode):
+        os.chmod(path, mode)
+
+    def posix_rename(self, src, dst):
+        self._check_write(dst)
+        os.replace(src, dst)
+
+    rename = posix_rename
+
+    def remove(self, path):
+        self._check_write(path)
+        os.remove(path)
+
+    def stat(self, path):
+        return os.stat(path)
+
+
+class LocalClient:
+    """exec_command在本地执行（用于远程sha256sum）"""
+
+    def exec_command(self, command, timeout=None):
+        output = subprocess.run(['sh', '-c', command], capture_output=True).stdout
+        return None, io.BytesIO(output), io.BytesIO()
+
+
+def run_as_root(commands):
+    def privileged(command):
+        commands.append(command)
+        result = subprocess.run(['sh', '-c', command], capture_output=True, text=True)
+        return result.returncode, result.stdout, result.stderr
+    return privileged
+
+
+@pytest.fixture
+def transfer(tmp_path):
+    home = tmp_path / 'home'
+    protected = tmp_path / 'docker'
+    home.mkdir()
+    protected.mkdir()
+    commands = []
+    transfer = RemoteTransfer(LocalClient(), privileged=run_as_root(commands))
+    transfer._sftp = LocalSFTP(str(home), str(protected))
+    transfer.sftp = lambda: transfer._sftp
+    transfer.commands = commands
+    return transfer, protected, home
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""asyncio模式（uvicorn + app_async）下的Flask路由：并发请求在WSGI工作线程中执行，不经过eventlet的线程池"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+pytest.importorskip('uvicorn')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = os.path.join(ROOT, 'scripts')
+
+# 模拟的分享服务：每个分享3个文件，下载接口延迟0.2秒
+STUB_SERVER = f"""
+import http.server, sys
+sys.path.insert(0, {SCRIPTS!r})
+from bench_share_parse import StubShareHandler
+StubShareHandler.file_count, StubShareHandler.delay = 3, 0.2
+server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubShareHandler)
+print(server.server_address[1], flush=True)
+server.serve_forever()
+"""
+CONCURRENCY = 4
+
+
+@pytest.fixture(scope='module')
+def share_base():
+    server = subprocess.Popen([sys.executable, '-c', STUB_SERVER], stdout=subprocess.PIPE, text=True)
+    try:
+        yield f'http://127.0.0.1:{server.stdout.readline().strip()}'
+    finally:
+        server.kill()
+        server.wait()
+
+
+@pytest.fixture(scope='module')
+def server_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, NASPT_SHARE_CACHE_FILE='')
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app_async:asgi_app', '--host', '127.0.0.1',
+                               '--port', str(port), '--log-level', 'warning'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                requests.get(f'{url}/api/sessions', timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    pytest.fail('asyncio模式的服务未能启动')
+                time.sleep(0.1)
+        yield url
+    finally:
+        # 卡住的工作线程会让uvicorn无法正常退出
+        server.kill()
+        server.wait()
+
+
+def run_concurrently(func, count=CONCURRENCY):
+    """在count个线程中同时执行func(i)，返回各自的结果或异常"""
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = func(i)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def share_url(share_base, i):
+    # 各请求使用不同的分享，不会合并为同一次解析
+    return f'{share_base}/s/{i:02x}{"0" * 14}'
+
+
+def test_concurrent_parse_requests(server_url, share_base):
+    def parse(i):
+        response = requests.post(f'{server_url}/api/parse-share-link', json={'url': share_url(share_base, i)},
+                                 timeout=10)
+        return response.status_code, len(response.json()['data']['file_download_map'])
+
+    start = time.monotonic()
+    results = run_concurrently(parse)
+    assert results == [(200, 3)] * CONCURRENCY
+    # 各请求并行解析，总耗时接近一次解析
+    assert time.monotonic() - start < 5
+
+
+def test_concurrent_streams(server_url, share_base):
+    def stream(i):
+        response = requests.get(f'{server_url}/api/parse-share-link/stream',
+                                params={'url': share_url(share_base, i), 'refresh': 1}, timeout=10)
+        events = [json.loads(line) for line in response.text.splitlines()]
+        return response.status_code, [event['type'] for event in events].count('link'), events[-1]['type']
+
+    start = time.monotonic()
+    results = run_concurrently(stream)
+    assert results == [(200, 3, 'done')] * CONCURRENCY
+    assert time.monotonic() - start < 5
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""download_jobs.DownloadJob：下载工具写到stderr的普通输出不作为下载项的状态信息，失败时才显示"""
+
+from download_jobs import DownloadItem, DownloadJob
+from ssh_exec import ExecResult
+
+REMOTE_PATHS = {'docker': '/vol1/docker', 'base': '/vol1/docker/naspt', 'downloads': '/vol1/docker/naspt/downloads',
+                'tmp': '/vol1/docker/naspt/tmp', 'compose': '/vol1/docker/naspt/compose'}
+
+
+def make_job(item, runs):
+    """runs: 每次执行依次产生的 (输出, 退出码)"""
+    runs = list(runs)
+
+    def execute(command, on_output, is_cancelled):
+        output, status = runs.pop(0)
+        for stream, line in output:
+            on_output(stream, [line])
+        return ExecResult(status, 0.1)
+
+    return DownloadJob([item], REMOTE_PATHS, {'wget': True}, execute, start_task=lambda func: None,
+                       on_update=lambda job, item: None, on_done=lambda job: None, retries=1,
+                       sleep_func=lambda seconds: None)
+
+
+def test_stderr_output_of_successful_download_is_not_the_message():
+    item = DownloadItem('1', 'http://example.com/a.tgz', 'a.tgz')
+    output = [('stdout', '@@total 10'),
+              ('stderr', '2026-10-18 10:00:00 URL:http://example.com/a.tgz [10/10] -> "a.tgz" [1]'),
+              ('stdout', '@@downloaded 10')]
+    job = make_job(item, [(output, 0)])
+
+    assert job.download(item) == 0
+    assert item.message == ''
+    assert item.last_output.startswith('2026-10-18')
+
+
+def test_failed_download_reports_last_output():
+    item = DownloadItem('1', 'http://example.com/a.tgz', 'a.tgz')
+    failure = [('stderr', 'Resolving example.com... 93.184.216.34'),
+               ('stderr', 'http://example.com/a.tgz: 2026-10-18 ERROR 404: Not Found.')]
+    job = make_job(item, [(failure, 8)])
+
+    assert job.download(item) == 8
+    assert item.http_status == 404
+    assert item.message == 'http://example.com/a.tgz: 2026-10-18 ERROR 404: Not Found.'
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""非root登录的批量下载：downloads目录和下载缓存的manifest属于root时经sudo创建和写入"""
+
+import io
+import os
+import subprocess
+
+from conftest import run_as_root
+from download_cache import DownloadCache
+from host_facts import HostFacts
+
+
+class _Channel:
+    def __init__(self, status):
+        self.status = status
+
+    def recv_exit_status(self):
+        return self.status
+
+
+class _Output(io.BytesIO):
+    def __init__(self, data, status):
+        super().__init__(data)
+        self.channel = _Channel(status)
+
+
+class UserClient:
+    """以登录用户执行：protected下不能创建目录"""
+
+    def __init__(self, protected):
+        self.protected = protected
+        self.commands = []
+
+    def exec_command(self, command, timeout=None):
+        self.commands.append(command)
+        if self.protected in command:
+            return None, _Output(b'', 1), _Output(b'mkdir: Permission denied', 1)
+        status = subprocess.run(['sh', '-c', command]).returncode
+        return None, _Output(b'', status), _Output(b'', status)
+
+
+def test_ensure_dirs_uses_sudo_when_login_user_cannot_create(tmp_path):
+    protected = str(tmp_path / 'docker')
+    downloads = f'{protected}/naspt/downloads'
+    commands = []
+    facts = HostFacts(privileged=run_as_root(commands))
+    client = UserClient(protected)
+
+    facts.ensure_dirs(client, f'{protected}/naspt', downloads)
+    assert os.path.isdir(downloads)
+    assert len(client.commands) == 1 and commands == client.commands
+    # 已确认存在的目录不再发起远程调用
+    facts.ensure_dirs(client, downloads)
+    assert len(client.commands) == 1
+
+
+def test_download_cache_manifest_round_trip_through_sudo(transfer):
+    transfer, protected, _ = transfer
+    downloads = str(protected)
+    archive = os.path.join(downloads, 'bundle.tgz')
+    with open(archive, 'wb') as f:
+        f.write(b'x' * 10)
+
+    cache = DownloadCache(transfer, downloads, limit=0)
+    cache.load()
+    cache.record('https://example.com/bundle.tgz', archive, 10, etag='"v1"')
+    cache.flush()
+    assert os.path.exists(os.path.join(downloads, '.naspt-cache.json'))
+    assert any(command.startswith('install ') for command in transfer.commands)
+
+    # 登录用户也读不到manifest时经sudo读取
+    transfer._sftp.open = lambda path, mode: (_ for _ in ()).throw(PermissionError(13, 'Permission denied'))
+    reloaded = DownloadCache(transfer, downloads, limit=0)
+    reloaded.load()
+    assert reloaded.lookup('https://example.com/bundle.tgz')['etag'] == '"v1"'
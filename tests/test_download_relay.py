@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""download_relay.RelayCache：获取在后台进行，各主机边获取边上传，同一文件只从下载源获取一次；
+缓存按ETag确认，超过上限时按最近使用淘汰；多主机下载同时进行的上传数受限"""
+
+import hashlib
+import http.server
+import os
+import threading
+import time
+import types
+
+import pytest
+
+from download_jobs import DownloadItem
+from download_relay import RelayCache, RelayRestarted, _PendingFetch, _StreamReader
+from ssh_fanout import FanoutTarget
+
+BODY = os.urandom(600000)
+
+
+class SlowHandler(http.server.BaseHTTPRequestHandler):
+    """分6次发送BODY，每次间隔0.25秒，不支持Range"""
+
+    gets = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._headers()
+
+    def do_GET(self):
+        type(self).gets += 1
+        self._headers()
+        step = len(BODY) // 6
+        for start in range(0, len(BODY), step):
+            self.wfile.write(BODY[start:start + step])
+            self.wfile.flush()
+            time.sleep(0.25)
+
+    def _headers(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+
+
+@pytest.fixture
+def source():
+    SlowHandler.gets = 0
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/svc.tgz'
+    server.shutdown()
+
+
+def test_upload_streams_while_fetching(source, transfer, tmp_path):
+    transfer, protected, _ = transfer
+    relay = RelayCache(str(tmp_path / 'relay'))
+    item = DownloadItem('1', source, 'svc.tgz')
+
+    first = relay.fetch(item)
+    second = relay.fetch(item)
+    assert not first.complete and second.pending is first.pending
+
+    results = {}
+
+    def upload(relay_file, name):
+        results[name] = relay.upload(relay_file, transfer, str(protected / name))
+
+    threads = [threading.Thread(target=upload, args=(f, n)) for f, n in ((first, 'a.tgz'), (second, 'b.tgz'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert results == {'a.tgz': True, 'b.tgz': True}
+    assert SlowHandler.gets == 1
+    for name in ('a.tgz', 'b.tgz'):
+        with open(protected / name, 'rb') as f:
+            assert f.read() == BODY
+    assert first.sha256 == hashlib.sha256(BODY).hexdigest()
+    relay.release(first)
+    relay.release(second)
+
+    # 缓存命中后按完整文件上传，主机上已有相同内容时跳过
+    cached = relay.fetch(item)
+    assert cached.complete and not cached.fetched
+    assert relay.upload(cached, transfer, str(protected / 'a.tgz')) is False
+    assert SlowHandler.gets == 1
+
+
+def test_stream_reader_rejects_restarted_fetch(tmp_path):
+    pending = _PendingFetch(str(tmp_path / 'data'))
+    with open(pending.part_path, 'wb') as f:
+        f.write(b'x' * 100)
+    pending.progress(100, None)
+    reader = _StreamReader(pending)
+    assert reader.read(64) == b'x' * 64
+
+    # 下载源拒绝续传，.part 从头写入：已读取的内容作废
+    pending.progress(10, None)
+    with pytest.raises(RelayRestarted):
+        reader.read(64)
+    reader.close()
+
+
+class SourceHandler(http.server.BaseHTTPRequestHandler):
+    """files: 路径 -> 内容；etag可修改，模拟下载源上的文件更新"""
+
+    files = {}
+    etag = '"v1"'
+    gets = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._headers()
+
+    def do_GET(self):
+        type(self).gets += 1
+        self._headers()
+        self.wfile.write(self.files[self.path])
+
+    def _headers(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.files[self.path])))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+
+
+@pytest.fixture
+def origin():
+    SourceHandler.files = {'/a.tgz': os.urandom(300 * 1024), '/b.tgz': os.urandom(300 * 1024)}
+    SourceHandler.etag = '"v1"'
+    SourceHandler.gets = 0
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SourceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_concurrent_fetches_download_once(origin, tmp_path):
+    relay = RelayCache(str(tmp_path / 'relay'))
+    item = DownloadItem('1', f'{origin}/a.tgz', 'a.tgz')
+    results = []
+
+    def fetch():
+        results.append(relay.fetch(item))
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    # 都共用同一次后台获取
+    assert len({f.pending for f in results}) == 1
+    for relay_file in results:
+        relay_file.wait()
+        assert read(relay_file.path) == SourceHandler.files['/a.tgz']
+        relay.release(relay_file)
+    assert SourceHandler.gets == 1
+
+
+def test_cached_file_revalidated_by_etag(origin, tmp_path):
+    item = DownloadItem('1', f'{origin}/a.tgz', 'a.tgz')
+    relay = RelayCache(str(tmp_path / 'relay'))
+    fetched = relay.fetch(item)
+    fetched.wait()
+    relay.release(fetched)
+
+    # 新的缓存实例（如服务重启）用HEAD确认下载源未变化
+    relay = RelayCache(str(tmp_path / 'relay'))
+    cached = relay.fetch(item)
+    relay.release(cached)
+    assert not cached.fetched and SourceHandler.gets == 1
+
+    SourceHandler.etag = '"v2"'
+    relay = RelayCache(str(tmp_path / 'relay'))
+    refetched = relay.fetch(item)
+    refetched.wait()
+    relay.release(refetched)
+    assert refetched.fetched and SourceHandler.gets == 2
+
+
+def test_evicts_least_recently_used_but_not_in_use(origin, tmp_path):
+    # 上限只能放下一个文件
+    relay = RelayCache(str(tmp_path / 'relay'), limit=400 * 1024)
+    a = relay.fetch(DownloadItem('1', f'{origin}/a.tgz', 'a.tgz'))
+    b = relay.fetch(DownloadItem('2', f'{origin}/b.tgz', 'b.tgz'))
+    a.wait()
+    b.wait()
+    # a仍在使用，不被淘汰
+    assert os.path.exists(a.path) and os.path.exists(b.path)
+
+    relay.release(a)
+    relay.release(b)
+    c = relay.fetch(DownloadItem('3', f'{origin}/a.tgz#copy', 'a.tgz', cache_key='copy'))
+    c.wait()
+    relay.release(c)
+    # 淘汰在获取完成后进行
+    deadline = time.monotonic() + 5
+    while (os.path.exists(a.path) or os.path.exists(b.path)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not os.path.exists(a.path) and not os.path.exists(b.path)
+    assert os.path.exists(c.path)
+
+
+class CountingRelay:
+    """记录同时进行的上传数，每次上传占用0.3秒"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def fetch(self, item):
+        return types.SimpleNamespace(complete=True, size=1)
+
+    def upload(self, relay_file, transfer, remote_path):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.3)
+        with self.lock:
+            self.active -= 1
+        return True
+
+    def release(self, relay_file):
+        pass
+
+
+def test_fanout_uploads_are_capped(monkeypatch):
+    import eventlet
+
+    import app
+    from ssh_stream import get_semaphore_factory
+
+    relay = CountingRelay()
+    batch = types.SimpleNamespace(items=lambda: [DownloadItem('1', 'http://example.com/a.tgz', 'a.tgz')], relay=relay)
+    job = types.SimpleNamespace(id='job', owner='owner', cancelled=False, operation={'batch': batch},
+                                update=lambda target, state: None)
+    facts = types.SimpleNamespace(get=lambda client, base: {'tools': {}}, ensure_dirs=lambda *args: None)
+    lease = types.SimpleNamespace(client=None, conn=types.SimpleNamespace(facts=facts, transfer=None))
+    lines = []
+    monkeypatch.setattr(app, 'relay_upload_slots', get_semaphore_factory('eventlet')(2))
+    monkeypatch.setattr(app, 'build_extract_command', lambda *args: 'true')
+    monkeypatch.setattr(app, 'run_command',
+                        lambda *args, **kwargs: types.SimpleNamespace(cancelled=False, success=True))
+    monkeypatch.setattr(app.socketio, 'emit', lambda event, data, room: lines.extend(data['lines']))
+
+    def unrelated_call():
+        # 上传进行中，其他阻塞调用不需要等待线程池
+        eventlet.sleep(0.1)
+        start = time.monotonic()
+        app.blocking_call(time.sleep, 0)
+        return time.monotonic() - start
+
+    targets = [FanoutTarget(str(i), f'10.0.0.{i}', 22, 'root', '') for i in range(8)]
+    workers = [eventlet.spawn(app.run_fanout_download, job, target, lease) for target in targets]
+    probe = eventlet.spawn(unrelated_call)
+    results = [worker.wait() for worker in workers]
+
+    assert results == [0] * 8
+    assert relay.peak == 2
+    assert probe.wait() < 0.2
+    assert 'a.tgz: 等待其他主机的上传完成...' in lines
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""ssh_stream.OutputWindow：流控暂停时等待确认事件，确认到达或会话关闭后立即继续"""
+
+import threading
+import time
+
+import eventlet
+
+from ssh_stream import OutputWindow, get_event_factory
+
+
+def test_ack_wakes_waiting_reader():
+    window = OutputWindow(window=100)
+    window.on_sent(150)
+    result = {}
+
+    def reader():
+        start = time.monotonic()
+        result['room'] = window.wait_for_room(timeout=5)
+        result['elapsed'] = time.monotonic() - start
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    time.sleep(0.1)
+    # 确认后仍超出上限时继续等待
+    window.ack(20)
+    time.sleep(0.1)
+    assert thread.is_alive()
+    window.ack(100)
+    thread.join(1)
+
+    assert result['room'] is True
+    assert result['elapsed'] < 1
+    assert window.pauses == 1
+
+
+def test_wake_on_close_returns_false():
+    window = OutputWindow(window=100)
+    window.on_sent(100)
+    closed = threading.Event()
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(room=window.wait_for_room(closed.is_set, timeout=5)))
+    thread.start()
+    time.sleep(0.1)
+    closed.set()
+    window.wake()
+    thread.join(1)
+
+    assert result['room'] is False
+
+
+def test_green_event_yields_to_hub():
+    window = OutputWindow(window=100, event_factory=get_event_factory('eventlet'))
+    window.on_sent(100)
+    order = []
+
+    def reader():
+        order.append('wait')
+        window.wait_for_room(timeout=5)
+        order.append('room')
+
+    def acker():
+        order.append('ack')
+        window.ack(100)
+
+    waiter = eventlet.spawn(reader)
+    eventlet.spawn(acker)
+    waiter.wait()
+
+    assert order == ['wait', 'ack', 'room']
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""remote_transfer.RemoteTransfer：经测试SSH服务器的SFTP写入文件，内容未变化时跳过；
+非root登录、目标目录属于root时经sudo写入、读取和删除"""
+
+import hashlib
+import os
+import sys
+
+import paramiko
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from bench_sshd import TEST_PASSWORD, LocalSSHServer  # noqa: E402
+from remote_transfer import RemoteTransfer  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = LocalSSHServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def connect(server):
+    clients = []
+
+    def connect():
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(server.host, server.port, username='naspt', password=TEST_PASSWORD, timeout=10)
+        clients.append(client)
+        return RemoteTransfer(client)
+
+    yield connect
+    for client in clients:
+        client.close()
+
+
+def test_upload_then_skip_unchanged(connect, tmp_path):
+    transfer = connect()
+    target = str(tmp_path / 'docker-compose.yml')
+
+    assert transfer.put_text(target, 'services: {}\n', mode=0o600) is True
+    with open(target) as f:
+        assert f.read() == 'services: {}\n'
+    assert oct(os.stat(target).st_mode & 0o777) == '0o600'
+    # 临时文件已重命名为目标文件
+    assert os.listdir(tmp_path) == ['docker-compose.yml']
+
+    # 本连接上传过的内容按大小和修改时间确认，不需要在远程计算sha256
+    transfer.remote_sha256 = lambda path: pytest.fail('不应计算远程sha256')
+    assert transfer.put_text(target, 'services: {}\n') is False
+
+    # 新连接没有上传记录：远程sha256一致时同样跳过
+    assert connect().put_text(target, 'services: {}\n') is False
+
+
+def test_same_size_different_content_is_uploaded(connect, tmp_path):
+    transfer = connect()
+    target = str(tmp_path / 'run.sh')
+    with open(target, 'w') as f:
+        f.write('echo a\n')
+
+    assert transfer.put_text(target, 'echo b\n', mode=0o755) is True
+    with open(target) as f:
+        assert f.read() == 'echo b\n'
+    assert os.stat(target).st_mode & 0o777 == 0o755
+    assert transfer.put_text(target, 'echo b\n', mode=0o755) is False
+    transfer.close()
+
+
+
+def test_put_text_falls_back_to_sudo_install(transfer):
+    transfer, protected, home = transfer
+    target = str(protected / 'docker-compose.yml')
+
+    assert transfer.put_text(target, 'services: {}\n', mode=0o600) is True
+    with open(target) as f:
+        assert f.read() == 'services: {}\n'
+    assert oct(os.stat(target).st_mode & 0o777) == '0o600'
+    assert any(command.startswith('install -m 600 ') for command in transfer.commands)
+    # 暂存文件和目标目录中的临时文件都已清理
+    assert os.listdir(home) == []
+    assert os.listdir(protected) == ['docker-compose.yml']
+
+    # 内容未变化时跳过，不再经sudo
+    transfer.commands.clear()
+    assert transfer.put_text(target, 'services: {}\n') is False
+    assert transfer.commands == []
+
+
+def test_put_file_get_text_and_remove_through_sudo(transfer, tmp_path):
+    transfer, protected, _ = transfer
+    local = tmp_path / 'bundle.tgz'
+    local.write_bytes(os.urandom(600 * 1024))
+    target = str(protected / 'bundle.tgz')
+    progress = []
+
+    assert transfer.put_file(str(local), target, callback=lambda sent, total: progress.append(sent)) is True
+    with open(target, 'rb') as f:
+        assert hashlib.sha256(f.read()).digest() == hashlib.sha256(local.read_bytes()).digest()
+    assert progress[-1] == local.stat().st_size
+
+    assert transfer.put_text(str(protected / 'notes.txt'), '你好') is True
+    transfer._sftp.open = lambda path, mode: (_ for _ in ()).throw(PermissionError(13, 'Permission denied'))
+    assert transfer.get_text(str(protected / 'notes.txt')) == '你好'
+    assert transfer.remove(target) is True
+    assert not os.path.exists(target)
+
+
+def test_permission_error_without_privileged_runner(transfer):
+    transfer, protected, _ = transfer
+    transfer.privileged = None
+    with pytest.raises(PermissionError):
+        transfer.put_text(str(protected / 'env'), 'A=1\n')
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""share_cache.ShareCache：同一分享并发请求只解析一次，结果按有效期和下载链接的过期时间缓存"""
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from share_cache import ShareCache
+
+SHARE_URL = 'https://share.example.com/s/abc123'
+
+
+class FakeParser:
+    """代替FeiNiuShareParser：记录解析次数，parse_all耗时delay秒"""
+
+    calls = 0
+    delay = 0.0
+    result = {}
+    error = None
+
+    def __init__(self, share_url):
+        self.share_url = share_url
+
+    def parse_all(self):
+        type(self).calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return dict(self.result, share_url=self.share_url)
+
+
+@pytest.fixture
+def parser():
+    FakeParser.calls = 0
+    FakeParser.delay = 0.0
+    FakeParser.error = None
+    FakeParser.result = {'share_id': 'abc123', 'auth': 'token', 'files': [{'file': 'a.tgz'}],
+                         'download_links': ['https://share.example.com/s/download/abc123?fid=1']}
+    return FakeParser
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_concurrent_requests_share_one_parse(parser):
+    parser.delay = 0.2
+    cache = ShareCache(ttl=600, path='', parser_factory=parser)
+    results = []
+
+    def get():
+        results.append(cache.get(SHARE_URL))
+
+    threads = [threading.Thread(target=get) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert parser.calls == 1
+    assert sorted(cached for _, cached in results) == [False, True, True, True, True]
+    assert all(result['auth'] == 'token' for result, _ in results)
+    assert cache.stats()['joined'] == 4
+
+    # 返回的是副本
+    results[0][0]['files'].clear()
+    assert cache.get(SHARE_URL) == (results[1][0], True)
+    assert parser.calls == 1
+
+
+def test_request_arriving_as_parse_finishes_uses_cache(parser, monkeypatch):
+    import share_cache
+
+    cache = ShareCache(ttl=600, path='', parser_factory=parser)
+    late = []
+
+    class HookedEvent(threading.Event):
+        def set(self):
+            # 解析结束、唤醒等待者的时刻又到达一个请求（只模拟一次）
+            if not late:
+                thread = threading.Thread(target=lambda: late.append(cache.get(SHARE_URL)))
+                late.append(thread)
+                thread.start()
+                thread.join(0.2)
+            super().set()
+
+    class HookedFlight(share_cache._Flight):
+        def __init__(self):
+            super().__init__()
+            self.done = HookedEvent()
+
+    monkeypatch.setattr(share_cache, '_Flight', HookedFlight)
+    result, cached = cache.get(SHARE_URL)
+    late[0].join(5)
+
+    assert parser.calls == 1
+    assert late[1] == (result, True)
+
+
+def test_ttl_and_link_expiry(parser):
+    clock = Clock()
+    cache = ShareCache(ttl=600, path='', parser_factory=parser, clock=clock)
+    cache.get(SHARE_URL)
+    clock.now += 599
+    assert cache.get(SHARE_URL)[1] is True
+    clock.now += 2
+    assert cache.get(SHARE_URL)[1] is False
+    assert parser.calls == 2
+
+    # 下载链接在2分钟后过期：提前EXPIRY_MARGIN秒失效
+    parser.result['download_links'] = [f'https://share.example.com/s/download/abc123?expires={int(clock.now) + 120}']
+    cache.get(SHARE_URL, refresh=True)
+    clock.now += 59
+    assert cache.get(SHARE_URL)[1] is True
+    clock.now += 2
+    assert cache.get(SHARE_URL)[1] is False
+
+
+def test_incomplete_results_and_errors_are_not_cached(parser):
+    cache = ShareCache(ttl=600, path='', parser_factory=parser)
+    parser.result['auth'] = None
+    assert cache.get(SHARE_URL)[1] is False
+    assert cache.get(SHARE_URL)[1] is False
+
+    parser.error = RuntimeError('分享已失效')
+    with pytest.raises(RuntimeError):
+        cache.get(SHARE_URL)
+    assert parser.calls == 3
+    assert cache.stats()['entries'] == 0
+
+
+def test_persisted_entries_are_shared_and_invalidated(parser, tmp_path):
+    path = str(tmp_path / 'share_cache.json')
+    ShareCache(ttl=600, path=path, parser_factory=parser).get(SHARE_URL)
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+    # 另一个进程（如命令行）读取同一个文件
+    other = ShareCache(ttl=600, path=path, parser_factory=parser)
+    assert other.get(SHARE_URL)[1] is True
+    assert parser.calls == 1
+
+    other.invalidate('abc123')
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {}
+    assert ShareCache(ttl=600, path=path, parser_factory=parser).get(SHARE_URL)[1] is False
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""/api/parse-share-link/stream 与 ShareCache.stream：边解析边推送，结果与缓存、并发合并共用；
+事件内容放在data中，不与事件名冲突"""
+
+import json
+
+import pytest
+
+from share_cache import ShareCache
+
+SHARE_URL = 'https://share.example.com/s/abc123'
+FILES = [{'file': 'a.tgz', 'path': '/a.tgz'}, {'file': 'b.tgz', 'path': '/b.tgz'}]
+LINKS = {'a.tgz': 'https://share.example.com/s/download/abc123?fid=1',
+         'b.tgz': 'https://share.example.com/s/download/abc123?fid=2'}
+
+
+class StreamParser:
+    """代替FeiNiuShareParser：按iter_parse的顺序产出事件，链接按完成的先后（b先于a）"""
+
+    calls = 0
+
+    def __init__(self, share_url):
+        self.share_url = share_url
+
+    def parse_all(self):
+        for event, payload in self.iter_parse():
+            if event == 'done':
+                return payload
+
+    def iter_parse(self):
+        type(self).calls += 1
+        yield 'share', {'share_id': 'abc123', 'share_url': self.share_url, 'auth': 'token'}
+        for item in FILES:
+            yield 'file', item
+        for name in ('b.tgz', 'a.tgz'):
+            yield 'link', {'file': name, 'url': LINKS[name]}
+        yield 'done', {'share_id': 'abc123', 'share_url': self.share_url, 'auth': 'token', 'files': FILES,
+                       'download_links': list(LINKS.values()), 'file_download_map': dict(LINKS)}
+
+
+@pytest.fixture
+def cache():
+    StreamParser.calls = 0
+    return ShareCache(ttl=600, path='', parser_factory=StreamParser)
+
+
+def test_stream_then_replay_from_cache(cache):
+    events = list(cache.stream(SHARE_URL))
+    assert [event for event, _ in events] == ['share', 'file', 'file', 'link', 'link', 'done']
+    assert events[3][1]['file'] == 'b.tgz'
+    assert events[-1][1]['cached'] is False
+
+    # 缓存命中：一次产出相同的事件，链接按文件列表的顺序
+    replayed = list(cache.stream(SHARE_URL))
+    assert [event for event, _ in replayed] == ['share', 'file', 'file', 'link', 'link', 'done']
+    assert [payload['file'] for event, payload in replayed if event == 'link'] == ['a.tgz', 'b.tgz']
+    assert replayed[-1][1]['cached'] is True
+    assert cache.get(SHARE_URL)[1] is True
+    assert StreamParser.calls == 1
+
+
+def test_closed_stream_is_not_cached(cache):
+    events = cache.stream(SHARE_URL)
+    assert next(events)[0] == 'share'
+    # 客户端断开
+    events.close()
+    assert cache.stats()['in_flight'] == 0
+    assert cache.get(SHARE_URL)[1] is False
+
+
+def test_endpoint_ndjson_and_sse(cache, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'share_cache', cache)
+    client = app.app.test_client()
+
+    response = client.get(f'/api/parse-share-link/stream?url={SHARE_URL}')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['type'] for line in lines] == ['share', 'file', 'file', 'link', 'link', 'done']
+    assert lines[1]['data'] == FILES[0]
+    assert lines[-1]['data']['data']['file_download_map'] == LINKS
+
+    response = client.post('/api/parse-share-link/stream', json={'url': SHARE_URL, 'format': 'sse'})
+    assert response.mimetype == 'text/event-stream'
+    messages = response.get_data(as_text=True).split('\n\n')
+    assert messages[0].startswith('event: share\ndata: ')
+    assert messages[-2].startswith('event: done\ndata: {"cached": true')
+
+    assert client.post('/api/parse-share-link/stream', json={'url': 'share.example.com'}).status_code == 400
+
+
+def test_ndjson_keeps_payload_fields():
+    from app import format_stream_event
+
+    entry = {'file': 'a.tgz', 'path': '/a.tgz', 'type': 'regular', 'isDir': False}
+    line = format_stream_event('file', entry, sse=False)
+    assert line.endswith('\n')
+    assert json.loads(line) == {'type': 'file', 'data': entry}
+
+
+def test_sse_sends_payload_as_data():
+    from app import format_stream_event
+
+    message = format_stream_event('error', {'message': '解析失败'}, sse=True)
+    assert message == 'event: error\ndata: {"message": "解析失败"}\n\n'
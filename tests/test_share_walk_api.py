@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""/api/parse-share-link 与命令行的 recursive / max_depth / pattern：子目录中的文件出现在结果中"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+sys.path.insert(0, SCRIPTS)
+
+from bench_share_parse import SHARE_ID  # noqa: E402
+
+# 两层子目录，每个目录2个子目录和2个文件。
+# 模拟服务在子进程中运行：Flask-SocketIO的eventlet模式导入后，同一进程中的http.server处理线程偶尔会卡住
+STUB_SERVER = f"""
+import http.server, sys
+sys.path.insert(0, {SCRIPTS!r})
+from bench_share_walk import StubTreeHandler
+StubTreeHandler.branches, StubTreeHandler.depth, StubTreeHandler.delay = 2, 2, 0
+server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubTreeHandler)
+print(server.server_address[1], flush=True)
+server.serve_forever()
+"""
+
+
+@pytest.fixture
+def share_url():
+    server = subprocess.Popen([sys.executable, '-c', STUB_SERVER], stdout=subprocess.PIPE, text=True)
+    try:
+        yield f'http://127.0.0.1:{server.stdout.readline().strip()}/s/{SHARE_ID}'
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@pytest.fixture
+def client():
+    import app
+    return app.app.test_client()
+
+
+def parse(client, **body):
+    response = client.post('/api/parse-share-link', json=body)
+    return response.status_code, response.get_json()
+
+
+def test_recursive_parse_lists_nested_files(client, share_url):
+    status, flat = parse(client, url=share_url)
+    assert status == 200
+    assert sorted(flat['data']['file_download_map']) == ['pkg0.tgz', 'pkg1.tgz']
+
+    status, nested = parse(client, url=share_url, recursive=True)
+    assert status == 200 and nested['cached'] is False
+    names = nested['data']['file_download_map']
+    assert 'd0/d1/pkg0.tgz' in names and 'd1/pkg1.tgz' in names
+    # 1 + 2 + 4 个目录，每个目录2个文件
+    assert len(names) == 14
+
+    status, shallow = parse(client, url=share_url, recursive=True, max_depth=1, pattern='pkg0.tgz')
+    assert status == 200
+    assert sorted(shallow['data']['file_download_map']) == ['d0/pkg0.tgz', 'd1/pkg0.tgz', 'pkg0.tgz']
+
+    # 各组参数的结果分开缓存
+    assert parse(client, url=share_url, recursive=True)[1]['cached'] is True
+    assert parse(client, url=share_url, max_depth='x', recursive=True)[0] == 400
+
+
+def test_stream_accepts_walk_arguments(client, share_url):
+    query = f'url={share_url}&recursive=1&max_depth=1&pattern=d0/*&refresh=1'
+    response = client.get(f'/api/parse-share-link/stream?{query}')
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert events[-1]['type'] == 'done'
+    assert sorted(events[-1]['data']['data']['file_download_map']) == ['d0/pkg0.tgz', 'd0/pkg1.tgz']
+
+
+def test_cli_recursive_flag(share_url, tmp_path, monkeypatch):
+    import parse_share_link
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['parse_share_link.py', share_url, '--recursive', '--max-depth', '1', '--refresh'])
+    parse_share_link.main()
+    with open(tmp_path / f'share_result_{SHARE_ID}.json', encoding='utf-8') as f:
+        result = json.load(f)
+    assert sorted(result['file_download_map']) == ['d0/pkg0.tgz', 'd0/pkg1.tgz', 'd1/pkg0.tgz', 'd1/pkg1.tgz',
+                                                   'pkg0.tgz', 'pkg1.tgz']
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""ssh_escalation.SudoEscalation：看到密码提示立即发送密码，看到root提示符后用id -u确认；root与原用户并发登录"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import bench_sshd  # noqa: E402
+from ssh_escalation import PROBE_COMMAND, SUDO_COMMAND, SUDO_PROMPT, SudoEscalation  # noqa: E402
+from ssh_pool import SSHTransportPool, connect_client  # noqa: E402
+
+
+class SudoShell:
+    """
+    模拟PTY上的用户shell：回显输入的命令，按sudo的行为输出提示
+
+    banner为登录后已在缓冲区中的输出；delay秒后才输出对命令的响应；sudo_uid为sudo -i后id -u的结果
+    """
+
+    def __init__(self, password='secret', nopasswd=False, responds=True, banner=b'', delay=0.0, sudo_uid=0):
+        self.password = password
+        self.nopasswd = nopasswd
+        self.responds = responds
+        self.delay = delay
+        self.sudo_uid = sudo_uid
+        self.uid = 1000
+        self.closed = False
+        self.eof_received = False
+        self.buffer = bytearray(banner)
+        self.pending = []
+        self.sent = []
+
+    def recv_ready(self):
+        now = time.monotonic()
+        while self.pending and self.pending[0][0] <= now:
+            self.buffer += self.pending.pop(0)[1]
+        return bool(self.buffer)
+
+    def recv(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def send(self, data):
+        self.sent.append(data)
+        if not self.responds:
+            return len(data)
+        if data == SUDO_COMMAND:
+            output = SUDO_COMMAND.replace('\n', '\r\n').encode()
+            if self.nopasswd:
+                self.uid = self.sudo_uid
+                output += b'root@nas:~# '
+            else:
+                output += SUDO_PROMPT.encode()
+        elif data == PROBE_COMMAND:
+            output = PROBE_COMMAND.replace('\n', '\r\n').encode() + f'NASPT_UID:{self.uid}\r\nroot@nas:~# '.encode()
+        elif data == '\x03':
+            output = b'^C\r\nadmin@nas:~$ '
+        elif data == f'{self.password}\n':
+            self.uid = self.sudo_uid
+            output = b'\r\nroot@nas:~# '
+        else:
+            output = f'\r\nSorry, try again.\r\n{SUDO_PROMPT}'.encode()
+        self.pending.append((time.monotonic() + self.delay, output))
+        return len(data)
+
+
+def idle_select(readable, writable, exceptional, timeout):
+    time.sleep(min(timeout, 0.01))
+    return [], [], []
+
+
+def escalate(shell, password='secret', timeout=5.0):
+    return SudoEscalation(shell, password, select_func=idle_select, timeout=timeout).run()
+
+
+def test_password_sent_on_prompt():
+    shell = SudoShell()
+    result = escalate(shell)
+
+    assert result.success is True
+    assert shell.sent == [SUDO_COMMAND, 'secret\n', PROBE_COMMAND]
+    assert result.elapsed < 1
+    # 转发给终端的输出不含密码，提示替换为sudo默认的提示
+    assert b'secret' not in result.output
+    assert b'[sudo] password: ' in result.output and SUDO_PROMPT.encode() not in result.output
+    # 确认命令不出现在终端中，只留下一个root提示符
+    assert b'NASPT' not in result.output.replace(SUDO_COMMAND.strip().encode(), b'')
+    assert result.output.endswith(b'[sudo] password: \r\nroot@nas:~# ')
+    assert result.output.count(b'root@nas:~# ') == 1
+
+
+def test_nopasswd_sudo_needs_no_password():
+    shell = SudoShell(nopasswd=True)
+    assert escalate(shell).success is True
+    assert shell.sent == [SUDO_COMMAND, PROBE_COMMAND]
+
+
+def test_banner_line_ending_with_hash_is_not_a_root_prompt():
+    # 登录横幅的最后一行以#结尾，sudo的回显和提示稍后才到达
+    shell = SudoShell(banner=b'##########\r\n# Welcome to NAS #\r\n', delay=0.05)
+    result = escalate(shell)
+
+    assert result.success is True
+    assert shell.sent == [SUDO_COMMAND, 'secret\n', PROBE_COMMAND]
+    assert result.output.startswith(b'##########\r\n# Welcome to NAS #\r\n')
+
+
+def test_hash_prompt_without_root_fails():
+    # 提示符以#结尾，但id -u表明并没有成为root
+    shell = SudoShell(nopasswd=True, sudo_uid=1000)
+    result = escalate(shell)
+
+    assert result.success is False
+    assert shell.sent == [SUDO_COMMAND, PROBE_COMMAND, '\x03']
+
+
+def test_wrong_password_fails_and_cancels():
+    shell = SudoShell()
+    result = escalate(shell, password='wrong')
+
+    assert result.success is False
+    assert shell.sent == [SUDO_COMMAND, 'wrong\n', '\x03']
+
+
+def test_silent_shell_times_out():
+    result = escalate(SudoShell(responds=False), timeout=0.2)
+    assert result.success is None
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = bench_sshd.LocalSSHServer().start()
+    yield server
+    server.stop()
+
+
+def test_root_login_preferred(server):
+    client, username = connect_client(server.host, server.port, 'admin', bench_sshd.TEST_PASSWORD)
+    client.close()
+    assert username == 'root'
+
+
+def test_user_login_when_root_rejected(server, monkeypatch):
+    check = bench_sshd._ServerInterface.check_auth_password
+
+    def reject_root(self, username, password):
+        return bench_sshd.paramiko.AUTH_FAILED if username == 'root' else check(self, username, password)
+
+    monkeypatch.setattr(bench_sshd._ServerInterface, 'check_auth_password', reject_root)
+    client, username = connect_client(server.host, server.port, 'admin', bench_sshd.TEST_PASSWORD)
+    client.close()
+    assert username == 'admin'
+
+
+def test_pool_remembers_login_method(server):
+    pool = SSHTransportPool()
+    key = pool.make_key(server.host, server.port, 'admin')
+    lease = pool.acquire(server.host, server.port, 'admin', bench_sshd.TEST_PASSWORD)
+    try:
+        assert lease.username == 'root'
+        assert pool.login_methods[key] == 'root'
+    finally:
+        lease.release()
+        pool.close_all()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""ssh_input.InputWriter：远程窗口一直已满时按截止时间结束发送"""
+
+import time
+
+import pytest
+
+import ssh_input
+from ssh_input import InputWriter
+
+
+class StalledChannel:
+    """远程程序不读取输入：send_ready()在ready之前一直为False"""
+
+    def __init__(self):
+        self.closed = False
+        self.ready = False
+        self.data = bytearray()
+
+    def send_ready(self):
+        return self.ready
+
+    def send(self, chunk):
+        self.data += chunk
+        return len(chunk)
+
+
+def test_wait_sent_times_out_when_window_stays_full():
+    channel = StalledChannel()
+    writer = InputWriter(channel)
+    offset = writer.write('x' * 100)
+
+    start = time.monotonic()
+    assert writer.wait_sent(offset, timeout=0.1) is False
+    assert time.monotonic() - start < 1
+    assert writer.pending == 100
+
+    # 写入者已释放：窗口恢复后下一次发送把缓冲区中的数据写出
+    channel.ready = True
+    assert writer.wait_sent(offset, timeout=0.1) is True
+    assert bytes(channel.data) == b'x' * 100
+
+
+def test_flush_raises_after_deadline(monkeypatch):
+    monkeypatch.setattr(ssh_input, 'FLUSH_TIMEOUT', 0.05)
+    writer = InputWriter(StalledChannel())
+    writer.write('ls\n')
+
+    with pytest.raises(TimeoutError):
+        writer.flush()
+    assert writer.pending == 3
+    # 超时后其他调用方可以重新成为写入者
+    with pytest.raises(TimeoutError):
+        writer.flush(deadline=time.monotonic())
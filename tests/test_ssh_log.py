@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""ssh_log：默认不输出逐块的DEBUG日志，高频日志可采样，写入线程跟不上时丢弃而不阻塞调用方"""
+
+import logging
+import os
+import queue
+import subprocess
+import sys
+
+from ssh_log import SAMPLED, SamplingFilter, _DroppingQueueHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_logging(code, **env):
+    """在新进程中初始化日志（setup_logging每个进程只生效一次），返回stdout和stderr"""
+    env = dict(os.environ, **env)
+    for name in ('NASPT_LOG_LEVEL', 'NASPT_LOG_SAMPLE_EVERY'):
+        if name not in env or env[name] is None:
+            env.pop(name, None)
+    script = f"import sys\nsys.path.insert(0, {ROOT!r})\n{code}\nfrom ssh_log import shutdown_logging\nshutdown_logging()\n"
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, env=env, timeout=30)
+    assert result.returncode == 0, result.stderr
+    return result.stdout, result.stderr
+
+
+def test_debug_lines_off_by_default_and_sampling():
+    code = """
+from ssh_log import SAMPLED, get_logger
+logger = get_logger('ssh')
+logger.debug('chunk')
+for i in range(9):
+    logger.info('sampled %d', i, extra=SAMPLED)
+logger.info('connected')
+"""
+    stdout, _ = run_logging(code, NASPT_LOG_LEVEL=None, NASPT_LOG_SAMPLE_EVERY='3')
+    assert stdout.splitlines() == ['sampled 0', 'sampled 3', 'sampled 6', 'connected']
+
+    stdout, _ = run_logging(code, NASPT_LOG_LEVEL='debug', NASPT_LOG_SAMPLE_EVERY=None)
+    assert stdout.splitlines()[0] == 'chunk'
+    assert len(stdout.splitlines()) == 11
+
+
+def test_slow_output_does_not_block_callers():
+    code = """
+import time
+
+class SlowStream:
+    delay = 0.01
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return len(text)
+
+    def flush(self):
+        pass
+
+sys.stdout = SlowStream()
+from ssh_log import get_dropped_count, get_logger
+logger = get_logger('ssh')
+start = time.monotonic()
+for i in range(20000):
+    logger.info('line %d', i)
+elapsed = time.monotonic() - start
+sys.stderr.write(f'{elapsed} {get_dropped_count()}')
+# 队列仍是满的时退出：写出剩余的日志，不抛出queue.Full
+SlowStream.delay = 0
+"""
+    _, stderr = run_logging(code)
+    elapsed, dropped = stderr.split()
+    # 同步写入需要约200秒；这里只入队，队列满后丢弃
+    assert float(elapsed) < 5
+    assert int(dropped) > 0
+
+
+def test_sampling_filter_and_dropping_handler():
+    sampler = SamplingFilter(every=2)
+    sampled = [logging.makeLogRecord(dict(SAMPLED, msg='x')) for _ in range(4)]
+    assert [sampler.filter(record) for record in sampled] == [True, False, True, False]
+    assert sampler.filter(logging.makeLogRecord({'msg': 'y'})) is True
+
+    handler = _DroppingQueueHandler(queue.Queue(1))
+    handler.enqueue(sampled[0])
+    handler.enqueue(sampled[1])
+    assert handler.dropped == 1
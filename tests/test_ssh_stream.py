@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""ssh_stream：在测试SSH服务器的shell通道上，有数据时才唤醒，一次读取全部可用的数据"""
+
+import os
+import select
+import sys
+import threading
+import time
+
+import paramiko
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from bench_sshd import TEST_PASSWORD, LocalSSHServer  # noqa: E402
+from ssh_stream import (channel_finished, drain_channel, get_blocking_call, get_select,  # noqa: E402
+                        wait_channel_readable)
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = LocalSSHServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def channel(server):
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(server.host, server.port, username='naspt', password=TEST_PASSWORD, timeout=10)
+    channel = client.invoke_shell()
+    yield channel
+    client.close()
+
+
+def test_idle_channel_waits_until_timeout(channel):
+    start = time.monotonic()
+    assert wait_channel_readable(channel, timeout=0.2) is False
+    assert time.monotonic() - start >= 0.15
+
+    channel.sendall(b'ls\n')
+    assert wait_channel_readable(channel, timeout=5) is True
+    assert drain_channel(channel).startswith(b'ls')
+
+
+def test_drain_reads_everything_buffered(channel):
+    payload = os.urandom(200 * 1024)
+    channel.sendall(payload)
+    deadline = time.monotonic() + 5
+    while len(channel.in_buffer) < len(payload) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    # 一次唤醒读出全部数据，不受单次recv大小的限制；max_bytes限制单次读取量
+    assert drain_channel(channel, max_bytes=1000) == payload[:1000]
+    assert drain_channel(channel) == payload[1000:]
+    assert drain_channel(channel) == b''
+
+
+def test_eof_wakes_reader_and_finishes(channel):
+    channel.shutdown_write()
+    assert wait_channel_readable(channel, timeout=5) is True
+    deadline = time.monotonic() + 5
+    while not channel_finished(channel) and time.monotonic() < deadline:
+        wait_channel_readable(channel, timeout=0.1)
+        drain_channel(channel)
+    assert channel_finished(channel)
+
+
+def test_get_select():
+    from eventlet.green import select as green_select
+
+    assert get_select('eventlet') is green_select.select
+    assert get_select('threading') is select.select
+
+
+def test_blocking_call_uses_thread_pool_only_on_hub():
+    import eventlet
+
+    blocking_call = get_blocking_call('eventlet')
+    # hub调度的协程：在线程池中执行
+    assert eventlet.spawn(blocking_call, threading.get_ident).wait() != threading.get_ident()
+
+    # 没有hub的原生线程（asyncio模式的WSGI工作线程）：直接调用
+    results = []
+
+    def worker():
+        results.append(blocking_call(threading.get_ident) == threading.get_ident())
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == [True] * 4